@@ -0,0 +1,80 @@
+"""Broadcast microbenchmark.
+
+Compares sending the same message to many connections with cached
+serialisation and ``send_message`` (framing per connection) against
+:meth:`chitty.message.Message.send` (single pre-encoded frame per wire
+format written to each connection stream).
+
+Usage::
+
+    python benchmarks/bench_broadcast.py [connections] [rounds]
+"""
+
+import sys
+import time
+
+import trio
+import trio.testing
+from trio_websocket import wrap_client_stream, wrap_server_stream
+
+from chitty import codec
+from chitty.message import make_message
+
+
+class NullStream(trio.abc.SendStream):
+    """Send stream that discards everything written to it."""
+
+    async def send_all(self, data):
+        await trio.lowlevel.checkpoint()
+
+    async def wait_send_all_might_not_block(self):
+        await trio.lowlevel.checkpoint()
+
+    async def aclose(self):
+        await trio.lowlevel.checkpoint()
+
+
+async def open_connection(nursery):
+    client_stream, server_stream = trio.testing.memory_stream_pair()
+    nursery.start_soon(wrap_client_stream, nursery, client_stream, "bench", "/")
+    request = await wrap_server_stream(nursery, server_stream)
+    ws = await request.accept()
+    ws._stream = NullStream()
+    return ws
+
+
+async def per_connection(connections, rounds):
+    user = {"name": "bench"}
+    for n in range(rounds):
+        message = make_message(user, "general", f"message {n}")
+        for ws in connections:
+            await ws.send_message(message.encoded(codec.FORMAT_JSON))
+
+
+async def raw_frames(connections, rounds):
+    user = {"name": "bench"}
+    for n in range(rounds):
+        message = make_message(user, "general", f"message {n}")
+        for ws in connections:
+            await message.send(ws, codec.FORMAT_JSON)
+
+
+async def main(num_connections, rounds):
+    async with trio.open_nursery() as nursery:
+        connections = [await open_connection(nursery) for _ in range(num_connections)]
+        for name, fn in (("send_message", per_connection), ("raw frames", raw_frames)):
+            start = time.perf_counter()
+            await fn(connections, rounds)
+            elapsed = time.perf_counter() - start
+            sends = num_connections * rounds
+            print(
+                f"{name:>12}: {elapsed:.3f}s, {sends / elapsed:,.0f} sends/s, "
+                f"{elapsed / rounds * 1_000_000:.1f}us per message"
+            )
+        nursery.cancel_scope.cancel()
+
+
+if __name__ == "__main__":
+    num_connections = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    trio.run(main, num_connections, rounds)
@@ -0,0 +1,73 @@
+"""Content filter microbenchmark.
+
+Compares checking message texts against large banned term lists with
+single alternation regular expression, pure Python Aho-Corasick automaton
+(:class:`chitty.filters.Matcher`) and ``pyahocorasick`` automaton (if
+installed). Reports build time and per-message matching cost.
+
+Usage::
+
+    python benchmarks/bench_filter.py [terms] [messages]
+"""
+
+import random
+import re
+import string
+import sys
+import time
+
+from chitty import filters
+
+
+def random_word(rng, min_len=4, max_len=10):
+    return "".join(
+        rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_len, max_len))
+    )
+
+
+class RegexMatcher:
+    def __init__(self, terms):
+        pattern = "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+        self._re = re.compile(rf"(?<!\w)(?:{pattern})(?!\w)")
+
+    def find(self, text):
+        m = self._re.search(text)
+        return m.group(0) if m else None
+
+
+def run(name, factory, terms, texts):
+    started = time.perf_counter()
+    matcher = factory(terms)
+    build = time.perf_counter() - started
+    started = time.perf_counter()
+    blocked = sum(matcher.find(text) is not None for text in texts)
+    elapsed = time.perf_counter() - started
+    per_msg = elapsed / len(texts) * 1_000_000
+    print(
+        f"  {name:<14} build {build * 1000:8.1f} ms   "
+        f"{per_msg:8.2f} us/msg   blocked {blocked}"
+    )
+
+
+def main():
+    num_terms = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    num_messages = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    rng = random.Random(42)
+    terms = {random_word(rng) for _ in range(num_terms)}
+    vocabulary = [random_word(rng, 2, 8) for _ in range(2000)]
+    banned = sorted(terms)
+    texts = []
+    for i in range(num_messages):
+        words = rng.choices(vocabulary, k=rng.randint(5, 40))
+        if i % 20 == 0:
+            words.insert(rng.randrange(len(words)), rng.choice(banned))
+        texts.append(" ".join(words))
+    print(f"{len(terms)} terms, {num_messages} messages")
+    run("regex", RegexMatcher, terms, texts)
+    run("aho-corasick", filters.Matcher, terms, texts)
+    if filters.ahocorasick is not None:
+        run("pyahocorasick", filters.NativeMatcher, terms, texts)
+
+
+if __name__ == "__main__":
+    main()
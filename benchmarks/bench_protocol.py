@@ -0,0 +1,197 @@
+"""Protocol hot path microbenchmarks with regression check.
+
+Measures message routing, validation, normalisation, message building and
+serialisation, auth token handling and error response building, with
+small, medium and large payloads. Handler paths run against in-memory
+storage backend, so Redis is not needed.
+
+Results (best of repeats, nanoseconds per call) are compared with baseline
+stored in ``benchmarks/baseline.json``; script exits with status 1 if any
+benchmark is slower than its baseline by more than threshold percentage.
+Baseline is machine specific, refresh it with ``--save`` on reference
+machine when change in numbers is expected.
+
+Usage::
+
+    python benchmarks/bench_protocol.py [--save] [--threshold PCT] [-k NAME]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("CHITTY_SECRET_KEY", "benchmark")
+os.environ["CHITTY_STORAGE_BACKEND"] = "memory"
+
+import trio  # noqa: E402
+
+from chitty import controller, message  # noqa: E402
+from chitty.services.auth import check_token, get_token  # noqa: E402
+from chitty.user import User  # noqa: E402
+from chitty.utils import error_response  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+THRESHOLD = float(os.getenv("CHITTY_BENCH_THRESHOLD", "20"))
+
+REPEATS = 5
+TARGET_TIME = 0.05
+
+SIZES = {"small": 16, "medium": 512, "large": 16 * 1024}
+
+USER_DATA = {"name": "alice", "created": 1_600_000_000.0}
+
+
+def text(size):
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit".split()
+    out = []
+    length = 0
+    while length < size:
+        word = words[len(out) % len(words)]
+        out.append(word)
+        length += len(word) + 1
+    return " ".join(out)[:size]
+
+
+def measure(fn, number):
+    started = time.perf_counter()
+    fn(number)
+    return time.perf_counter() - started
+
+
+def calibrate(fn):
+    number = 1
+    while True:
+        elapsed = measure(fn, number)
+        if elapsed >= TARGET_TIME or number >= 1_000_000:
+            return number
+        number *= 2 if elapsed == 0 else max(2, int(TARGET_TIME / elapsed))
+
+
+def bench(fn):
+    """Run loop function and return best time per call in nanoseconds."""
+    number = calibrate(fn)
+    best = min(measure(fn, number) for _ in range(REPEATS))
+    return best / number * 1e9
+
+
+def sync_loop(fn, *args):
+    def loop(number):
+        for _ in range(number):
+            fn(*args)
+
+    return loop
+
+
+def async_loop(make_args, fn):
+    def loop(number):
+        async def run():
+            for _ in range(number):
+                await fn(*make_args())
+
+        trio.run(run)
+
+    return loop
+
+
+def cases():
+    token = get_token("alice")
+    yield "get_token", sync_loop(get_token, "alice")
+    yield "check_token", sync_loop(check_token, token)
+    yield "error_response", sync_loop(error_response, "E_REASON_MALFORMED", "error")
+    yield "validate_message", sync_loop(
+        controller.validate_message,
+        "reply",
+        {"to": "general", "value": "hi", "replyingTo": USER_DATA},
+    )
+
+    def normalise():
+        msg = {
+            "to": "general",
+            "value": "hi",
+            "replyingTo": USER_DATA,
+            "messageId": "1",
+        }
+        controller.normalise_message_fields(msg)
+
+    yield "normalise_message_fields", sync_loop(normalise)
+    user = User("alice")
+    for label, size in SIZES.items():
+        value = text(size)
+        yield f"make_message[{label}]", sync_loop(
+            message.make_message, USER_DATA, "general", value
+        )
+
+        def serialise(value=value):
+            msg = message.make_message(USER_DATA, "general", value)
+            return msg.serialised_payload
+
+        yield f"serialised_payload[{label}]", sync_loop(serialise)
+        yield f"route_message[msg,{label}]", async_loop(
+            lambda value=value: (
+                user,
+                {"type": "msg", "to": "general", "value": value},
+            ),
+            controller.route_message,
+        )
+    yield "route_message[typing]", async_loop(
+        lambda: (user, {"type": "typing", "to": "general"}), controller.route_message
+    )
+
+
+def load_baseline(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="store results as baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="allowed slowdown against baseline, in percent",
+    )
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("-k", dest="select", help="run only benchmarks containing NAME")
+    opts = parser.parse_args()
+    baseline = load_baseline(opts.baseline)
+    results = {}
+    regressions = []
+    for name, fn in cases():
+        if opts.select and opts.select not in name:
+            continue
+        result = results[name] = round(bench(fn), 1)
+        base = baseline.get(name)
+        if base:
+            change = (result - base) / base * 100
+            status = f"{change:+7.1f}%"
+            if change > opts.threshold:
+                status += "  REGRESSION"
+                regressions.append(name)
+        else:
+            status = "     new"
+        print(f"{name:<32} {result:12.0f} ns  {status}")
+    if opts.save:
+        baseline.update(results)
+        with open(opts.baseline, "w") as fp:
+            json.dump(dict(sorted(baseline.items())), fp, indent=2)
+            fp.write("\n")
+        print(f"baseline saved to {opts.baseline}")
+        return 0
+    if regressions:
+        print(
+            f"{len(regressions)} benchmarks regressed by more than "
+            f"{opts.threshold}%: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,8 +25,11 @@ def find_version(*where):
 
 base_reqs = [
     "trio",
-    "trio-websocket",
-    "redio",
+    # wsframes writes to trio-websocket connection and wsproto internals
+    "trio-websocket==0.12.2",
+    "wsproto==1.3.2",
+    # pubsub.TopicPubSub relies on redio PubSub internals
+    "redio==1.0.0",
     "falcon",
     "redis[hiredis]",
     "passlib[argon2]",
@@ -40,6 +43,16 @@ test_reqs = [
     "pytest-cov",
     "pytest-trio",
     "pytest-mock",
+    "msgpack",
+    "trustme",
+]
+
+msgpack_reqs = [
+    "msgpack",
+]
+
+filter_reqs = [
+    "pyahocorasick",
 ]
 
 docs_reqs = [
@@ -104,6 +117,8 @@ setup(
     extras_require={
         "dev": dev_reqs,
         "test": test_reqs,
+        "msgpack": msgpack_reqs,
+        "filter": filter_reqs,
         "docs": docs_reqs,
     },
     entry_points={
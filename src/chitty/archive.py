@@ -0,0 +1,483 @@
+"""Long-term message archive.
+
+Archiver runs as separate process (``chitty archive``) subscribed to all
+PubSub channels and stores every published message, except ephemeral ones,
+in append-only segment files, one series of segments per topic::
+
+    <root>/<quoted topic>/<start ms>.seg
+    <root>/<quoted topic>/<start ms>.idx
+
+Topic directory name is percent-encoded topic name, with leading dot
+encoded as well, so no topic maps to ``.``, ``..`` or a hidden directory.
+
+Segment is a sequence of zlib compressed blocks, one block per topic per
+flush. Block starts with fixed size header (magic, first and last message
+timestamp, record count, compressed length and CRC32), its content is a
+sequence of records (timestamp, length, serialised payload). Segments are
+rotated when they reach configured size or age, and new segment is started
+by each archiver process, so files are never modified once closed.
+
+Index file holds one fixed size entry per block (offset, first and last
+timestamp), so reader can skip blocks outside of requested time range
+without reading them. Block is written before its index entry; reader
+falls back to scanning block headers past the last index entry, so blocks
+are not lost if archiver is stopped between the two writes.
+
+:class:`ArchiveReader` opens segments through :mod:`mmap` and decompresses
+only blocks that overlap requested time range, one at a time.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import trio
+
+from . import codec
+from .message import EPHEMERAL_FIELD
+from .storage import redio_client
+
+ARCHIVE_DIR = os.getenv("CHITTY_ARCHIVE_DIR", "archive")
+SEGMENT_SIZE = int(os.getenv("CHITTY_ARCHIVE_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+SEGMENT_AGE = float(os.getenv("CHITTY_ARCHIVE_SEGMENT_AGE", "86400"))
+FLUSH_INTERVAL = float(os.getenv("CHITTY_ARCHIVE_FLUSH_INTERVAL", "1.0"))
+COMPRESSION_LEVEL = int(os.getenv("CHITTY_ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+SEGMENT_EXT = ".seg"
+INDEX_EXT = ".idx"
+
+BLOCK_MAGIC = b"CHA1"
+# magic, first timestamp, last timestamp, record count, data length, CRC32
+BLOCK_HEADER = struct.Struct(">4sddIII")
+# timestamp, payload length
+RECORD_HEADER = struct.Struct(">dI")
+# block offset, first timestamp, last timestamp
+INDEX_ENTRY = struct.Struct(">Qdd")
+
+# maximum length of file name on most file systems
+NAME_MAX = 255
+
+log = logging.getLogger(__name__)
+
+Record = Tuple[float, str]
+
+
+def topic_dir(root: str, topic: str) -> str:
+    """Build segment directory path of topic.
+
+    :param root: archive directory
+    :type root: str
+    :param topic: topic name
+    :type topic: str
+    :raises ValueError: if topic name can not be used as directory name
+    :return: directory path
+    :rtype: str
+    """
+    name = quote(topic, safe="")
+    if name.startswith("."):
+        name = "%2E" + name[1:]
+    if not name or len(name) > NAME_MAX:
+        raise ValueError(f"invalid archive topic name: {topic!r}")
+    return os.path.join(root, name)
+
+
+def encode_block(records: List[Record], level: int = COMPRESSION_LEVEL) -> bytes:
+    """Build compressed block from records.
+
+    :param records: pairs of message timestamp and serialised payload
+    :type records: List[Record]
+    :param level: zlib compression level, defaults to
+                  :data:`COMPRESSION_LEVEL`
+    :type level: int, optional
+    :return: block bytes
+    :rtype: bytes
+    """
+    parts = []
+    for timestamp, data in records:
+        raw = data.encode("utf-8")
+        parts.append(RECORD_HEADER.pack(timestamp, len(raw)))
+        parts.append(raw)
+    compressed = zlib.compress(b"".join(parts), level)
+    timestamps = [timestamp for timestamp, _ in records]
+    header = BLOCK_HEADER.pack(
+        BLOCK_MAGIC,
+        min(timestamps),
+        max(timestamps),
+        len(records),
+        len(compressed),
+        zlib.crc32(compressed),
+    )
+    return header + compressed
+
+
+def decode_block(data: bytes) -> Iterator[Record]:
+    """Iterate over records of decompressed block content.
+
+    :param data: decompressed block content
+    :type data: bytes
+    :yield: pairs of message timestamp and serialised payload
+    :rtype: Iterator[Record]
+    """
+    pos = 0
+    while pos < len(data):
+        timestamp, length = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        pos = start + length
+        yield timestamp, data[start:pos].decode("utf-8")
+
+
+@dataclass
+class SegmentWriter:
+    """Currently written segment of single topic."""
+
+    path: str
+    started: float
+    size: int = 0
+
+    @property
+    def index_path(self) -> str:
+        return self.path[: -len(SEGMENT_EXT)] + INDEX_EXT
+
+    def append(self, block: bytes, first: float, last: float) -> None:
+        with open(self.path, "ab") as fp:
+            fp.write(block)
+        with open(self.index_path, "ab") as fp:
+            fp.write(INDEX_ENTRY.pack(self.size, first, last))
+        self.size += len(block)
+
+
+class ArchiveWriter:
+    """Append-only segment writer.
+
+    :param root: archive directory, defaults to :data:`ARCHIVE_DIR`
+    :type root: str, optional
+    :param segment_size: segment size that triggers rotation, in bytes,
+                         defaults to :data:`SEGMENT_SIZE`
+    :type segment_size: int, optional
+    :param segment_age: segment age that triggers rotation, in seconds,
+                        defaults to :data:`SEGMENT_AGE`
+    :type segment_age: float, optional
+    :param level: zlib compression level, defaults to
+                  :data:`COMPRESSION_LEVEL`
+    :type level: int, optional
+    """
+
+    def __init__(
+        self,
+        root: str = ARCHIVE_DIR,
+        segment_size: int = SEGMENT_SIZE,
+        segment_age: float = SEGMENT_AGE,
+        level: int = COMPRESSION_LEVEL,
+    ):
+        self.root = root
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.level = level
+        self.segments: Dict[str, SegmentWriter] = {}
+
+    def _segment(self, topic: str, now: float) -> SegmentWriter:
+        segment = self.segments.get(topic)
+        if (
+            segment is None
+            or segment.size >= self.segment_size
+            or now - segment.started >= self.segment_age
+        ):
+            directory = topic_dir(self.root, topic)
+            os.makedirs(directory, exist_ok=True)
+            stamp = int(now * 1000)
+            path = os.path.join(directory, f"{stamp:015d}{SEGMENT_EXT}")
+            while os.path.exists(path):
+                stamp += 1
+                path = os.path.join(directory, f"{stamp:015d}{SEGMENT_EXT}")
+            segment = self.segments[topic] = SegmentWriter(path, now)
+        return segment
+
+    def write(
+        self, batch: Mapping[str, List[Record]], now: Optional[float] = None
+    ) -> int:
+        """Append records to topic segments, one block per topic.
+
+        :param batch: records grouped by topic
+        :type batch: Mapping[str, List[Record]]
+        :param now: current time, defaults to None
+        :type now: Optional[float], optional
+        :return: number of written records
+        :rtype: int
+        """
+        now = time.time() if now is None else now
+        count = 0
+        for topic, records in batch.items():
+            if not records:
+                continue
+            block = encode_block(records, self.level)
+            first = min(timestamp for timestamp, _ in records)
+            last = max(timestamp for timestamp, _ in records)
+            self._segment(topic, now).append(block, first, last)
+            count += len(records)
+        return count
+
+
+def _read_index(path: str) -> List[Tuple[int, float, float]]:
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+    except FileNotFoundError:
+        return []
+    size = INDEX_ENTRY.size
+    return [
+        INDEX_ENTRY.unpack_from(data, pos)
+        for pos in range(0, len(data) - size + 1, size)
+    ]
+
+
+def _scan_blocks(mm: mmap.mmap, offset: int) -> Iterator[Tuple[int, float, float]]:
+    while offset + BLOCK_HEADER.size <= len(mm):
+        magic, first, last, _, length, _ = BLOCK_HEADER.unpack_from(mm, offset)
+        if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + length > len(mm):
+            return
+        yield offset, first, last
+        offset += BLOCK_HEADER.size + length
+
+
+class ArchiveReader:
+    """Archive reader.
+
+    :param root: archive directory, defaults to :data:`ARCHIVE_DIR`
+    :type root: str, optional
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+
+    def topics(self) -> List[str]:
+        """List archived topics.
+
+        :rtype: List[str]
+        """
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            unquote(name)
+            for name in names
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))
+        )
+
+    def segments(self, topic: str) -> List[str]:
+        """List segment files of topic, from the oldest.
+
+        :param topic: topic name
+        :type topic: str
+        :rtype: List[str]
+        """
+        try:
+            directory = topic_dir(self.root, topic)
+            names = os.listdir(directory)
+        except (ValueError, FileNotFoundError):
+            return []
+        return [
+            os.path.join(directory, name)
+            for name in sorted(names)
+            if name.endswith(SEGMENT_EXT)
+        ]
+
+    def read(
+        self, topic: str, since: Optional[float] = None, until: Optional[float] = None
+    ) -> Iterator[Record]:
+        """Stream archived messages of topic from time range.
+
+        Messages are yielded in the order they were archived.
+
+        :param topic: topic name
+        :type topic: str
+        :param since: minimum message timestamp, defaults to None
+        :type since: Optional[float], optional
+        :param until: maximum message timestamp (exclusive), defaults to None
+        :type until: Optional[float], optional
+        :yield: pairs of message timestamp and serialised payload
+        :rtype: Iterator[Record]
+        """
+        lower = float("-inf") if since is None else since
+        upper = float("inf") if until is None else until
+        for path in self.segments(topic):
+            yield from self._read_segment(path, lower, upper)
+
+    def _read_segment(self, path: str, lower: float, upper: float) -> Iterator[Record]:
+        entries = _read_index(path[: -len(SEGMENT_EXT)] + INDEX_EXT)
+        with open(path, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                blocks = [
+                    entry
+                    for entry in entries
+                    if entry[0] + BLOCK_HEADER.size <= len(mm)
+                ]
+                end = 0
+                if blocks:
+                    offset = blocks[-1][0]
+                    end = offset + BLOCK_HEADER.size
+                    end += BLOCK_HEADER.unpack_from(mm, offset)[4]
+                blocks.extend(_scan_blocks(mm, end))
+                for offset, first, last in blocks:
+                    if last < lower or first >= upper:
+                        continue
+                    for timestamp, data in self._read_block(mm, offset):
+                        if lower <= timestamp < upper:
+                            yield timestamp, data
+
+    @staticmethod
+    def _read_block(mm: mmap.mmap, offset: int) -> Iterator[Record]:
+        magic, _, _, _, length, crc = BLOCK_HEADER.unpack_from(mm, offset)
+        start = offset + BLOCK_HEADER.size
+        end = start + length
+        compressed = mm[start:end]
+        if magic != BLOCK_MAGIC or zlib.crc32(compressed) != crc:
+            log.warning(f"corrupted archive block at {offset}")
+            return
+        yield from decode_block(zlib.decompress(compressed))
+
+
+def archive_record(topic: str, data: str, received: float) -> Optional[Record]:
+    """Build archive record from published message.
+
+    Message timestamp is taken from payload date, receive time is used if
+    payload has no date.
+
+    :param topic: PubSub channel name
+    :type topic: str
+    :param data: serialised message payload
+    :type data: str
+    :param received: time message was received
+    :type received: float
+    :return: archive record or None if message should not be archived
+    :rtype: Optional[Record]
+    """
+    try:
+        payload = codec.decode(data)
+    except codec.DecodeError:
+        return received, data
+    if isinstance(payload, dict):
+        if payload.get(EPHEMERAL_FIELD):
+            return None
+        date = payload.get("date")
+        if isinstance(date, (int, float)) and not isinstance(date, bool):
+            return float(date), data
+    return received, data
+
+
+class Archiver:
+    """Batching message archiver.
+
+    :param writer: segment writer
+    :type writer: ArchiveWriter
+    :param flush_interval: maximum time messages are buffered, in seconds,
+                           defaults to :data:`FLUSH_INTERVAL`
+    :type flush_interval: float, optional
+    """
+
+    def __init__(self, writer: ArchiveWriter, flush_interval: float = FLUSH_INTERVAL):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.pending: List[Tuple[str, str, float]] = []
+        self.archived = 0
+
+    def feed(self, topic: str, data: str) -> None:
+        """Buffer published message for archiving.
+
+        :param topic: PubSub channel name
+        :type topic: str
+        :param data: serialised message payload
+        :type data: str
+        """
+        self.pending.append((topic, data, time.time()))
+
+    async def flush(self) -> int:
+        """Write buffered messages to archive.
+
+        Messages of topics that were not written because of an error are
+        put back to the buffer and written by the next flush.
+
+        :return: number of archived messages
+        :rtype: int
+        """
+        batch, self.pending = self.pending, []
+        grouped: Dict[str, List[Record]] = {}
+        invalid = set()
+        for topic, data, received in batch:
+            if topic in invalid:
+                continue
+            if topic not in grouped:
+                try:
+                    topic_dir(self.writer.root, topic)
+                except ValueError:
+                    log.warning(f"not archiving messages of {topic!r}")
+                    invalid.add(topic)
+                    continue
+            record = archive_record(topic, data, received)
+            if record is not None:
+                grouped.setdefault(topic, []).append(record)
+        if not grouped:
+            return 0
+        written: Dict[str, int] = {}
+
+        def write():
+            for topic, records in grouped.items():
+                written[topic] = self.writer.write({topic: records})
+
+        try:
+            await trio.to_thread.run_sync(write)
+        except BaseException:
+            self.pending[:0] = [
+                item for item in batch if item[0] in grouped and item[0] not in written
+            ]
+            raise
+        finally:
+            count = sum(written.values())
+            self.archived += count
+        return count
+
+    async def receive(self, pubsub: Iterable) -> None:
+        """Feed messages received from PubSub receiver.
+
+        :param pubsub: receiver that yields channel and message pairs
+        :type pubsub: PubSub
+        """
+        async for topic, data in pubsub:  # type: ignore
+            self.feed(topic, data)
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED) -> None:
+        """Subscribe to all channels and archive messages until cancelled."""
+        pubsub = redio_client().pubsub().strdecode.with_channel.psubscribe("*")
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self.receive, pubsub)
+            task_status.started()
+            try:
+                while True:
+                    await trio.sleep(self.flush_interval)
+                    try:
+                        await self.flush()
+                    except Exception:
+                        log.exception("failed to write archive batch")
+            finally:
+                with trio.CancelScope(shield=True):
+                    await self.flush()
+
+
+async def main(root: str = ARCHIVE_DIR) -> None:
+    """Archiver entrypoint.
+
+    :param root: archive directory, defaults to :data:`ARCHIVE_DIR`
+    :type root: str, optional
+    """
+    logging.basicConfig(level=os.getenv("CHITTY_LOGLEVEL", "INFO"))
+    log.info(f"archiving messages to {root}")
+    archiver = Archiver(ArchiveWriter(root))
+    await archiver.run()
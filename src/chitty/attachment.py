@@ -0,0 +1,61 @@
+"""Attachment references.
+
+Files are uploaded to and downloaded from web service. Chat messages carry
+only small reference to uploaded file (its content hash and optional
+description), so file content never passes through chat server or Redis.
+"""
+
+import re
+from typing import Any, Dict, Union
+
+ATTACHMENT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+MAX_NAME_LENGTH = 255
+MAX_CONTENT_TYPE_LENGTH = 127
+
+
+def is_valid_id(value: Any) -> bool:
+    """Check if value is well formed attachment ID (hex SHA-256 digest).
+
+    :param value: value to check
+    :type value: Any
+    :return: validation result
+    :rtype: bool
+    """
+    return isinstance(value, str) and ATTACHMENT_ID_RE.match(value) is not None
+
+
+def make_reference(data: Any) -> Dict[str, Union[str, int]]:
+    """Build attachment reference from client supplied data.
+
+    Reference has required ``id`` and optional ``name``, ``size`` and
+    ``contentType`` fields, any other fields are dropped.
+
+    :param data: client supplied reference
+    :type data: Any
+    :raises ValueError: if reference is malformed
+    :return: attachment reference
+    :rtype: Dict[str, Union[str, int]]
+    """
+    if not isinstance(data, dict) or not is_valid_id(data.get("id")):
+        raise ValueError("attachment id is required")
+    ref: Dict[str, Union[str, int]] = {"id": data["id"]}
+    name = data.get("name")
+    if name is not None:
+        if not isinstance(name, str) or len(name) > MAX_NAME_LENGTH:
+            raise ValueError("invalid attachment name")
+        ref["name"] = name
+    size = data.get("size")
+    if size is not None:
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise ValueError("invalid attachment size")
+        ref["size"] = size
+    content_type = data.get("contentType")
+    if content_type is not None:
+        if (
+            not isinstance(content_type, str)
+            or len(content_type) > MAX_CONTENT_TYPE_LENGTH
+        ):
+            raise ValueError("invalid attachment content type")
+        ref["contentType"] = content_type
+    return ref
@@ -0,0 +1,319 @@
+"""Inbound traffic capture.
+
+When enabled with ``CHITTY_CAPTURE_FILE`` (or ``chitty run --capture``)
+server records connection events, inbound messages and handling results
+to gzip compressed JSON lines file, for replay with :mod:`chitty.replay`.
+
+First line is header object, every other line is one record array with
+event type, time in seconds since capture start and connection number:
+
+* ``["o", t, conn, user, fmt]`` - connection opened
+* ``["m", t, conn, payload]`` - decoded inbound message
+* ``["b", t, conn, size]`` - malformed inbound frame
+* ``["r", t, conn, latency_ms, error]`` - message handled
+* ``["c", t, conn]`` - connection closed
+
+User names are replaced with pseudonyms that are stable within capture,
+also in ``to`` field of direct messages and in reply recipient. Topic names
+in messages are kept, unless they are the name of connected user or of
+existing account (private topic), which is checked in batch on flush.
+Message text is replaced with placeholder of the same length.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+import trio
+
+from .message import (
+    MSG_TYPE_DIRECT_MESSAGE,
+    MSG_TYPE_MESSAGE,
+    MSG_TYPE_READ,
+    MSG_TYPE_REPLY,
+    MSG_TYPE_SUBSCRIBE_TOPIC,
+    MSG_TYPE_TYPING,
+    MSG_TYPE_UNSUBSCRIBE_TOPIC,
+)
+from .storage import storage
+from .topic import SYSTEM_TOPIC_PREFIX
+
+CAPTURE_FILE = os.getenv("CHITTY_CAPTURE_FILE")
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+CAPTURE_VERSION = 1
+
+EVENT_OPEN = "o"
+EVENT_MESSAGE = "m"
+EVENT_MALFORMED = "b"
+EVENT_RESULT = "r"
+EVENT_CLOSE = "c"
+
+TEXT_TYPES = {MSG_TYPE_MESSAGE, MSG_TYPE_REPLY, MSG_TYPE_DIRECT_MESSAGE}
+
+# message fields that hold topic name, by message type
+TOPIC_FIELDS = {
+    MSG_TYPE_SUBSCRIBE_TOPIC: "value",
+    MSG_TYPE_UNSUBSCRIBE_TOPIC: "value",
+    MSG_TYPE_MESSAGE: "to",
+    MSG_TYPE_REPLY: "to",
+    MSG_TYPE_TYPING: "to",
+    MSG_TYPE_READ: "to",
+}
+
+# maximum number of topic names remembered as account names or not
+ACCOUNT_CACHE_SIZE = 10000
+
+log = logging.getLogger(__name__)
+
+
+class TrafficCapture:
+    """Recorder of inbound traffic.
+
+    All recording methods are no-op unless capture is enabled.
+
+    :param path: capture file path, capture is disabled if None, defaults to
+                 ``CHITTY_CAPTURE_FILE``
+    :type path: Optional[str], optional
+    """
+
+    def __init__(self, path: Optional[str] = CAPTURE_FILE):
+        self.path: Optional[str] = None
+        self._buffer: List[Any] = []
+        self._connections: Dict[Any, int] = {}
+        self._users: Dict[int, str] = {}
+        self._accounts: Dict[str, bool] = {}
+        self._next_connection = 0
+        self._started = 0.0
+        self._salt = b""
+        if path:
+            self.enable(path)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def enable(self, path: str) -> None:
+        """Start capturing to file, header is written on first flush.
+
+        :param path: capture file path
+        :type path: str
+        """
+        self.path = path
+        self._started = time.monotonic()
+        self._salt = secrets.token_bytes(16)
+        header = {"version": CAPTURE_VERSION, "started": time.time()}
+        self._buffer = [header]
+        log.warning(f"capturing inbound traffic to {path}")
+
+    def pseudonym(self, name: str) -> str:
+        digest = hmac.new(self._salt, name.encode("utf-8"), hashlib.sha256)
+        return f"u{digest.hexdigest()[:12]}"
+
+    def _record(self, *fields: Any) -> None:
+        self._buffer.append(list(fields))
+
+    def _now(self) -> float:
+        return round(time.monotonic() - self._started, 6)
+
+    def opened(self, ws: Any, user: str, fmt: str) -> None:
+        """Record new connection.
+
+        :param ws: connection object
+        :type ws: Any
+        :param user: user name
+        :type user: str
+        :param fmt: connection wire format
+        :type fmt: str
+        """
+        if not self.enabled:
+            return
+        conn = self._connections[ws] = self._next_connection
+        self._next_connection += 1
+        self._users[conn] = user
+        self._record(EVENT_OPEN, self._now(), conn, self.pseudonym(user), fmt)
+
+    def closed(self, ws: Any) -> None:
+        """Record closed connection.
+
+        :param ws: connection object
+        :type ws: Any
+        """
+        conn = self._connections.pop(ws, None)
+        if conn is not None:
+            self._users.pop(conn, None)
+            self._record(EVENT_CLOSE, self._now(), conn)
+
+    def message(self, ws: Any, payload: Mapping[str, Any]) -> None:
+        """Record decoded inbound message.
+
+        :param ws: connection object
+        :type ws: Any
+        :param payload: message
+        :type payload: Mapping[str, Any]
+        """
+        conn = self._connections.get(ws)
+        if conn is not None:
+            data = self.scrub(payload, self._users.get(conn))
+            self._record(EVENT_MESSAGE, self._now(), conn, data)
+
+    def malformed(self, ws: Any, size: int) -> None:
+        """Record inbound frame that could not be decoded.
+
+        :param ws: connection object
+        :type ws: Any
+        :param size: frame size
+        :type size: int
+        """
+        conn = self._connections.get(ws)
+        if conn is not None:
+            self._record(EVENT_MALFORMED, self._now(), conn, size)
+
+    def result(self, ws: Any, received: float, error: bool) -> None:
+        """Record message handling outcome.
+
+        :param ws: connection object
+        :type ws: Any
+        :param received: monotonic time when message was received
+        :type received: float
+        :param error: flag whether error response was sent
+        :type error: bool
+        """
+        conn = self._connections.get(ws)
+        if conn is not None:
+            latency = round((time.monotonic() - received) * 1000, 3)
+            self._record(EVENT_RESULT, self._now(), conn, latency, int(error))
+
+    def scrub(
+        self, payload: Mapping[str, Any], user: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Remove personal data from message.
+
+        Topic field is replaced if it is the name of sending user, names of
+        other accounts are replaced on flush.
+
+        :param payload: message
+        :type payload: Mapping[str, Any]
+        :param user: name of sending user, defaults to None
+        :type user: Optional[str], optional
+        :rtype: Dict[str, Any]
+        """
+        data = dict(payload)
+        msg_type = data.get("type")
+        field_name = TOPIC_FIELDS.get(msg_type)  # type: ignore
+        if field_name is not None and user is not None and data.get(field_name) == user:
+            data[field_name] = self.pseudonym(user)
+        if msg_type in TEXT_TYPES and isinstance(data.get("value"), str):
+            data["value"] = "x" * len(data["value"])
+        if msg_type == MSG_TYPE_DIRECT_MESSAGE:
+            to = data.get("to")
+            if isinstance(to, str):
+                data["to"] = self.pseudonym(to)
+            elif isinstance(to, list):
+                data["to"] = [
+                    self.pseudonym(name) if isinstance(name, str) else name
+                    for name in to
+                ]
+        replying_to = data.get("replyingTo")
+        if isinstance(replying_to, dict) and isinstance(replying_to.get("name"), str):
+            data["replyingTo"] = {"name": self.pseudonym(replying_to["name"])}
+        return data
+
+    def _topic_names(self, records: List[Any]) -> List[str]:
+        names = set()
+        for record in records:
+            if not isinstance(record, dict) and record[0] == EVENT_MESSAGE:
+                payload = record[3]
+                name = payload.get(TOPIC_FIELDS.get(payload.get("type")))
+                if isinstance(name, str) and not name.startswith(SYSTEM_TOPIC_PREFIX):
+                    names.add(name)
+        return sorted(names)
+
+    async def _accounts_of(self, names: List[str]) -> Dict[str, bool]:
+        unknown = [name for name in names if name not in self._accounts]
+        if unknown:
+            if len(self._accounts) + len(unknown) > ACCOUNT_CACHE_SIZE:
+                self._accounts.clear()
+            try:
+                exist = await storage.users_exist(unknown)
+            except Exception:
+                log.exception("capture account lookup failed")
+                # names that can not be checked are not written in clear
+                return {name: self._accounts.get(name, True) for name in names}
+            self._accounts.update(zip(unknown, exist))
+        return {name: self._accounts[name] for name in names}
+
+    def _serialise(self, record: Any, accounts: Mapping[str, bool]) -> str:
+        if isinstance(record, dict):
+            return json.dumps(record)
+        if record[0] == EVENT_MESSAGE:
+            payload = record[3]
+            field_name = TOPIC_FIELDS.get(payload.get("type"))
+            if accounts.get(payload.get(field_name)):  # type: ignore
+                payload[field_name] = self.pseudonym(payload[field_name])
+        return json.dumps(record, separators=(",", ":"), default=str)
+
+    def _write(self, lines: List[str]) -> None:
+        with gzip.open(self.path, "at", encoding="utf-8") as fp:  # type: ignore
+            fp.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> int:
+        """Append buffered records to capture file.
+
+        :return: number of written lines
+        :rtype: int
+        """
+        if not self._buffer:
+            return 0
+        records, self._buffer = self._buffer, []
+        accounts = await self._accounts_of(self._topic_names(records))
+        lines = [self._serialise(record, accounts) for record in records]
+        await trio.to_thread.run_sync(self._write, lines)
+        return len(lines)
+
+    async def run(self) -> None:
+        """Background task that periodically writes captured records."""
+        if not self.enabled:
+            return
+        try:
+            while True:
+                await trio.sleep(CAPTURE_FLUSH_INTERVAL)
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("capture flush failed")
+        finally:
+            with trio.CancelScope(shield=True):
+                await self.flush()
+
+
+def read_capture(path: str):
+    """Read capture file.
+
+    :param path: capture file path
+    :type path: str
+    :return: header and iterator of records
+    :rtype: Tuple[Dict[str, Any], Iterator[List[Any]]]
+    """
+    fp = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(fp.readline())
+    if header.get("version") != CAPTURE_VERSION:
+        fp.close()
+        raise ValueError(f"unsupported capture version {header.get('version')}")
+
+    def records():
+        with fp:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, records()
+
+
+capture = TrafficCapture()
@@ -1,16 +1,11 @@
 import functools
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
 
-import trio
-from dotenv import find_dotenv, load_dotenv
-
-load_dotenv(find_dotenv())
-
 
 def parse_args() -> Namespace:
     parser_kw = {"formatter_class": ArgumentDefaultsHelpFormatter}
     parser = ArgumentParser(description="Chitty chat server management")
-    subparsers = parser.add_subparsers(help="Available commands")
+    subparsers = parser.add_subparsers(help="Available commands", dest="command")
     run_parser = subparsers.add_parser("run", help="Launch the server", **parser_kw)
     run_parser.add_argument(
         "-H", "--host", default="127.0.0.1", help="IP address to bind to"
@@ -18,18 +13,133 @@ def parse_args() -> Namespace:
     run_parser.add_argument(
         "-p", "--port", type=int, default=5000, help="port number to bind to"
     )
+    run_parser.add_argument(
+        "--certfile", help="[optional] PEM certificate chain file, enables TLS"
+    )
+    run_parser.add_argument(
+        "--keyfile",
+        help="[optional] PEM private key file, if not included in certificate file",
+    )
+    run_parser.add_argument(
+        "--tls-tickets",
+        type=int,
+        default=None,
+        help="number of TLS 1.3 session tickets issued to client",
+    )
+    run_parser.add_argument(
+        "--ticket-key-file",
+        help=(
+            "[optional] file with 80 bytes of session ticket keys shared by all"
+            " nodes, enables session resumption across nodes and restarts"
+            " (requires CHITTY_TLS_CTYPES_TICKET_KEYS=1)"
+        ),
+    )
     run_parser.add_argument(
         "-i",
         "--instrument",
         help="[optional] name of instrumentation class from debug module",
     )
+    run_parser.add_argument(
+        "--capture",
+        help=(
+            "[optional] record inbound traffic to this file"
+            " (default: CHITTY_CAPTURE_FILE)"
+        ),
+    )
+    index_parser = subparsers.add_parser(
+        "index", help="Launch message search indexer", **parser_kw
+    )
+    index_parser.add_argument(
+        "--db",
+        help="[optional] search database path (default: CHITTY_SEARCH_DB or search.db)",
+    )
+    archive_parser = subparsers.add_parser(
+        "archive", help="Launch message archiver", **parser_kw
+    )
+    archive_parser.add_argument(
+        "--dir",
+        help="[optional] archive directory (default: CHITTY_ARCHIVE_DIR or archive)",
+    )
+    replay_parser = subparsers.add_parser(
+        "replay", help="Replay captured traffic against server", **parser_kw
+    )
+    replay_parser.add_argument("file", help="capture file")
+    replay_parser.add_argument(
+        "--url", default="ws://127.0.0.1:5000", help="server URL"
+    )
+    replay_parser.add_argument(
+        "--speed", choices=["1", "10", "max"], default="1", help="replay speed"
+    )
+    replay_parser.add_argument(
+        "--create-users",
+        action="store_true",
+        help="create accounts for captured users in server storage first",
+    )
     return parser.parse_args()
 
 
+def run_indexer(opts: Namespace) -> None:
+    import trio
+
+    from . import indexer
+
+    try:
+        trio.run(indexer.main, opts.db or indexer.SEARCH_DB)
+    except KeyboardInterrupt:
+        print()
+
+
+def run_archiver(opts: Namespace) -> None:
+    import trio
+
+    from . import archive
+
+    try:
+        trio.run(archive.main, opts.dir or archive.ARCHIVE_DIR)
+    except KeyboardInterrupt:
+        print()
+
+
+def run_replay(opts: Namespace) -> None:
+    import trio
+
+    from . import replay
+
+    capture = replay.load_capture(opts.file)
+    if opts.create_users:
+        created = replay.create_users(capture.users)
+        print(f"Created {created} user accounts")
+    try:
+        stats = trio.run(replay.main, capture, opts.url, opts.speed)
+    except KeyboardInterrupt:
+        print()
+        return
+    print(replay.format_report(capture, stats, opts.speed))
+
+
 def run() -> None:
-    from . import debug, server
+    # environment is loaded before importing modules that read it at import
+    from dotenv import find_dotenv, load_dotenv
 
+    load_dotenv(find_dotenv())
     opts = parse_args()
+    if opts.command == "index":
+        run_indexer(opts)
+        return
+    if opts.command == "archive":
+        run_archiver(opts)
+        return
+    if opts.command == "replay":
+        run_replay(opts)
+        return
+    import trio
+
+    from . import debug, server
+
+    if opts.capture:
+        from .capture import capture
+
+        capture.enable(opts.capture)
     kw = {}
     if opts.instrument:
         instrument_cls = getattr(debug, opts.instrument, None)
@@ -37,8 +147,21 @@ def run() -> None:
             print(f"Instrumentation class {opts.instrument} not found")
         else:
             print(f"Running with instrumentation {opts.instrument}")
-            kw["instruments"] = [instrument_cls()]
-    entrypoint = functools.partial(server.main, host=opts.host, port=opts.port)
+            instrument = instrument_cls()
+            if hasattr(instrument, "install_signal_handler"):
+                instrument.install_signal_handler()
+            kw["instruments"] = [instrument]
+    ssl_context = None
+    if opts.certfile:
+        from . import tls
+
+        tls_kw = {"ticket_key_file": opts.ticket_key_file}
+        if opts.tls_tickets is not None:
+            tls_kw["num_tickets"] = opts.tls_tickets
+        ssl_context = tls.make_server_context(opts.certfile, opts.keyfile, **tls_kw)
+    entrypoint = functools.partial(
+        server.main, host=opts.host, port=opts.port, ssl_context=ssl_context
+    )
     try:
         trio.run(entrypoint, **kw)
     except KeyboardInterrupt:
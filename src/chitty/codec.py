@@ -0,0 +1,102 @@
+"""Wire format encoding for WebSocket clients.
+
+Clients select wire format with WebSocket subprotocol header. JSON text
+frames are the default, MessagePack binary frames are available if
+``msgpack`` package is installed.
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+
+SUBPROTOCOL_JSON = "chitty.json"
+SUBPROTOCOL_MSGPACK = "chitty.msgpack"
+
+SUBPROTOCOLS = {
+    SUBPROTOCOL_JSON: FORMAT_JSON,
+    SUBPROTOCOL_MSGPACK: FORMAT_MSGPACK,
+}
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def available_formats() -> Tuple[str, ...]:
+    if msgpack is None:
+        return (FORMAT_JSON,)
+    return (FORMAT_JSON, FORMAT_MSGPACK)
+
+
+def negotiate(proposed: Iterable[str]) -> Tuple[Optional[str], str]:
+    """Select wire format from subprotocols proposed by client.
+
+    First supported subprotocol wins. If client did not propose any known
+    subprotocol then JSON is used and no subprotocol is confirmed.
+
+    :param proposed: subprotocols from client handshake request
+    :type proposed: Iterable[str]
+    :return: subprotocol to confirm and selected format
+    :rtype: Tuple[Optional[str], str]
+    """
+    formats = available_formats()
+    for subprotocol in proposed:
+        fmt = SUBPROTOCOLS.get(subprotocol)
+        if fmt in formats:
+            return subprotocol, fmt
+    return None, FORMAT_JSON
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.timestamp()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serialisable")
+
+
+def encode(data: Any, fmt: str = FORMAT_JSON) -> Union[str, bytes]:
+    """Encode data in specified wire format.
+
+    JSON is encoded to text, MessagePack to bytes.
+
+    :param data: serialisable data structure
+    :type data: Any
+    :param fmt: wire format, defaults to ``json``
+    :type fmt: str, optional
+    :return: encoded data
+    :rtype: Union[str, bytes]
+    """
+    if fmt == FORMAT_MSGPACK:
+        return msgpack.packb(data, default=_default)
+    return json.dumps(data, default=_default)
+
+
+def decode(frame: Union[str, bytes]) -> Any:
+    """Decode WebSocket frame content.
+
+    Text frames are always decoded as JSON, binary frames as MessagePack.
+
+    :param frame: frame content
+    :type frame: Union[str, bytes]
+    :raises DecodeError: if frame content can not be decoded
+    :return: decoded data
+    :rtype: Any
+    """
+    if isinstance(frame, str):
+        try:
+            return json.loads(frame)
+        except json.JSONDecodeError as e:
+            raise DecodeError(str(e)) from e
+    if msgpack is None:
+        raise DecodeError("Binary frames are not supported")
+    try:
+        return msgpack.unpackb(frame)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise DecodeError(str(e)) from e
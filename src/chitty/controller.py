@@ -1,14 +1,18 @@
-from typing import Mapping, MutableMapping, Optional, Union
+from typing import Callable, List, Mapping, MutableMapping, Optional, Union
 
-from . import handlers
+from . import handlers, tracing
 from .errors import MessageFormatError, MessageRoutingError
+from .filters import content_filter
 from .message import (
     KNOWN_MSG_TYPES,
     MSG_FIELDS,
     MSG_TYPE_DIRECT_MESSAGE,
     MSG_TYPE_MESSAGE,
+    MSG_TYPE_READ,
     MSG_TYPE_REPLY,
     MSG_TYPE_SUBSCRIBE_TOPIC,
+    MSG_TYPE_TYPING,
+    MSG_TYPE_UNSUBSCRIBE_TOPIC,
 )
 from .user import User
 
@@ -16,9 +20,21 @@ MSG_HANDLERS = {
     MSG_TYPE_MESSAGE: handlers.post_message,
     MSG_TYPE_REPLY: handlers.post_reply_message,
     MSG_TYPE_SUBSCRIBE_TOPIC: handlers.subscribe,
+    MSG_TYPE_UNSUBSCRIBE_TOPIC: handlers.unsubscribe,
     MSG_TYPE_DIRECT_MESSAGE: handlers.direct_message,
+    MSG_TYPE_TYPING: handlers.typing_indicator,
+    MSG_TYPE_READ: handlers.mark_read,
 }
 
+MessageFilter = Callable[
+    [User, str, Mapping[str, Union[str, int]]], Optional[Mapping[str, object]]
+]
+
+# Filter stages run on validated and normalised messages before handler, in
+# order. First stage that returns a response rejects the message, and that
+# response is sent back to sender instead of handler result.
+MESSAGE_FILTERS: List[MessageFilter] = [content_filter.stage]
+
 
 def validate_message(
     msg_type: str, message: Mapping[str, Union[str, int, float]]
@@ -49,9 +65,10 @@ def normalise_message_fields(message: MutableMapping[str, str | int]) -> None:
     :param message: message structure
     :type message: MutableMapping[str, str | int]
     """
-    invalid = {"replyingTo"}
+    invalid = {"replyingTo", "messageId"}
     subst = {
         "replyingTo": "replying_to",
+        "messageId": "message_id",
     }
     to_subst = set(message.keys()).intersection(invalid)
     for key in to_subst:
@@ -60,6 +77,25 @@ def normalise_message_fields(message: MutableMapping[str, str | int]) -> None:
         del message[key]
 
 
+def message_lane(message: Mapping[str, Union[str, int]]) -> str:
+    """Get ordering lane key of message.
+
+    Messages are ordered per target topic (or recipient), that is ``to``
+    field, or ``value`` for subscription changes. Messages without valid target
+    share single lane.
+
+    :param message: message contents
+    :type message: Mapping[str, Union[str, int]]
+    :return: lane key
+    :rtype: str
+    """
+    if message.get("type") in (MSG_TYPE_SUBSCRIBE_TOPIC, MSG_TYPE_UNSUBSCRIBE_TOPIC):
+        target = message.get("value")
+    else:
+        target = message.get("to")
+    return target if isinstance(target, str) else ""
+
+
 async def route_message(
     user: User, msg: MutableMapping[str, Union[str, int]]
 ) -> Optional[dict]:
@@ -80,5 +116,10 @@ async def route_message(
     if not validate_message(msg_type, msg):
         raise MessageFormatError("Invalid message format")
     normalise_message_fields(msg)
+    for message_filter in MESSAGE_FILTERS:
+        rejection = message_filter(user, msg_type, msg)
+        if rejection is not None:
+            return rejection  # type: ignore
     handler = MSG_HANDLERS[msg_type]
+    tracing.tracer.hop(tracing.current_trace.get(), tracing.HOP_ROUTE, type=msg_type)
     return await handler(user, **msg)
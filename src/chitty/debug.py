@@ -1,6 +1,18 @@
+import logging
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
 from trio.abc import Instrument
 from trio.lowlevel import Task
 
+log = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = 32
+
 
 class TaskLogger(Instrument):
     """Simple instrumentation object that traces Trio task execution."""
@@ -13,3 +25,209 @@ class TaskLogger(Instrument):
 
     def after_task_step(self, task: Task):
         print(f"after task step: {task.name}")
+
+
+def _bucket(value: float) -> int:
+    """Find power-of-two histogram bucket for duration given in seconds.
+
+    Bucket ``n`` collects durations in range ``[2**(n-1), 2**n)`` microseconds,
+    bucket 0 holds anything below 1 microsecond.
+    """
+    return min(int(value * 1_000_000).bit_length(), HISTOGRAM_BUCKETS - 1)
+
+
+def _percentile(histogram: List[int], count: int, pct: float) -> float:
+    """Approximate percentile from power-of-two histogram, in seconds.
+
+    Returned value is upper bound of the bucket that contains requested
+    percentile.
+    """
+    if not count:
+        return 0.0
+    threshold = count * pct
+    running = 0
+    for index, bucket_count in enumerate(histogram):
+        running += bucket_count
+        if running >= threshold:
+            return (1 << index) / 1_000_000
+    return (1 << (len(histogram) - 1)) / 1_000_000
+
+
+@dataclass
+class TaskStats:
+    """Aggregated scheduler statistics for all tasks sharing the same name.
+
+    :ivar steps: number of task steps executed
+    :type steps: int
+    :ivar cpu_time: total CPU time spent in task steps, in seconds
+    :type cpu_time: float
+    :ivar max_step: longest single step wall time, in seconds
+    :type max_step: float
+    :ivar slow_steps: number of steps that exceeded slow step threshold
+    :type slow_steps: int
+    :ivar max_delay: longest delay between scheduling and running, in seconds
+    :type max_delay: float
+    """
+
+    steps: int = 0
+    cpu_time: float = 0.0
+    max_step: float = 0.0
+    slow_steps: int = 0
+    max_delay: float = 0.0
+    step_histogram: List[int] = field(
+        default_factory=lambda: [0] * HISTOGRAM_BUCKETS, repr=False
+    )
+    delay_histogram: List[int] = field(
+        default_factory=lambda: [0] * HISTOGRAM_BUCKETS, repr=False
+    )
+    delays: int = field(default=0, repr=False)
+
+    def summary(self) -> str:
+        mean_cpu = self.cpu_time / self.steps if self.steps else 0.0
+        step_p99 = _percentile(self.step_histogram, self.steps, 0.99)
+        delay_p50 = _percentile(self.delay_histogram, self.delays, 0.5)
+        delay_p99 = _percentile(self.delay_histogram, self.delays, 0.99)
+        return (
+            f"steps={self.steps} cpu={self.cpu_time * 1000:.3f}ms "
+            f"cpu/step={mean_cpu * 1_000_000:.1f}us "
+            f"step_p99<={step_p99 * 1000:.3f}ms max_step={self.max_step * 1000:.3f}ms "
+            f"slow={self.slow_steps} delay_p50<={delay_p50 * 1000:.3f}ms "
+            f"delay_p99<={delay_p99 * 1000:.3f}ms "
+            f"max_delay={self.max_delay * 1000:.3f}ms"
+        )
+
+
+class TaskProfiler(Instrument):
+    """Aggregating scheduler profiler.
+
+    Instead of printing every scheduler event this instrument collects per
+    task name step counts, CPU time spent in steps and scheduling delay
+    (time between task being rescheduled and actually run) into power-of-two
+    histograms. Every step that blocks the event loop for longer than
+    threshold is logged with task name.
+
+    Report is logged periodically (if interval is set), on ``SIGUSR1`` once
+    :meth:`install_signal_handler` is called, or on demand with
+    :meth:`report`.
+
+    Default configuration is read from environment: ``CHITTY_PROFILER_SLOW_MS``
+    (slow step threshold in milliseconds, default 50) and
+    ``CHITTY_PROFILER_REPORT_INTERVAL`` (report interval in seconds, 0
+    disables periodic reports, default 60).
+
+    :param slow_step: slow step threshold in seconds, defaults to None
+    :type slow_step: Optional[float], optional
+    :param report_interval: periodic report interval in seconds, defaults
+                            to None
+    :type report_interval: Optional[float], optional
+    """
+
+    def __init__(
+        self,
+        slow_step: Optional[float] = None,
+        report_interval: Optional[float] = None,
+    ):
+        if slow_step is None:
+            slow_step = float(os.getenv("CHITTY_PROFILER_SLOW_MS", "50")) / 1000
+        if report_interval is None:
+            report_interval = float(
+                os.getenv("CHITTY_PROFILER_REPORT_INTERVAL", "60")
+            )
+        self.slow_step = slow_step
+        self.report_interval = report_interval
+        self.stats: Dict[str, TaskStats] = {}
+        self._scheduled: Dict[Task, float] = {}
+        self._running: Optional[Tuple[Task, float, float]] = None
+        self._next_report = time.perf_counter() + report_interval
+        self._report_requested = False
+
+    def install_signal_handler(self) -> bool:
+        """Log report on ``SIGUSR1``, replacing its current handler.
+
+        Handler is installed only in main thread of platforms that have
+        ``SIGUSR1``.
+
+        :return: True if handler was installed
+        :rtype: bool
+        """
+        if threading.current_thread() is not threading.main_thread() or not hasattr(
+            signal, "SIGUSR1"
+        ):
+            return False
+        signal.signal(signal.SIGUSR1, self._on_signal)
+        return True
+
+    def _on_signal(self, signum, frame):
+        self._report_requested = True
+
+    def _stats_for(self, task: Task) -> TaskStats:
+        stats = self.stats.get(task.name)
+        if stats is None:
+            stats = self.stats[task.name] = TaskStats()
+        return stats
+
+    def task_scheduled(self, task: Task):
+        self._scheduled[task] = time.perf_counter()
+
+    def before_task_step(self, task: Task):
+        now = time.perf_counter()
+        scheduled_at = self._scheduled.pop(task, None)
+        if scheduled_at is not None:
+            delay = now - scheduled_at
+            stats = self._stats_for(task)
+            stats.delays += 1
+            stats.delay_histogram[_bucket(delay)] += 1
+            if delay > stats.max_delay:
+                stats.max_delay = delay
+        self._running = (task, now, time.thread_time())
+
+    def after_task_step(self, task: Task):
+        if self._running is None or self._running[0] is not task:
+            return
+        _, started, cpu_started = self._running
+        self._running = None
+        now = time.perf_counter()
+        duration = now - started
+        stats = self._stats_for(task)
+        stats.steps += 1
+        stats.cpu_time += time.thread_time() - cpu_started
+        stats.step_histogram[_bucket(duration)] += 1
+        if duration > stats.max_step:
+            stats.max_step = duration
+        if duration > self.slow_step:
+            stats.slow_steps += 1
+            log.warning(
+                f"task {task.name} blocked event loop for {duration * 1000:.1f}ms"
+            )
+        if self._report_requested or (
+            self.report_interval and now >= self._next_report
+        ):
+            self._report_requested = False
+            self._next_report = now + self.report_interval
+            self.report()
+
+    def task_exited(self, task: Task):
+        self._scheduled.pop(task, None)
+
+    def report(self, reset: bool = False) -> str:
+        """Log and return aggregated statistics report.
+
+        Task names are sorted by total CPU time, most expensive first.
+
+        :param reset: flag whether collected statistics should be cleared
+                      after reporting, defaults to False
+        :type reset: bool, optional
+        :return: report text
+        :rtype: str
+        """
+        lines = ["trio task profile:"]
+        ordered = sorted(
+            self.stats.items(), key=lambda item: item[1].cpu_time, reverse=True
+        )
+        for name, stats in ordered:
+            lines.append(f"  {name}: {stats.summary()}")
+        text = "\n".join(lines)
+        log.info(text)
+        if reset:
+            self.stats.clear()
+        return text
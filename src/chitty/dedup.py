@@ -0,0 +1,83 @@
+import os
+import time
+from collections import OrderedDict
+
+from . import keys
+from .storage import storage
+
+DEDUP_TTL = int(os.getenv("CHITTY_DEDUP_TTL", "300"))
+DEDUP_CACHE_SIZE = int(os.getenv("CHITTY_DEDUP_CACHE_SIZE", "10000"))
+
+MAX_MESSAGE_ID_LENGTH = 128
+
+
+class DedupCache:
+    """Short-lived registry of client supplied message IDs.
+
+    Recently seen IDs are kept in bounded local LRU cache, so retries that
+    come to the same node do not cost Redis round trip. Retries that land on
+    another node are caught by Redis key set with ``SET NX EX`` that expires
+    after ``ttl`` seconds. ID of message that failed is released with
+    :meth:`release`, so client can retry it.
+
+    :param ttl: how long message ID is remembered, in seconds
+    :type ttl: int
+    :param maxsize: maximum number of locally cached IDs
+    :type maxsize: int
+    """
+
+    def __init__(self, ttl: int = DEDUP_TTL, maxsize: int = DEDUP_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._local: OrderedDict[str, float] = OrderedDict()
+
+    def _seen_locally(self, key: str, now: float) -> bool:
+        expires = self._local.get(key)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._local[key]
+            return False
+        self._local.move_to_end(key)
+        return True
+
+    def _remember(self, key: str, now: float) -> None:
+        self._local[key] = now + self.ttl
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    async def is_duplicate(self, sender: str, message_id: str) -> bool:
+        """Check if message with this ID has already been sent by user.
+
+        The first call for given sender and message ID registers it and
+        returns False, subsequent calls within TTL return True.
+
+        :param sender: sender user name
+        :type sender: str
+        :param message_id: client supplied message ID
+        :type message_id: str
+        :return: True if message is a duplicate
+        :rtype: bool
+        """
+        key = f"{keys.DEDUP}:{sender}:{message_id}"
+        now = time.monotonic()
+        if self._seen_locally(key, now):
+            return True
+        self._remember(key, now)
+        return not await storage.mark_seen(key, self.ttl)
+
+    async def release(self, sender: str, message_id: str) -> None:
+        """Forget message ID so message can be sent again.
+
+        :param sender: sender user name
+        :type sender: str
+        :param message_id: client supplied message ID
+        :type message_id: str
+        """
+        key = f"{keys.DEDUP}:{sender}:{message_id}"
+        self._local.pop(key, None)
+        await storage.forget_seen(key)
+
+
+cache = DedupCache()
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+import trio
+
+from .message import EphemeralMessage
+from .storage import storage
+
+EPHEMERAL_WINDOW = float(os.getenv("CHITTY_EPHEMERAL_WINDOW", "1.0"))
+
+log = logging.getLogger(__name__)
+
+CoalesceKey = Tuple[str, str]
+
+
+class EventCoalescer:
+    """Throttle ephemeral events per (user, topic) on sending node.
+
+    The first event after a quiet period is published immediately. Events
+    that come within the window after publication replace each other and
+    only the latest one is published when the window closes, so every
+    (user, topic) pair is published at most once per window. Pending events
+    are published in single pipeline.
+
+    :param window: coalescing window in seconds
+    :type window: float
+    """
+
+    def __init__(self, window: float = EPHEMERAL_WINDOW):
+        self.window = window
+        self._pending: Dict[CoalesceKey, EphemeralMessage] = {}
+        self._published: Dict[CoalesceKey, float] = {}
+
+    async def submit(self, sender: str, message: EphemeralMessage) -> None:
+        """Publish or coalesce ephemeral event.
+
+        :param sender: sender user name
+        :type sender: str
+        :param message: ephemeral message
+        :type message: EphemeralMessage
+        """
+        key = (sender, message.topic)
+        now = time.monotonic()
+        last = self._published.get(key)
+        if last is None or now - last >= self.window:
+            self._published[key] = now
+            self._pending.pop(key, None)
+            await message.publish()
+        else:
+            self._pending[key] = message
+
+    async def flush(self) -> int:
+        """Publish pending events for which window has closed.
+
+        :return: number of published events
+        :rtype: int
+        """
+        now = time.monotonic()
+        due = [
+            key
+            for key in self._pending
+            if now - self._published.get(key, 0) >= self.window
+        ]
+        stale = [
+            key
+            for key, last in self._published.items()
+            if now - last >= self.window and key not in self._pending
+        ]
+        for key in stale:
+            del self._published[key]
+        if not due:
+            return 0
+        messages = []
+        for key in due:
+            message = self._pending.pop(key)
+            self._published[key] = now
+            messages.append((message.topic, message.serialised_payload))
+        await storage.publish_many(messages)
+        return len(due)
+
+    async def run(self) -> None:
+        """Background task that periodically publishes coalesced events."""
+        while True:
+            await trio.sleep(self.window / 2)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("ephemeral events flush failed")
+
+
+coalescer = EventCoalescer()
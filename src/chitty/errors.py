@@ -2,6 +2,7 @@ E_REASON_MALFORMED = "E_REASON_MALFORMED"
 E_REASON_TYPE_INVALID = "E_REASON_TYPE_INVALID"
 E_REASON_NOTREG = "E_REASON_NOTREG"
 E_REASON_TOPIC_SYSTEM = "E_REASON_TOPIC_SYSTEM"
+E_REASON_CONTENT_BLOCKED = "E_REASON_CONTENT_BLOCKED"
 
 
 class ChatMessageException(Exception):
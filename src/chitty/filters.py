@@ -0,0 +1,287 @@
+"""Content filter stage.
+
+Text of ``msg``, ``reply`` and ``dm`` messages is checked against list of
+banned terms with Aho-Corasick automaton, so matching cost is linear in
+message length regardless of number of terms. Matching is case insensitive
+and only whole words (and phrases) are matched. If ``pyahocorasick`` package
+is installed its automaton is used, otherwise pure Python implementation.
+
+Terms are stored in Redis set and reloaded periodically when term list
+version changes. Automaton is built in worker thread and swapped in when
+ready, so reload does not block event loop.
+"""
+
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import trio
+
+from . import errors, utils
+from .message import MSG_TYPE_DIRECT_MESSAGE, MSG_TYPE_MESSAGE, MSG_TYPE_REPLY
+from .storage import storage
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover
+    ahocorasick = None
+
+log = logging.getLogger(__name__)
+
+FILTERED_TYPES = {MSG_TYPE_MESSAGE, MSG_TYPE_REPLY, MSG_TYPE_DIRECT_MESSAGE}
+
+RELOAD_INTERVAL = float(os.getenv("CHITTY_FILTER_RELOAD_INTERVAL", "10"))
+REPORT_INTERVAL = float(os.getenv("CHITTY_FILTER_REPORT_INTERVAL", "60"))
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not _is_word_char(text[start - 1])) and (
+        end == len(text) or not _is_word_char(text[end])
+    )
+
+
+class Matcher:
+    """Pure Python Aho-Corasick automaton.
+
+    :param terms: terms to match, should be case folded
+    :type terms: Iterable[str]
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[Optional[str]] = [None]
+        for term in terms:
+            if term:
+                self._add(term)
+        self._fail = [0] * len(self._goto)
+        # nearest state on failure chain that ends some term
+        self._link = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                fail = self._fail[child]
+                self._link[child] = fail if self._out[fail] else self._link[fail]
+
+    def _add(self, term: str) -> None:
+        state = 0
+        for char in term:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = self._goto[state][char] = len(self._goto)
+                self._goto.append({})
+                self._out.append(None)
+            state = nxt
+        self._out[state] = term
+
+    def find(self, text: str) -> Optional[str]:
+        """Find first whole word occurrence of any term in text.
+
+        :param text: case folded text
+        :type text: str
+        :return: matched term or None
+        :rtype: Optional[str]
+        """
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            candidate = state if out[state] else link[state]
+            while candidate:
+                term = out[candidate]
+                end = index + 1
+                if _is_whole_word(text, end - len(term), end):  # type: ignore
+                    return term
+                candidate = link[candidate]
+        return None
+
+
+class NativeMatcher:
+    """Matcher backed by ``pyahocorasick`` automaton.
+
+    :param terms: terms to match, should be case folded
+    :type terms: Iterable[str]
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self._automaton = ahocorasick.Automaton()
+        for term in terms:
+            if term:
+                self._automaton.add_word(term, term)
+        self._empty = len(self._automaton) == 0
+        if not self._empty:
+            self._automaton.make_automaton()
+
+    def find(self, text: str) -> Optional[str]:
+        if self._empty:
+            return None
+        for last, term in self._automaton.iter(text):
+            if _is_whole_word(text, last + 1 - len(term), last + 1):
+                return term
+        return None
+
+
+def build_matcher(terms: Iterable[str]):
+    """Build fastest available matcher for terms.
+
+    :param terms: banned terms
+    :type terms: Iterable[str]
+    :return: matcher object
+    :rtype: Union[NativeMatcher, Matcher]
+    """
+    folded = {term.strip().casefold() for term in terms}
+    folded.discard("")
+    if ahocorasick is not None:
+        return NativeMatcher(folded)
+    return Matcher(folded)
+
+
+@dataclass
+class FilterStats:
+    """Content filter cost counters.
+
+    :ivar messages: number of checked messages
+    :type messages: int
+    :ivar blocked: number of blocked messages
+    :type blocked: int
+    :ivar chars: total length of checked texts
+    :type chars: int
+    """
+
+    messages: int = 0
+    blocked: int = 0
+    chars: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    def record(self, duration: float, length: int, blocked: bool) -> None:
+        self.messages += 1
+        self.chars += length
+        self.blocked += blocked
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+    def summary(self) -> str:
+        mean = self.total_time / self.messages if self.messages else 0.0
+        per_char = self.total_time / self.chars if self.chars else 0.0
+        return (
+            f"messages={self.messages} blocked={self.blocked} "
+            f"mean={mean * 1_000_000:.1f}us max={self.max_time * 1_000_000:.1f}us "
+            f"per_char={per_char * 1_000_000_000:.1f}ns"
+        )
+
+
+class ContentFilter:
+    """Banned terms filter.
+
+    :param reload_interval: how often term list version is checked, in
+                            seconds
+    :type reload_interval: float
+    :param report_interval: how often cost statistics are logged, in
+                            seconds, 0 disables reports
+    :type report_interval: float
+    """
+
+    def __init__(
+        self,
+        reload_interval: float = RELOAD_INTERVAL,
+        report_interval: float = REPORT_INTERVAL,
+    ):
+        self.reload_interval = reload_interval
+        self.report_interval = report_interval
+        self.matcher = None
+        self.version: Optional[int] = None
+        self.stats = FilterStats()
+
+    def check(self, text: str) -> Optional[str]:
+        """Check text for banned terms.
+
+        :param text: message text
+        :type text: str
+        :return: first banned term found or None
+        :rtype: Optional[str]
+        """
+        matcher = self.matcher
+        if matcher is None:
+            return None
+        started = time.perf_counter()
+        term = matcher.find(text.casefold())
+        self.stats.record(time.perf_counter() - started, len(text), term is not None)
+        return term
+
+    def stage(
+        self, user, msg_type: str, msg: Mapping[str, str]
+    ) -> Optional[Mapping[str, str | Mapping[str, str]]]:
+        """Message routing filter stage.
+
+        :param user: sender object
+        :type user: User
+        :param msg_type: message type
+        :type msg_type: str
+        :param msg: message contents
+        :type msg: Mapping[str, str]
+        :return: error structure if message is blocked
+        :rtype: Optional[Mapping[str, str | Mapping[str, str]]]
+        """
+        if msg_type not in FILTERED_TYPES:
+            return None
+        text = msg.get("value")
+        if not isinstance(text, str) or not text:
+            return None
+        term = self.check(text)
+        if term is None:
+            return None
+        log.info(f"{msg_type} message from {user.name} blocked by content filter")
+        return utils.error_response(
+            errors.E_REASON_CONTENT_BLOCKED,
+            message="Message contains banned content",
+        )
+
+    async def reload(self) -> bool:
+        """Reload term list if its version has changed.
+
+        :return: True if matcher has been replaced
+        :rtype: bool
+        """
+        version = await storage.get_filter_version()
+        if version == self.version:
+            return False
+        terms = await storage.get_filter_terms()
+        matcher = None
+        if terms:
+            matcher = await trio.to_thread.run_sync(build_matcher, terms)
+        self.matcher, self.version = matcher, version
+        log.info(f"content filter loaded {len(terms)} terms, version {version}")
+        return True
+
+    async def run(self) -> None:
+        """Background task that reloads term list and reports filter cost."""
+        next_report = time.monotonic() + self.report_interval
+        while True:
+            try:
+                await self.reload()
+            except Exception:
+                log.exception("content filter reload failed")
+            if self.report_interval and time.monotonic() >= next_report:
+                next_report = time.monotonic() + self.report_interval
+                log.info(f"content filter: {self.stats.summary()}")
+            await trio.sleep(self.reload_interval)
+
+
+content_filter = ContentFilter()
@@ -5,26 +5,154 @@ arguments required by message spec. Anything that is returned from this
 function will be serialised and then sent back to client as response.
 """
 
+import functools
 import logging
-from typing import Mapping, Optional
+import os
+import re
+from typing import Awaitable, Callable, List, Mapping, Optional, Tuple, Union
 
 import trio
 
-from . import errors, topic, utils
-from .event import SYS_USER_DATA
-from .message import MSG_TYPE_SUBSCRIBE_TOPIC, make_message
-from .user import User, registry
+from . import attachment, codec, dedup, ephemeral, errors, notify, topic, utils
+from .markers import read_markers
+from .message import (
+    MSG_TYPE_SUBSCRIBE_TOPIC,
+    MSG_TYPE_TYPING,
+    MSG_TYPE_UNSUBSCRIBE_TOPIC,
+    Message,
+    make_direct_message,
+    make_ephemeral_message,
+    make_message,
+)
+from .storage import storage
+from .user import User
 
 log = logging.getLogger(__name__)
 
+HandlerResult = Optional[Mapping[str, str | Mapping[str, str]]]
 
+MENTION_RE = re.compile(r"(?<![\w@])@([\w.-]*\w)")
+MAX_MENTIONS = 10
+
+MAX_RECIPIENTS = int(os.getenv("CHITTY_MAX_DM_RECIPIENTS", "50"))
+
+
+def idempotent(
+    handler: Callable[..., Awaitable[HandlerResult]]
+) -> Callable[..., Awaitable[HandlerResult]]:
+    """Decorate handler to accept optional client supplied message ID.
+
+    If message with the same ID has recently been sent by the same user it is
+    dropped before handler is run, so retried message is not published again.
+    ID is released when handler fails or returns error response, so client
+    can retry the message, unless error response lists recipients message
+    was already ``delivered`` to, as retry would deliver it again.
+
+    :param handler: message handler
+    :type handler: Callable[..., Awaitable[HandlerResult]]
+    :return: decorated handler
+    :rtype: Callable[..., Awaitable[HandlerResult]]
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(
+        user: User, *, message_id: Optional[str] = None, **kw
+    ) -> HandlerResult:
+        if message_id is not None:
+            if not isinstance(message_id, str) or not (
+                0 < len(message_id) <= dedup.MAX_MESSAGE_ID_LENGTH
+            ):
+                return utils.error_response(
+                    errors.E_REASON_MALFORMED, message="Invalid message ID"
+                )
+            if await dedup.cache.is_duplicate(user.name, message_id):
+                log.info(f"duplicate message {message_id} from {user.name} dropped")
+                return None
+        try:
+            rv = await handler(user, **kw)
+        except BaseException:
+            if message_id is not None:
+                with trio.CancelScope(shield=True):
+                    await dedup.cache.release(user.name, message_id)
+            raise
+        if (
+            message_id is not None
+            and rv
+            and rv.get("status") == "error"
+            and not rv.get("delivered")
+        ):
+            await dedup.cache.release(user.name, message_id)
+        return rv
+
+    return wrapper
+
+
+def find_mentions(text: str, sender: str) -> List[str]:
+    """Find names of users mentioned in message text with ``@name``.
+
+    :param text: message text
+    :type text: str
+    :param sender: sender name, excluded from result
+    :type sender: str
+    :return: unique mentioned names, at most ``MAX_MENTIONS``
+    :rtype: List[str]
+    """
+    names = []
+    for name in MENTION_RE.findall(text):
+        if name != sender and name not in names:
+            names.append(name)
+            if len(names) == MAX_MENTIONS:
+                break
+    return names
+
+
+def _message_ref(message: Message) -> Mapping[str, str]:
+    return {
+        "topic": message.topic,
+        "from": message.payload["from"]["name"],  # type: ignore
+        "date": message.payload["date"],
+    }
+
+
+async def _post(
+    user: User, to: str, value: str, attachment_ref: Optional[Mapping] = None
+) -> Tuple[HandlerResult, Optional[Message]]:
+    if to in topic.SYSTEM_TOPICS:
+        log.warning(f"user {user.name} tries to post to system topic")
+        return (
+            utils.error_response(
+                errors.E_REASON_TOPIC_SYSTEM,
+                message=f"Topic {to} is not available for posting",
+            ),
+            None,
+        )
+    if attachment_ref is not None:
+        try:
+            attachment_ref = attachment.make_reference(attachment_ref)
+        except ValueError as e:
+            return utils.error_response(errors.E_REASON_MALFORMED, message=str(e)), None
+    message = await user.post_message(to, value, attachment=attachment_ref)
+    log.debug(f"{user.name} posted message to {to}")
+    mentions = find_mentions(value, user.name)
+    if mentions:
+        # only existing users are notified, @word must not publish to topic
+        exist = await storage.users_exist(mentions)
+        ref = _message_ref(message)
+        for name, ok in zip(mentions, exist):
+            if ok:
+                await notify.aggregator.notify(name, notify.KIND_MENTION, ref)
+    return None, message
+
+
+@idempotent
 async def post_message(
-    user: User, *, to: str, value: str
+    user: User, *, to: str, value: str, attachment: Optional[Mapping] = None
 ) -> Optional[Mapping[str, str | Mapping[str, str]]]:
     """Post chat message on specific topic.
 
     This function return None if operation succeeds, error structure
-    otherwise.
+    otherwise. Users mentioned in message text get notified. Message may
+    carry reference to file uploaded to web service.
 
     :param user: user object
     :type client: User
@@ -32,24 +160,29 @@ async def post_message(
     :type to: str
     :param value: message text
     :type value: str
+    :param attachment: attachment reference, defaults to None
+    :type attachment: Optional[Mapping], optional
     :return: optional error structure
     :rtype: Optional[dict]
     """
-    if to in topic.SYSTEM_TOPICS:
-        log.warning(f"user {user.name} tries to post to system topic")
-        return utils.error_response(
-            errors.E_REASON_TOPIC_SYSTEM,
-            message=f"Topic {to} is not available for posting",
-        )
-    await user.post_message(to, value)
-    log.debug(f"{user.name} posted message to {to}")
+    ret, _ = await _post(user, to, value, attachment)
+    return ret
 
 
+@idempotent
 async def post_reply_message(
-    user: User, *, to: str, value: str, replying_to: Mapping[str, str]
+    user: User,
+    *,
+    to: str,
+    value: str,
+    replying_to: Mapping[str, str],
+    attachment: Optional[Mapping] = None,
 ) -> Optional[Mapping[str, str | Mapping[str, str]]]:
     """Post reply message.
 
+    Reply recipient gets notification, notifications are aggregated per
+    recipient by :data:`~chitty.notify.aggregator`.
+
     :param user: sender user object
     :type user: User
     :param to: topic name
@@ -58,57 +191,206 @@ async def post_reply_message(
     :type value: str
     :param replying_to: reply recipient data
     :type replying_to: Mapping[str, str]
+    :param attachment: attachment reference, defaults to None
+    :type attachment: Optional[Mapping], optional
     :return: optonal error response from message posting
     :rtype: Optional[Mapping[str, str | Mapping[str, str]]]
     """
-    ret = await post_message(user, to=to, value=value)
+    ret, message = await _post(user, to, value, attachment)
     if ret:
         return ret
     in_reply_to = replying_to["name"]
-    msg = make_message(
-        user_data=SYS_USER_DATA, topic=in_reply_to, msg="You've got reply"
-    )
-    await msg.publish()
+    if in_reply_to != user.name:
+        await notify.aggregator.notify(
+            in_reply_to, notify.KIND_REPLY, _message_ref(message)
+        )
+
 
+async def _resync(user: User, topic: str, since: int) -> Mapping[str, object]:
+    seq, messages = 0, None
+    # backlog of other users' private topics holds their direct messages
+    if topic == user.name or not await storage.user_exists(topic):
+        seq, messages = await storage.read_backlog(topic, since)
+    result = {"topic": topic, "seq": seq}
+    if messages is None or len(messages) < seq - since or since > seq:
+        result["gap"] = True
+    else:
+        result["messages"] = [codec.decode(data) for data in messages]
+    return result
 
-async def subscribe(user: User, *, value: str) -> Mapping[str, str]:
+
+async def subscribe(
+    user: User, *, value: str, since: Optional[int] = None
+) -> Mapping[str, object]:
     """Subscribe user to specified topic.
 
+    If client sends sequence number of the last message it has seen in the
+    topic, messages published since then are read from topic backlog and
+    returned in ``resync`` field of confirmation, oldest first. If they are
+    no longer available in backlog, ``resync`` has ``gap`` flag set instead
+    and client should reload topic history. Resynced messages may also be
+    delivered live, clients should skip already seen sequence numbers.
+
     :param client: client ID
     :type client: str
     :param value: topic name
     :type value: str
+    :param since: last sequence number seen by client, defaults to None
+    :type since: Optional[int], optional
     :return: subscription confirmation message structure
     :rtype: dict
     """
+    if since is not None and (
+        not isinstance(since, int) or isinstance(since, bool) or since < 0
+    ):
+        return utils.error_response(
+            errors.E_REASON_MALFORMED, message="since must be sequence number"
+        )
     await user.subscribe(value)
     await trio.sleep(0)
     payload = user.to_map(with_topics=True)
     payload["type"] = MSG_TYPE_SUBSCRIBE_TOPIC
+    if since is not None:
+        payload["resync"] = await _resync(user, value, since)
     log.debug(f"{user.name} subscribed to {value}")
     return payload
 
 
+async def unsubscribe(user: User, *, value: str) -> Mapping[str, object]:
+    """Unsubscribe user from specified topic.
+
+    User can not leave own private topic, default topics nor system topics.
+
+    :param user: user object
+    :type user: User
+    :param value: topic name
+    :type value: str
+    :return: unsubscription confirmation message structure
+    :rtype: dict
+    """
+    if (
+        value == user.name
+        or value in topic.DEFAULT_TOPICS
+        or value.startswith(topic.SYSTEM_TOPIC_PREFIX)
+    ):
+        return utils.error_response(
+            errors.E_REASON_TOPIC_SYSTEM,
+            message=f"Topic {value} can not be unsubscribed",
+        )
+    await user.unsubscribe(value)
+    payload = user.to_map(with_topics=True)
+    payload["type"] = MSG_TYPE_UNSUBSCRIBE_TOPIC
+    log.debug(f"{user.name} unsubscribed from {value}")
+    return payload
+
+
+def _recipient_names(to: Union[str, List[str]]) -> Optional[List[str]]:
+    names = [to] if isinstance(to, str) else to
+    if not isinstance(names, list) or not names:
+        return None
+    if not all(isinstance(name, str) and name for name in names):
+        return None
+    return list(dict.fromkeys(names))
+
+
+@idempotent
 async def direct_message(
-    user: User, *, to: str, value: str
+    user: User, *, to: Union[str, List[str]], value: str
 ) -> Optional[Mapping[str, str | Mapping[str, str]]]:
-    """Send direct message to another user.
+    """Send direct message to one or more users.
+
+    Recipients are checked in single round trip and message is published to
+    private topics of all existing recipients in single pipeline. Message
+    to single recipient keeps its name in ``topic`` field, message to list
+    of recipients is serialised once with the list in ``to`` field.
+
+    If some recipients do not exist the message is still delivered to the
+    others, and error response lists missing names in ``recipients`` and
+    names message was delivered to in ``delivered``.
 
     :param user: sender object
     :type user: User
-    :param to: recipient name
-    :type to: str
+    :param to: recipient name or list of names, at most ``MAX_RECIPIENTS``
+    :type to: Union[str, List[str]]
     :param value: message
     :type value: str
     :return: optional error structure
     :rtype: Optional[Mapping[str, str | Mapping[str, str]]]
     """
-    recipient = registry.get(to)
-    if not recipient:
-        log.warning(f"recipient {to} not found")
+    names = _recipient_names(to)
+    if names is None or len(names) > MAX_RECIPIENTS:
+        return utils.error_response(
+            errors.E_REASON_MALFORMED,
+            message=f"Invalid recipients, expected: 1 to {MAX_RECIPIENTS} names",
+        )
+    exist = await storage.users_exist(names)
+    found = [name for name, ok in zip(names, exist) if ok]
+    missing = [name for name, ok in zip(names, exist) if not ok]
+    if found:
+        if isinstance(to, str):
+            await make_message(user_data=user.to_map(), topic=to, msg=value).publish()
+        else:
+            message = make_direct_message(user.to_map(), found, value)
+            await message.publish_to(found)
+        log.debug(f"direct message from {user.name} to {len(found)} recipients sent")
+    if missing:
+        log.warning(f"recipients {', '.join(missing)} not found")
+        resp = utils.error_response(
+            errors.E_REASON_NOTREG,
+            message="Recipient not found",
+        )
+        return {**resp, "recipients": missing, "delivered": found}
+
+
+async def typing_indicator(user: User, *, to: str, value: bool = True) -> HandlerResult:
+    """Notify topic subscribers that user is typing.
+
+    Typing indicators are ephemeral and coalesced per user and topic, so
+    repeated notifications are published at most once per coalescing window.
+
+    :param user: sender object
+    :type user: User
+    :param to: topic name
+    :type to: str
+    :param value: flag whether user is typing, defaults to True
+    :type value: bool, optional
+    :return: optional error structure
+    :rtype: HandlerResult
+    """
+    if to in topic.SYSTEM_TOPICS:
+        return utils.error_response(
+            errors.E_REASON_TOPIC_SYSTEM,
+            message=f"Topic {to} is not available for posting",
+        )
+    message = make_ephemeral_message(
+        user.to_map(), to, MSG_TYPE_TYPING, active=bool(value)
+    )
+    await ephemeral.coalescer.submit(user.name, message)
+
+
+async def mark_read(user: User, *, to: str, value: int) -> HandlerResult:
+    """Record sequence number of the last message user has read in topic.
+
+    Markers are buffered and written in batches, see :mod:`chitty.markers`.
+    Only topics user is subscribed to can be marked.
+
+    :param user: user object
+    :type user: User
+    :param to: topic name
+    :type to: str
+    :param value: sequence number of the last read message
+    :type value: int
+    :return: optional error structure
+    :rtype: HandlerResult
+    """
+    if not isinstance(to, str) or not to:
+        return utils.error_response(errors.E_REASON_MALFORMED, message="Invalid topic")
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        return utils.error_response(
+            errors.E_REASON_MALFORMED, message="value must be sequence number"
+        )
+    if to not in user.topics:
         return utils.error_response(
-            errors.E_REASON_NOTREG, message="Recipient not found"
+            errors.E_REASON_NOTREG, message=f"Not subscribed to topic {to}"
         )
-    message = make_message(user_data=user.to_map(), topic=recipient.name, msg=value)
-    await message.publish()
-    log.debug(f"direct message from {user.name} to {recipient.name} sent")
+    read_markers.mark(user.name, to, value)
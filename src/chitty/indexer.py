@@ -0,0 +1,174 @@
+"""Streaming search indexer.
+
+Indexer runs as separate process (``chitty index``) subscribed to all
+PubSub channels, so it never adds latency to live message delivery. Chat
+messages posted to public topics are collected in memory and written to
+:class:`~chitty.search.SearchIndex` in periodic batches, each batch in
+single transaction executed in worker thread. Direct messages, private
+topics, system topics and ephemeral messages are not indexed.
+"""
+
+import logging
+import os
+from typing import List, Optional, Set, Tuple
+
+import trio
+
+from . import codec
+from .message import EPHEMERAL_FIELD, MSG_TYPE_MESSAGE
+from .search import SEARCH_DB, IndexEntry, SearchIndex
+from .storage import redio_client, storage
+from .topic import SYSTEM_TOPIC_PREFIX
+
+BATCH_SIZE = int(os.getenv("CHITTY_INDEX_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("CHITTY_INDEX_FLUSH_INTERVAL", "1.0"))
+
+log = logging.getLogger(__name__)
+
+
+def parse_entry(topic: str, data: str) -> Optional[IndexEntry]:
+    """Build index entry from published message.
+
+    :param topic: PubSub channel name
+    :type topic: str
+    :param data: serialised message payload
+    :type data: str
+    :return: index entry or None if message should not be indexed
+    :rtype: Optional[IndexEntry]
+    """
+    if topic.startswith(SYSTEM_TOPIC_PREFIX):
+        return None
+    try:
+        payload = codec.decode(data)
+    except codec.DecodeError:
+        return None
+    if (
+        not isinstance(payload, dict)
+        or payload.get("type") != MSG_TYPE_MESSAGE
+        or payload.get(EPHEMERAL_FIELD)
+    ):
+        return None
+    sender = payload.get("from")
+    message = payload.get("message")
+    date = payload.get("date")
+    if (
+        not isinstance(sender, dict)
+        or not isinstance(message, str)
+        or not isinstance(date, (int, float))
+    ):
+        return None
+    return IndexEntry(topic, str(sender.get("name")), float(date), message, data)
+
+
+class Indexer:
+    """Batching message indexer.
+
+    Messages fed to indexer are buffered and written when batch fills up or
+    flush interval passes, whichever comes first. Only messages in topics
+    registered in topic directory are indexed, which leaves out direct
+    messages and users' private topics. Topics are checked at flush time,
+    when topic created by batched message is already registered.
+
+    :param index: search index
+    :type index: SearchIndex
+    :param batch_size: maximum number of messages written in single
+                       transaction, defaults to :data:`BATCH_SIZE`
+    :type batch_size: int, optional
+    :param flush_interval: maximum time messages are buffered, in seconds,
+                           defaults to :data:`FLUSH_INTERVAL`
+    :type flush_interval: float, optional
+    """
+
+    def __init__(
+        self,
+        index: SearchIndex,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.index = index
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: List[Tuple[str, str]] = []
+        self.indexed = 0
+        self._public_topics: Set[str] = set()
+        self._batch_full = trio.Event()
+
+    def feed(self, topic: str, data: str) -> None:
+        """Buffer published message for indexing.
+
+        :param topic: PubSub channel name
+        :type topic: str
+        :param data: serialised message payload
+        :type data: str
+        """
+        self.pending.append((topic, data))
+        if len(self.pending) >= self.batch_size:
+            self._batch_full.set()
+
+    async def _filter_public(self, entries: List[IndexEntry]) -> List[IndexEntry]:
+        unknown = {entry.topic for entry in entries} - self._public_topics
+
+        async def check(topic):
+            if await storage.topic_exists(topic):
+                self._public_topics.add(topic)
+
+        async with trio.open_nursery() as nursery:
+            for topic in unknown:
+                nursery.start_soon(check, topic)
+        return [entry for entry in entries if entry.topic in self._public_topics]
+
+    async def flush(self) -> int:
+        """Write buffered messages to index.
+
+        :return: number of indexed messages
+        :rtype: int
+        """
+        batch, self.pending = self.pending, []
+        entries = [entry for entry in (parse_entry(*item) for item in batch) if entry]
+        if not entries:
+            return 0
+        entries = await self._filter_public(entries)
+        if not entries:
+            return 0
+        count = await trio.to_thread.run_sync(self.index.add, entries)
+        self.indexed += count
+        return count
+
+    async def receive(self, pubsub) -> None:
+        """Feed messages received from PubSub receiver.
+
+        :param pubsub: receiver that yields channel and message pairs
+        :type pubsub: PubSub
+        """
+        async for topic, data in pubsub:
+            self.feed(topic, data)
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED) -> None:
+        """Subscribe to all channels and index messages until cancelled."""
+        pubsub = redio_client().pubsub().strdecode.with_channel.psubscribe("*")
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self.receive, pubsub)
+            task_status.started()
+            while True:
+                with trio.move_on_after(self.flush_interval):
+                    await self._batch_full.wait()
+                self._batch_full = trio.Event()
+                try:
+                    count = await self.flush()
+                except Exception:
+                    log.exception("failed to write index batch")
+                    continue
+                if count:
+                    log.debug(f"indexed {count} messages, {self.indexed} total")
+
+
+async def main(path: str = SEARCH_DB) -> None:
+    """Search indexer entrypoint.
+
+    :param path: search database path, defaults to :data:`SEARCH_DB`
+    :type path: str, optional
+    """
+    logging.basicConfig(level=os.getenv("CHITTY_LOGLEVEL", "INFO"))
+    log.info(f"indexing messages to {path}")
+    indexer = Indexer(SearchIndex(path))
+    await indexer.run()
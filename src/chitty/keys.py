@@ -1,3 +1,19 @@
 USERS = "users"
 LOGINS = "logins"
 TOPICS = "topics"
+
+DIRECTORY_NAMES = "directory:names"
+DIRECTORY_SUBSCRIBERS = "directory:subscribers"
+DIRECTORY_ACTIVITY = "directory:activity"
+
+DEDUP = "dedup"
+
+FILTER_TERMS = "filter:terms"
+FILTER_VERSION = "filter:version"
+
+TOPIC_SEQ = "seq"
+TOPIC_BACKLOG = "backlog"
+READ_MARKERS = "read"
+READ_FLOORS = "floors"
+
+NODES = "nodes"
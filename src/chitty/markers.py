@@ -0,0 +1,104 @@
+"""Read markers and unread counts.
+
+Client reports sequence number of the last message it has read in topic
+with ``read`` message. Markers are buffered per user and topic, keeping
+only the highest sequence number, and written in batches every
+``CHITTY_READ_FLUSH_INTERVAL`` seconds. Unread count of topic is topic
+sequence number minus user read marker, counts for all user topics are sent
+to client on connect.
+"""
+
+import logging
+import os
+from typing import Dict
+
+import trio
+
+from .storage import storage
+
+READ_FLUSH_INTERVAL = float(os.getenv("CHITTY_READ_FLUSH_INTERVAL", "1.0"))
+
+log = logging.getLogger(__name__)
+
+
+class ReadMarkerBuffer:
+    """Buffer of read marker updates flushed in batches.
+
+    :param interval: flush interval in seconds, defaults to
+                     ``READ_FLUSH_INTERVAL``
+    :type interval: float, optional
+    """
+
+    def __init__(self, interval: float = READ_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Dict[str, Dict[str, int]] = {}
+
+    def mark(self, name: str, topic: str, seq: int) -> None:
+        """Record read position of user in topic.
+
+        :param name: user name
+        :type name: str
+        :param topic: topic name
+        :type topic: str
+        :param seq: sequence number of last read message
+        :type seq: int
+        """
+        positions = self._pending.setdefault(name, {})
+        if seq > positions.get(topic, -1):
+            positions[topic] = seq
+
+    def _restore(self, pending: Dict[str, Dict[str, int]]) -> None:
+        # keep markers for next flush, higher position wins
+        for name, positions in pending.items():
+            for topic, seq in positions.items():
+                self.mark(name, topic, seq)
+
+    async def flush(self) -> int:
+        """Write buffered markers in single pipeline.
+
+        :return: number of written markers
+        :rtype: int
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            await storage.set_read_markers(pending)
+        except Exception:
+            self._restore(pending)
+            raise
+        return sum(len(positions) for positions in pending.values())
+
+    async def unread_counts(self, name: str, topics) -> Dict[str, int]:
+        """Count unread messages in user topics.
+
+        Markers of the user that are still buffered are written first, they
+        are kept for next flush if write fails.
+
+        :param name: user name
+        :type name: str
+        :param topics: topic names
+        :type topics: Iterable[str]
+        :return: mapping of topic name to number of unread messages
+        :rtype: Dict[str, int]
+        """
+        positions = self._pending.pop(name, None)
+        if positions:
+            try:
+                await storage.set_read_markers({name: positions})
+            except Exception:
+                self._restore({name: positions})
+                raise
+        return await storage.unread_counts(name, sorted(topics))
+
+    async def run(self) -> None:
+        """Background task that periodically writes buffered markers."""
+        while True:
+            await trio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("read markers flush failed")
+
+
+read_markers = ReadMarkerBuffer()
@@ -1,67 +1,234 @@
-import json
+from __future__ import annotations
+
+import functools
+import os
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 try:
     from functools import cached_property
 except ImportError:
     from cached_property import cached_property  # type: ignore
 
-from typing import Mapping, Union
+from typing import Dict, List, Mapping, Optional, Sequence, Union
 
 from trio_websocket import WebSocketConnection
 
-from .storage import redis
+from . import codec, tracing, wsframes
+from .storage import storage
 
 MSG_TYPE_SUBSCRIBE_TOPIC = "sub"
+MSG_TYPE_UNSUBSCRIBE_TOPIC = "unsub"
 MSG_TYPE_DIRECT_MESSAGE = "dm"
 MSG_TYPE_MESSAGE = "msg"
 MSG_TYPE_REPLY = "reply"
 MSG_TYPE_EVENT = "event"
+MSG_TYPE_TYPING = "typing"
+MSG_TYPE_PRESENCE = "presence"
+MSG_TYPE_NOTIFICATION = "notification"
+MSG_TYPE_ACK = "ack"
+MSG_TYPE_READ = "read"
+MSG_TYPE_UNREAD = "unread"
 
 KNOWN_MSG_TYPES = [
     MSG_TYPE_SUBSCRIBE_TOPIC,
+    MSG_TYPE_UNSUBSCRIBE_TOPIC,
     MSG_TYPE_DIRECT_MESSAGE,
     MSG_TYPE_MESSAGE,
     MSG_TYPE_REPLY,
+    MSG_TYPE_TYPING,
+    MSG_TYPE_READ,
 ]
 
 MSG_FIELDS = {
     MSG_TYPE_SUBSCRIBE_TOPIC: ["value"],
+    MSG_TYPE_UNSUBSCRIBE_TOPIC: ["value"],
     MSG_TYPE_DIRECT_MESSAGE: ["to", "value"],
     MSG_TYPE_MESSAGE: ["to", "value"],
     MSG_TYPE_REPLY: ["to", "value", "replyingTo"],
+    MSG_TYPE_TYPING: ["to"],
+    MSG_TYPE_READ: ["to", "value"],
 }
 
+EPHEMERAL_FIELD = "ephemeral"
+SEQ_FIELD = "seq"
+
+BACKLOG_SIZE = int(os.getenv("CHITTY_BACKLOG_SIZE", "1000"))
+# number of recently delivered messages shared by local subscribers
+DELIVERY_CACHE_SIZE = int(os.getenv("CHITTY_DELIVERY_CACHE_SIZE", "1024"))
+
 
 @dataclass
 class Message:
     """Message object that can be published.
 
+    Payload is encoded at most once per wire format, encoded forms are cached
+    and shared by all connections that use the same format.
+
+    Published messages get per-topic sequence number, it is set in ``seq``
+    payload field of delivered message (but not in payload of published
+    object) and stored in :attr:`seq`.
+
     :ivar topic: topic where message will be published
     :type topic: str
     :ivar payload: message payload as serialisable structure
     :type payload: Mapping[str, Union[str, float, Mapping[str, str]]]
+    :ivar seq: topic sequence number, None if message is not yet published
+               or if it is ephemeral
+    :type seq: Optional[int]
     """
 
     topic: str
     payload: Mapping[str, Union[str, float, Mapping[str, str]]]
+    seq: Optional[int] = field(init=False, default=None)
+
+    ephemeral = False
+
+    _encoded: Dict[str, Union[str, bytes]] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    _frames: Dict[str, bytes] = field(init=False, repr=False, default_factory=dict)
+
+    @classmethod
+    def from_serialised(cls, topic: str, data: str) -> Message:
+        """Build message from JSON serialised payload.
+
+        Serialised form is kept so it does not need to be encoded again for
+        JSON clients.
+
+        :param topic: topic name
+        :type topic: str
+        :param data: JSON serialised payload
+        :type data: str
+        :return: message object
+        :rtype: Message
+        """
+        payload = codec.decode(data)
+        if isinstance(payload, Mapping) and payload.get(EPHEMERAL_FIELD):
+            cls = EphemeralMessage
+        message = cls(topic=topic, payload=payload)
+        message.__dict__["serialised_payload"] = data
+        if isinstance(payload, Mapping):
+            message.seq = payload.get(SEQ_FIELD)
+        return message
 
     @cached_property
-    def serialised_payload(self):
-        return json.dumps(self.payload)
+    def serialised_payload(self) -> str:
+        return codec.encode(self.payload)  # type: ignore
+
+    def encoded(self, fmt: str = codec.FORMAT_JSON) -> Union[str, bytes]:
+        """Get payload encoded in specified wire format.
+
+        :param fmt: wire format, defaults to ``json``
+        :type fmt: str, optional
+        :return: encoded payload
+        :rtype: Union[str, bytes]
+        """
+        if fmt == codec.FORMAT_JSON:
+            return self.serialised_payload
+        data = self._encoded.get(fmt)
+        if data is None:
+            data = self._encoded[fmt] = codec.encode(self.payload, fmt)
+        return data
 
     async def publish(self) -> None:
-        """Publish message to Redis PubSub channel (topic)."""
-        await redis().publish(self.topic, self.serialised_payload)  # type: ignore
+        """Publish message to Redis PubSub channel (topic).
+
+        Message that is not ephemeral is assigned next topic sequence number
+        and added to topic backlog.
+        """
+        if self.ephemeral:
+            await storage.publish(self.topic, self.serialised_payload)
+        else:
+            self.seq = await storage.publish_sequenced(
+                self.topic, self.serialised_payload, BACKLOG_SIZE
+            )
+        tracing.tracer.hop(
+            tracing.payload_trace(self.payload), tracing.HOP_PUBLISH, topic=self.topic
+        )
+
+    async def publish_to(self, topics: Sequence[str]) -> List[int]:
+        """Publish message to multiple topics in single pipeline.
 
-    async def send(self, ws: WebSocketConnection) -> None:
+        Payload is serialised once and the same serialised form is added to
+        backlog of every topic with its own sequence number.
+
+        :param topics: topic names
+        :type topics: Sequence[str]
+        :return: assigned sequence numbers, in order of topics
+        :rtype: List[int]
+        """
+        data = self.serialised_payload
+        seqs = await storage.publish_sequenced_many(
+            [(topic, data) for topic in topics], BACKLOG_SIZE
+        )
+        tracing.tracer.hop(
+            tracing.payload_trace(self.payload),
+            tracing.HOP_PUBLISH,
+            topic=",".join(topics),
+        )
+        return seqs
+
+    async def send(
+        self, ws: WebSocketConnection, fmt: str = codec.FORMAT_JSON
+    ) -> None:
         """Send message to websocket client connection.
 
+        Frame is built once per wire format and written directly to
+        connection stream, see :mod:`chitty.wsframes`. Connections that can
+        not take pre-encoded frames are sent message with ``send_message``.
+
         :param ws: websocket client connection
         :type ws: WebSocketConnection
+        :param fmt: wire format, defaults to ``json``
+        :type fmt: str, optional
         """
-        await ws.send_message(self.serialised_payload)
+        if wsframes.accepts_raw_frames(ws):
+            await wsframes.send_frame(ws, self.frame(fmt))
+        else:
+            await ws.send_message(self.encoded(fmt))
+
+    def frame(self, fmt: str = codec.FORMAT_JSON) -> bytes:
+        """Get complete server-to-client WebSocket frame with encoded payload.
+
+        :param fmt: wire format, defaults to ``json``
+        :type fmt: str, optional
+        :return: frame bytes
+        :rtype: bytes
+        """
+        frame = self._frames.get(fmt)
+        if frame is None:
+            frame = self._frames[fmt] = wsframes.encode_frame(self.encoded(fmt))
+        return frame
+
+
+class EphemeralMessage(Message):
+    """Message that is never persisted.
+
+    Ephemeral messages (typing indicators, presence changes) are only
+    delivered to currently connected clients, and they are the first to be
+    dropped when client can not keep up with outbound traffic.
+    """
+
+    ephemeral = True
+
+
+@functools.lru_cache(maxsize=DELIVERY_CACHE_SIZE)
+def delivered_message(topic: str, data: str) -> Message:
+    """Build message received from pubsub.
+
+    The same message object is returned to all local subscribers of topic,
+    so payload is encoded and framed once per wire format, not once per
+    connection.
+
+    :param topic: topic name
+    :type topic: str
+    :param data: JSON serialised payload
+    :type data: str
+    :return: message object
+    :rtype: Message
+    """
+    return Message.from_serialised(topic, data)
 
 
 def make_message(
@@ -69,7 +236,9 @@ def make_message(
 ) -> Message:
     """Build chat message structure.
 
-    Any extra data passed in kwargs will be added to message payload.
+    Any extra data passed in kwargs will be added to message payload. If
+    message is created while handling traced inbound message, trace ID is
+    added to payload too.
 
     :param user_data: serialised user data
     :type user_data: dict
@@ -87,4 +256,64 @@ def make_message(
         "topic": topic,
     }
     payload.update(extra)
+    trace_id = tracing.current_trace.get()
+    if trace_id is not None:
+        payload[tracing.TRACE_FIELD] = trace_id
     return Message(topic=topic, payload=payload)
+
+
+def make_direct_message(
+    user_data: Mapping[str, str], recipients: Sequence[str], msg: str
+) -> Message:
+    """Build direct message structure shared by multiple recipients.
+
+    Payload does not depend on recipient, it lists all recipients in ``to``
+    field instead of ``topic``, so it can be serialised once and published
+    to every recipient with :meth:`Message.publish_to`.
+
+    :param user_data: serialised user data
+    :type user_data: Mapping[str, str]
+    :param recipients: recipient names
+    :type recipients: Sequence[str]
+    :param msg: message text
+    :type msg: str
+    :return: message object, its topic is the first recipient
+    :rtype: Message
+    """
+    payload = {
+        "from": user_data,
+        "message": msg,
+        "date": time.time(),
+        "to": list(recipients),
+    }
+    trace_id = tracing.current_trace.get()
+    if trace_id is not None:
+        payload[tracing.TRACE_FIELD] = trace_id
+    return Message(topic=recipients[0], payload=payload)
+
+
+def make_ephemeral_message(
+    user_data: Mapping[str, str], topic: str, msg_type: str, **extra: str
+) -> EphemeralMessage:
+    """Build ephemeral event message structure.
+
+    Any extra data passed in kwargs will be added to message payload.
+
+    :param user_data: serialised user data
+    :type user_data: Mapping[str, str]
+    :param topic: topic name
+    :type topic: str
+    :param msg_type: message type
+    :type msg_type: str
+    :return: ephemeral message object
+    :rtype: EphemeralMessage
+    """
+    payload = {
+        "from": user_data,
+        "type": msg_type,
+        "date": time.time(),
+        "topic": topic,
+        EPHEMERAL_FIELD: True,
+    }
+    payload.update(extra)
+    return EphemeralMessage(topic=topic, payload=payload)
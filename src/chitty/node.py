@@ -0,0 +1,293 @@
+"""Server node state, load reports and graceful drain.
+
+Every ``CHITTY_NODE_REPORT_INTERVAL`` seconds node stores load report in
+shared state: advertised address, state, number of connections and
+capacity, CPU usage of the process and number of runnable tasks. Web
+application uses reports to send clients to lightly loaded nodes.
+
+On drain signal (``SIGTERM`` by default) node stops accepting new
+connections, marks itself as draining in shared state and closes existing
+connections in jittered waves spread over ``CHITTY_DRAIN_PERIOD`` seconds,
+with close code 1012 (service restart) that tells clients to reconnect,
+so they land on other nodes gradually instead of all at once. Server exits
+when all connections are closed. Second signal during drain exits
+immediately.
+"""
+
+import logging
+import math
+import os
+import random
+import signal
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import trio
+from trio_websocket import WebSocketConnection
+
+from .storage import storage
+
+NODE_ID = os.getenv("CHITTY_NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# address advertised to clients, defaults to server bind address
+NODE_HOST = os.getenv("CHITTY_NODE_HOST")
+NODE_PORT = os.getenv("CHITTY_NODE_PORT")
+
+REPORT_INTERVAL = float(os.getenv("CHITTY_NODE_REPORT_INTERVAL", "5"))
+# reports older than this many intervals are considered stale
+REPORT_STALE_INTERVALS = 3
+
+NODE_STATE_ACTIVE = "active"
+NODE_STATE_DRAINING = "draining"
+
+DRAIN_PERIOD = float(os.getenv("CHITTY_DRAIN_PERIOD", "30"))
+DRAIN_WAVES = int(os.getenv("CHITTY_DRAIN_WAVES", "10"))
+DRAIN_SIGNAL = os.getenv("CHITTY_DRAIN_SIGNAL", "SIGTERM")
+# time allowed for closed connections to finish cleanup before exit
+DRAIN_GRACE = 5.0
+
+CLOSE_CODE_RECONNECT = 1012
+CLOSE_REASON_RECONNECT = "Server restarting, reconnect elsewhere"
+
+log = logging.getLogger(__name__)
+
+
+def drain_schedule(
+    count: int,
+    period: float,
+    waves: int,
+    rand: Callable[[], float] = random.random,
+) -> List[float]:
+    """Compute start times of drain waves.
+
+    Period is split into equal slots, one per wave, and every wave starts at
+    random offset within its slot.
+
+    :param count: number of connections
+    :type count: int
+    :param period: drain period in seconds
+    :type period: float
+    :param waves: maximum number of waves
+    :type waves: int
+    :return: wave start times relative to drain start, ascending
+    :rtype: List[float]
+    """
+    waves = max(1, min(waves, count))
+    slot = period / waves
+    return [(i + rand()) * slot for i in range(waves)]
+
+
+def advertised_address(host: str, port: int) -> Tuple[str, int]:
+    """Get address clients should use to connect to this node.
+
+    :param host: server bind address
+    :type host: str
+    :param port: server port
+    :type port: int
+    :return: host and port
+    :rtype: Tuple[str, int]
+    """
+    if NODE_HOST:
+        host = NODE_HOST
+    elif host in ("", "0.0.0.0", "::"):
+        host = socket.getfqdn()
+    return host, int(NODE_PORT or port)
+
+
+class Node:
+    """State of this server node and its connections.
+
+    :ivar node_id: node ID in shared state
+    :type node_id: str
+    :ivar period: drain period in seconds
+    :type period: float
+    :ivar waves: maximum number of drain waves
+    :type waves: int
+    """
+
+    def __init__(
+        self,
+        node_id: str = NODE_ID,
+        period: float = DRAIN_PERIOD,
+        waves: int = DRAIN_WAVES,
+    ):
+        self.node_id = node_id
+        self.period = period
+        self.waves = waves
+        self.draining = False
+        self.connections: Set[WebSocketConnection] = set()
+        self._empty = trio.Event()
+        self._cpu_sample = (time.monotonic(), time.process_time())
+
+    @property
+    def state(self) -> str:
+        return NODE_STATE_DRAINING if self.draining else NODE_STATE_ACTIVE
+
+    def add(self, ws: WebSocketConnection) -> None:
+        """Register open connection.
+
+        :param ws: WebSocket connection object
+        :type ws: WebSocketConnection
+        """
+        self.connections.add(ws)
+
+    def remove(self, ws: WebSocketConnection) -> None:
+        """Unregister closed connection.
+
+        :param ws: WebSocket connection object
+        :type ws: WebSocketConnection
+        """
+        self.connections.discard(ws)
+        if self.draining and not self.connections:
+            self._empty.set()
+
+    def load_report(self, host: str, port: int, capacity: int) -> Dict[str, Any]:
+        """Build load report.
+
+        CPU usage is fraction of single core used by the process since the
+        previous report, queue is number of runnable tasks in trio scheduler.
+
+        :param host: advertised host
+        :type host: str
+        :param port: advertised port
+        :type port: int
+        :param capacity: maximum number of connections
+        :type capacity: int
+        :rtype: Dict[str, Any]
+        """
+        wall, cpu = time.monotonic(), time.process_time()
+        last_wall, last_cpu = self._cpu_sample
+        self._cpu_sample = (wall, cpu)
+        usage = (cpu - last_cpu) / (wall - last_wall) if wall > last_wall else 0.0
+        return {
+            "host": host,
+            "port": port,
+            "state": self.state,
+            "connections": len(self.connections),
+            "capacity": capacity,
+            "cpu": round(usage, 3),
+            "queue": trio.lowlevel.current_statistics().tasks_runnable,
+            "updated": time.time(),
+        }
+
+    async def report(
+        self, host: str, port: int, capacity: int, interval: float = REPORT_INTERVAL
+    ) -> None:
+        """Background task that periodically stores load report.
+
+        Report is removed from shared state when task is cancelled.
+
+        :param host: advertised host
+        :type host: str
+        :param port: advertised port
+        :type port: int
+        :param capacity: maximum number of connections
+        :type capacity: int
+        :param interval: report interval in seconds, defaults to
+                         ``REPORT_INTERVAL``
+        :type interval: float, optional
+        """
+        stale = interval * REPORT_STALE_INTERVALS
+        try:
+            while True:
+                report = self.load_report(host, port, capacity)
+                try:
+                    await storage.report_node(
+                        self.node_id,
+                        report,
+                        math.ceil(stale),
+                        report["updated"] - stale,
+                    )
+                except Exception:
+                    log.exception("failed to store node load report")
+                await trio.sleep(interval)
+        finally:
+            with trio.CancelScope(shield=True), trio.move_on_after(1):
+                try:
+                    await storage.remove_node(self.node_id)
+                except Exception:
+                    log.exception("failed to remove node load report")
+
+    async def _close(self, ws: WebSocketConnection) -> None:
+        try:
+            await ws.aclose(code=CLOSE_CODE_RECONNECT, reason=CLOSE_REASON_RECONNECT)
+        except Exception:
+            log.exception("error closing connection")
+
+    async def drain(self) -> None:
+        """Close all connections in jittered waves and wait until all are gone.
+
+        Connections are closed in random order. New connections must be
+        rejected by connection handler once :attr:`draining` is set. Drain
+        ends as soon as the last connection is gone, also between waves.
+        """
+        self.draining = True
+        ttl = int(self.period + DRAIN_GRACE) + 60
+        try:
+            await storage.set_node_state(self.node_id, NODE_STATE_DRAINING, ttl)
+        except Exception:
+            log.exception("failed to mark node as draining")
+        if not self.connections:
+            log.warning("drain finished, no connections")
+            return
+        pending = list(self.connections)
+        random.shuffle(pending)
+        schedule = drain_schedule(len(pending), self.period, self.waves)
+        log.warning(
+            f"draining {len(pending)} connections in {len(schedule)} waves"
+            f" over {self.period}s"
+        )
+        wave_size = math.ceil(len(pending) / len(schedule))
+        started = trio.current_time()
+        async with trio.open_nursery() as nursery:
+            for i, offset in enumerate(schedule):
+                with trio.move_on_at(started + offset):
+                    await self._empty.wait()
+                if self._empty.is_set():
+                    break
+                start = i * wave_size
+                end = start + wave_size
+                for ws in pending[start:end]:
+                    if ws in self.connections:
+                        nursery.start_soon(self._close, ws)
+        if self.connections:
+            with trio.move_on_after(DRAIN_GRACE):
+                await self._empty.wait()
+        log.warning(f"drain finished, {len(self.connections)} connections left")
+
+    async def run(
+        self,
+        cancel_scope: trio.CancelScope,
+        signum: Optional[int] = None,
+        *,
+        task_status=trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        """Wait for drain signal, drain and cancel server scope.
+
+        :param cancel_scope: server cancel scope, cancelled when drain is
+                             finished or on second signal
+        :type cancel_scope: trio.CancelScope
+        :param signum: drain signal number, defaults to ``CHITTY_DRAIN_SIGNAL``
+        :type signum: Optional[int], optional
+        """
+        if signum is None:
+            signum = getattr(signal, DRAIN_SIGNAL)
+        with trio.open_signal_receiver(signum) as signals:
+            task_status.started()
+            async with trio.open_nursery() as nursery:
+                async for _ in signals:
+                    if self.draining:
+                        log.warning("second drain signal, exiting")
+                        cancel_scope.cancel()
+                        return
+                    nursery.start_soon(self._drain_and_exit, cancel_scope)
+
+    async def _drain_and_exit(self, cancel_scope: trio.CancelScope) -> None:
+        try:
+            await self.drain()
+        finally:
+            cancel_scope.cancel()
+
+
+node = Node()
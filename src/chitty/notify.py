@@ -0,0 +1,152 @@
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping
+
+import trio
+
+from .event import SYS_USER_DATA
+from .message import BACKLOG_SIZE, MSG_TYPE_NOTIFICATION, Message, make_message
+from .storage import storage
+
+NOTIFY_WINDOW = float(os.getenv("CHITTY_NOTIFY_WINDOW", "2.0"))
+NOTIFY_QUIET = float(os.getenv("CHITTY_NOTIFY_QUIET", "10.0"))
+
+MAX_REFS = 20
+
+KIND_REPLY = "reply"
+KIND_MENTION = "mention"
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingNotifications:
+    since: float
+    counts: Dict[str, int] = field(default_factory=dict)
+    refs: List[Mapping[str, str]] = field(default_factory=list)
+
+    def add(self, kind: str, ref: Mapping[str, str]) -> None:
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self.refs) < MAX_REFS:
+            self.refs.append({"kind": kind, **ref})
+
+
+def _summary_text(counts: Mapping[str, int]) -> str:
+    parts = []
+    for kind, singular, plural in (
+        (KIND_REPLY, "reply", "replies"),
+        (KIND_MENTION, "mention", "mentions"),
+    ):
+        count = counts.get(kind, 0)
+        if count:
+            parts.append(f"{count} {singular if count == 1 else plural}")
+    return f"You've got {' and '.join(parts)}"
+
+
+def make_notification(recipient: str, pending: PendingNotifications) -> Message:
+    """Build notification summary message for recipient.
+
+    :param recipient: recipient user name
+    :type recipient: str
+    :param pending: collected notifications
+    :type pending: PendingNotifications
+    :return: notification message published to recipient personal topic
+    :rtype: Message
+    """
+    return make_message(
+        SYS_USER_DATA,
+        recipient,
+        _summary_text(pending.counts),
+        type=MSG_TYPE_NOTIFICATION,
+        counts=pending.counts,
+        refs=pending.refs,
+    )
+
+
+class NotificationAggregator:
+    """Collect reply and mention notifications per recipient.
+
+    First notification after ``quiet`` seconds without any is delivered
+    immediately. Notifications that come later are collected for ``window``
+    seconds and delivered as single summary message with counts and message
+    references. All due summaries are published in single pipeline.
+
+    :param window: aggregation window in seconds
+    :type window: float
+    :param quiet: quiet period after which notification is delivered
+                  immediately, in seconds
+    :type quiet: float
+    """
+
+    def __init__(self, window: float = NOTIFY_WINDOW, quiet: float = NOTIFY_QUIET):
+        self.window = window
+        self.quiet = quiet
+        self._pending: Dict[str, PendingNotifications] = {}
+        self._delivered: Dict[str, float] = {}
+
+    async def notify(self, recipient: str, kind: str, ref: Mapping[str, str]) -> None:
+        """Deliver or collect notification.
+
+        :param recipient: recipient user name
+        :type recipient: str
+        :param kind: notification kind
+        :type kind: str
+        :param ref: reference to message that caused notification
+        :type ref: Mapping[str, str]
+        """
+        now = time.monotonic()
+        pending = self._pending.get(recipient)
+        if pending is None:
+            pending = PendingNotifications(since=now)
+            pending.add(kind, ref)
+            last = self._delivered.get(recipient)
+            if last is None or now - last >= self.quiet:
+                self._delivered[recipient] = now
+                await make_notification(recipient, pending).publish()
+                return
+            self._pending[recipient] = pending
+        else:
+            pending.add(kind, ref)
+
+    async def flush(self) -> int:
+        """Publish summaries for recipients whose window has closed.
+
+        :return: number of published summaries
+        :rtype: int
+        """
+        now = time.monotonic()
+        due = [
+            recipient
+            for recipient, pending in self._pending.items()
+            if now - pending.since >= self.window
+        ]
+        stale = [
+            recipient
+            for recipient, last in self._delivered.items()
+            if now - last >= self.quiet and recipient not in self._pending
+        ]
+        for recipient in stale:
+            del self._delivered[recipient]
+        if not due:
+            return 0
+        messages = []
+        for recipient in due:
+            message = make_notification(recipient, self._pending.pop(recipient))
+            self._delivered[recipient] = now
+            messages.append((message.topic, message.serialised_payload))
+        await storage.publish_sequenced_many(messages, BACKLOG_SIZE)
+        return len(due)
+
+    async def run(self) -> None:
+        """Background task that periodically publishes notification summaries."""
+        while True:
+            await trio.sleep(self.window / 2)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("notifications flush failed")
+
+
+aggregator = NotificationAggregator()
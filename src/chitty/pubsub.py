@@ -0,0 +1,74 @@
+"""Publish/subscribe receivers.
+
+This module imports redio, it is loaded by chat server on first use.
+
+:class:`TopicPubSub` extends redio receiver through its private attributes
+(``_sub``, ``_psub``, ``_messages``, ``protocol._command`` and
+``Redis._borrow_connection``), redio version is pinned in ``setup.py`` for
+that reason.
+"""
+
+from redio.conv import encode
+from redio.pubsub import PubSub
+
+from .storage import redio_client
+
+
+class TopicPubSub(PubSub):
+    """Publish/subscribe receiver that can also leave channels.
+
+    Redio receiver only supports subscribing. Unsubscription is queued the
+    same way and takes effect on next ``await``. Messages received while
+    waiting for subscription replies are kept for the next ``await``.
+    """
+
+    def __init__(self, protocol, *channels):
+        self._unsub = set()
+        super().__init__(protocol, *channels)
+
+    def subscribe(self, *channels):
+        """Subscribe to receive channels. Takes effect on `await`."""
+        self._unsub.difference_update(encode(a) for a in channels)
+        return super().subscribe(*channels)
+
+    def unsubscribe(self, *channels):
+        """Stop receiving from channels. Takes effect on `await`."""
+        for channel in map(encode, channels):
+            self._sub.discard(channel)
+            if channel.decode() in self.subscribed:
+                self._unsub.add(channel)
+        return self
+
+    async def _subscribe(self):
+        # replaces redio loop, that fails when message published to already
+        # subscribed channel arrives before the first subscription reply
+        if self._unsub:
+            self.protocol._command([b"UNSUBSCRIBE", *self._unsub])
+        if self._sub:
+            self.protocol._command([b"SUBSCRIBE", *self._sub])
+        if self._psub:
+            self.protocol._command([b"PSUBSCRIBE", *self._psub])
+        await self.protocol.send_all()
+        while self._unsub or self._sub or self._psub:
+            res = await self.protocol.receive()
+            if res[0] == b"unsubscribe":
+                self.subscribed.discard(res[1].decode())
+                self._unsub.discard(res[1])
+            elif res[0] == b"subscribe":
+                self.subscribed.add(res[1].decode())
+                self._sub.discard(res[1])
+            elif res[0] == b"psubscribe":
+                self.psubscribed.add(res[1].decode())
+                self._psub.discard(res[1])
+            else:
+                self._messages.append(res)
+
+
+def open_pubsub(*channels: str) -> TopicPubSub:
+    """Create receiver on shared redio connection pool.
+
+    :param channels: channels to subscribe
+    :type channels: str
+    :rtype: TopicPubSub
+    """
+    return TopicPubSub(redio_client()._borrow_connection(), *channels)
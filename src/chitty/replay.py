@@ -0,0 +1,377 @@
+"""Replay of captured traffic against test server.
+
+Capture written by :mod:`chitty.capture` is replayed with the original
+timing (speed 1), ten times faster (speed 10) or as fast as possible (speed
+``max``). Every captured connection is opened as separate client
+connection, as the user with the captured pseudonym, so concurrency follows
+the original run. Test server must share ``CHITTY_SECRET_KEY`` with replay
+tool, pseudonym accounts can be created in test server storage first.
+
+Every replayed message gets ``requestId``, latency is measured from send to
+response with the same request ID. Report compares latency percentiles and
+error rates with handling results recorded in capture. Original latency is
+measured by server from receive to response, so replayed latency is
+higher by network round trip.
+"""
+
+import logging
+import math
+import secrets
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+import trio
+from trio_websocket import ConnectionClosed, HandshakeError, open_websocket_url
+
+from . import codec
+from .capture import (
+    EVENT_CLOSE,
+    EVENT_MALFORMED,
+    EVENT_MESSAGE,
+    EVENT_OPEN,
+    EVENT_RESULT,
+    read_capture,
+)
+from .message import MSG_TYPE_DIRECT_MESSAGE
+from .services.auth import get_token
+
+SPEEDS = {"1": 1.0, "10": 10.0, "max": None}
+
+REQUEST_ID_FIELD = "requestId"
+ERROR_STATUS = "error"
+# time to wait for responses after connection sent its last message
+RESPONSE_TIMEOUT = 10.0
+
+SUBPROTOCOLS = {
+    codec.FORMAT_JSON: codec.SUBPROTOCOL_JSON,
+    codec.FORMAT_MSGPACK: codec.SUBPROTOCOL_MSGPACK,
+}
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Capture:
+    """Loaded capture.
+
+    :ivar records: connection events and messages in time order
+    :type records: List[List[Any]]
+    :ivar latencies: handling latencies recorded by server in milliseconds
+    :type latencies: List[float]
+    :ivar errors: number of error responses sent by server
+    :type errors: int
+    :ivar users: pseudonyms of connected users and message recipients
+    :type users: Set[str]
+    """
+
+    records: List[List[Any]] = field(default_factory=list)
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    users: Set[str] = field(default_factory=set)
+
+    @property
+    def duration(self) -> float:
+        return self.records[-1][1] if self.records else 0.0
+
+
+def load_capture(path: str) -> Capture:
+    """Read capture file.
+
+    :param path: capture file path
+    :type path: str
+    :rtype: Capture
+    """
+    capture = Capture()
+    _, records = read_capture(path)
+    for record in records:
+        event = record[0]
+        if event == EVENT_RESULT:
+            capture.latencies.append(record[3])
+            capture.errors += record[4]
+            continue
+        if event == EVENT_OPEN:
+            capture.users.add(record[3])
+        elif event == EVENT_MESSAGE:
+            payload = record[3]
+            if payload.get("type") == MSG_TYPE_DIRECT_MESSAGE:
+                to = payload.get("to")
+                capture.users.update(to if isinstance(to, list) else [to])
+        capture.records.append(record)
+    capture.records.sort(key=lambda record: record[1])
+    capture.users = {name for name in capture.users if isinstance(name, str)}
+    return capture
+
+
+@dataclass
+class ReplayStats:
+    """Results of replay.
+
+    :ivar latencies: response latencies in milliseconds, including error
+                     responses
+    :type latencies: List[float]
+    :ivar errors: number of error responses
+    :type errors: int
+    :ivar timeouts: number of requests without response
+    :type timeouts: int
+    :ivar connect_errors: number of connections that could not be opened
+    :type connect_errors: int
+    """
+
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    timeouts: int = 0
+    connect_errors: int = 0
+    duration: float = 0.0
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile.
+
+    :param values: values
+    :type values: List[float]
+    :param pct: percentile, 0 to 100
+    :type pct: float
+    :return: percentile value or None if there are no values
+    :rtype: Optional[float]
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, total: int) -> Dict[str, Any]:
+    """Summary of request results.
+
+    :param latencies: latencies of completed requests in milliseconds
+    :type latencies: List[float]
+    :param errors: number of failed requests
+    :type errors: int
+    :param total: number of requests
+    :type total: int
+    :rtype: Dict[str, Any]
+    """
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def format_report(capture: Capture, stats: ReplayStats, speed: str) -> str:
+    """Format comparison of original run and replay.
+
+    :param capture: loaded capture
+    :type capture: Capture
+    :param stats: replay results
+    :type stats: ReplayStats
+    :param speed: replay speed
+    :type speed: str
+    :rtype: str
+    """
+    original = summarize(capture.latencies, capture.errors, len(capture.latencies))
+    replayed = summarize(
+        stats.latencies,
+        stats.errors + stats.timeouts,
+        len(stats.latencies) + stats.timeouts,
+    )
+
+    def fmt(value: Any, spec: str) -> str:
+        return "-" if value is None else format(value, spec)
+
+    lines = [
+        f"replay speed {speed}: {stats.duration:.1f}s,"
+        f" original run {capture.duration:.1f}s",
+        f"{'':16}{'original':>12}{'replay':>12}",
+        f"{'requests':16}{original['requests']:>12}{replayed['requests']:>12}",
+        f"{'errors':16}{original['errors']:>12}{replayed['errors']:>12}",
+        f"{'error rate':16}{original['error_rate']:>12.2%}"
+        f"{replayed['error_rate']:>12.2%}",
+    ]
+    for key in ("p50", "p95", "p99"):
+        label = f"{key} ms"
+        lines.append(
+            f"{label:16}{fmt(original[key], '.2f'):>12}{fmt(replayed[key], '.2f'):>12}"
+        )
+    lines.append(f"{'timeouts':16}{'-':>12}{stats.timeouts:>12}")
+    lines.append(f"{'connect errors':16}{'-':>12}{stats.connect_errors:>12}")
+    return "\n".join(lines)
+
+
+class PendingRequests:
+    """Send times of requests of one connection that wait for response."""
+
+    def __init__(self):
+        self.sent: Dict[str, float] = {}
+        self._empty: Optional[trio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self.sent)
+
+    def add(self, request_id: str) -> None:
+        self.sent[request_id] = trio.current_time()
+
+    def pop(self, request_id: Any) -> Optional[float]:
+        sent = self.sent.pop(request_id, None)
+        if not self.sent and self._empty is not None:
+            self._empty.set()
+        return sent
+
+    async def wait_empty(self) -> None:
+        """Wait until all requests got response."""
+        if self.sent:
+            self._empty = trio.Event()
+            await self._empty.wait()
+
+
+class Replayer:
+    """Replays captured connections against server.
+
+    :param url: server URL, e.g. ``ws://127.0.0.1:5000``
+    :type url: str
+    :param speed: time scale factor, None replays as fast as possible
+    :type speed: Optional[float]
+    :param timeout: time to wait for outstanding responses, defaults to
+                    ``RESPONSE_TIMEOUT``
+    :type timeout: float, optional
+    """
+
+    def __init__(
+        self, url: str, speed: Optional[float], timeout: float = RESPONSE_TIMEOUT
+    ):
+        self.url = url.rstrip("/")
+        self.speed = speed
+        self.timeout = timeout
+        self.stats = ReplayStats()
+        self._request_count = 0
+
+    def _request_id(self) -> str:
+        self._request_count += 1
+        return f"r{self._request_count}"
+
+    async def run(self, capture: Capture) -> ReplayStats:
+        """Replay capture and collect results.
+
+        :param capture: loaded capture
+        :type capture: Capture
+        :rtype: ReplayStats
+        """
+        channels: Dict[int, trio.MemorySendChannel] = {}
+        started = trio.current_time()
+        async with trio.open_nursery() as nursery:
+            for record in capture.records:
+                event, offset, conn = record[:3]
+                if self.speed is not None:
+                    await trio.sleep_until(started + offset / self.speed)
+                if event == EVENT_OPEN:
+                    send_channel, receive_channel = trio.open_memory_channel(math.inf)
+                    channels[conn] = send_channel
+                    nursery.start_soon(
+                        self._connection, record[3], record[4], receive_channel
+                    )
+                elif event == EVENT_CLOSE:
+                    send_channel = channels.pop(conn, None)
+                    if send_channel is not None:
+                        await send_channel.aclose()
+                elif conn in channels:
+                    channels[conn].send_nowait(record)
+            for send_channel in channels.values():
+                await send_channel.aclose()
+        self.stats.duration = trio.current_time() - started
+        return self.stats
+
+    async def _connection(
+        self, user: str, fmt: str, records: trio.MemoryReceiveChannel
+    ) -> None:
+        pending = PendingRequests()
+        url = f"{self.url}/{get_token(user)}"
+        async with records:
+            try:
+                async with open_websocket_url(
+                    url, subprotocols=[SUBPROTOCOLS[fmt]]
+                ) as ws:
+                    async with trio.open_nursery() as nursery:
+                        nursery.start_soon(self._receive, ws, pending)
+                        async for record in records:
+                            await self._send(ws, fmt, record, pending)
+                        with trio.move_on_after(self.timeout):
+                            await pending.wait_empty()
+                        nursery.cancel_scope.cancel()
+            except (OSError, HandshakeError):
+                log.exception(f"connection of {user} failed")
+                self.stats.connect_errors += 1
+                async for _ in records:
+                    pass
+            except ConnectionClosed:
+                log.warning(f"connection of {user} closed by server")
+        self.stats.timeouts += len(pending)
+
+    async def _send(
+        self,
+        ws,
+        fmt: str,
+        record: List[Any],
+        pending: PendingRequests,
+    ) -> None:
+        if record[0] == EVENT_MALFORMED:
+            await ws.send_message(b"\xc1" * record[3])
+        elif record[0] == EVENT_MESSAGE:
+            request_id = self._request_id()
+            payload = {**record[3], REQUEST_ID_FIELD: request_id}
+            pending.add(request_id)
+            await ws.send_message(codec.encode(payload, fmt))
+
+    async def _receive(self, ws, pending: PendingRequests) -> None:
+        while True:
+            payload = codec.decode(await ws.get_message())
+            if not isinstance(payload, dict):
+                continue
+            sent = pending.pop(payload.get(REQUEST_ID_FIELD))
+            if sent is None:
+                continue
+            self.stats.latencies.append((trio.current_time() - sent) * 1000)
+            if payload.get("status") == ERROR_STATUS:
+                self.stats.errors += 1
+
+
+def create_users(names: Set[str]) -> int:
+    """Create missing accounts for pseudonyms in web application storage.
+
+    All accounts get the same random password nobody knows.
+
+    :param names: user pseudonyms
+    :type names: Set[str]
+    :return: number of created accounts
+    :rtype: int
+    """
+    from .web.services import Storage, hash_password
+
+    store = Storage()
+    names_list = sorted(names)
+    missing = [
+        name
+        for name, exists in zip(names_list, store.users_exist(names_list))
+        if not exists
+    ]
+    if missing:
+        password = hash_password(secrets.token_urlsafe())
+        store.add_users((name, password, get_token(name)) for name in missing)
+    return len(missing)
+
+
+async def main(capture: Capture, url: str, speed: str) -> ReplayStats:
+    """Replay entrypoint.
+
+    :param capture: loaded capture
+    :type capture: Capture
+    :param url: server URL
+    :type url: str
+    :param speed: replay speed, one of ``SPEEDS`` keys
+    :type speed: str
+    :rtype: ReplayStats
+    """
+    return await Replayer(url, SPEEDS[speed]).run(capture)
@@ -0,0 +1,144 @@
+"""Garbage collection of idle topics and stale subscriptions.
+
+Topics are created implicitly on first subscription or post and otherwise
+live forever, together with their directory entry, sequence counter and
+backlog. Collector periodically expires topics without activity for
+``CHITTY_TOPIC_TTL`` seconds, and walks user subscription sets with
+incremental ``SCAN`` to remove memberships of topics that no longer exist.
+Each run processes a bounded batch so the work is spread across runs
+instead of blocking Redis.
+"""
+
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import trio
+
+from . import keys
+from .storage import storage
+from .topic import DEFAULT_TOPICS, SYSTEM_TOPIC_PREFIX
+
+TOPIC_TTL = float(os.getenv("CHITTY_TOPIC_TTL", str(30 * 24 * 3600)))
+GC_INTERVAL = float(os.getenv("CHITTY_GC_INTERVAL", "300"))
+GC_BATCH_SIZE = int(os.getenv("CHITTY_GC_BATCH_SIZE", "100"))
+
+log = logging.getLogger(__name__)
+
+
+def is_protected(topic: str) -> bool:
+    """Check if topic is never expired.
+
+    :param topic: topic name
+    :type topic: str
+    :rtype: bool
+    """
+    return topic in DEFAULT_TOPICS or topic.startswith(SYSTEM_TOPIC_PREFIX)
+
+
+class TopicCollector:
+    """Periodic collector of idle topics and stale user subscriptions.
+
+    :ivar ttl: idle time after which topic is expired, in seconds
+    :type ttl: float
+    :ivar interval: time between collection runs, in seconds
+    :type interval: float
+    :ivar batch_size: maximum number of topics and users processed in run
+    :type batch_size: int
+    """
+
+    def __init__(
+        self,
+        ttl: float = TOPIC_TTL,
+        interval: float = GC_INTERVAL,
+        batch_size: int = GC_BATCH_SIZE,
+    ):
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self._cursor = 0
+
+    async def expire_topics(self, now: Optional[float] = None) -> int:
+        """Expire batch of topics idle for longer than TTL.
+
+        Protected topics found idle get their activity refreshed so they do
+        not occupy the batch in later runs.
+
+        :param now: current time, defaults to wall clock
+        :type now: Optional[float], optional
+        :return: number of expired topics
+        :rtype: int
+        """
+        now = time.time() if now is None else now
+        before = now - self.ttl
+        topics = await storage.idle_topics(before, self.batch_size)
+        expired: Dict[str, bool] = {}
+
+        async def expire(topic: str) -> None:
+            expired[topic] = await storage.expire_topic(topic, before)
+
+        async with trio.open_nursery() as nursery:
+            for topic in topics:
+                if is_protected(topic):
+                    nursery.start_soon(storage.touch_topic, topic, now)
+                else:
+                    nursery.start_soon(expire, topic)
+        count = sum(expired.values())
+        if count:
+            log.info(f"expired {count} idle topics")
+        return count
+
+    async def prune_subscriptions(self) -> int:
+        """Remove memberships of unregistered topics from one batch of users.
+
+        Scan cursor is kept between calls, so consecutive calls walk all user
+        subscription sets.
+
+        :return: number of removed memberships
+        :rtype: int
+        """
+        cursor, batch = await storage.scan(
+            self._cursor, f"{keys.TOPICS}:*", self.batch_size
+        )
+        self._cursor = cursor
+        removed: List[int] = []
+
+        async def prune(key: str) -> None:
+            name = key.split(":", 1)[1]
+            topics = [
+                topic
+                for topic in await storage.get_user_topics(name)
+                if topic != name and not is_protected(topic)
+            ]
+            if not topics:
+                return
+            exists = await storage.topics_exist(topics)
+            stale = [topic for topic, found in zip(topics, exists) if not found]
+            if stale:
+                removed.append(await storage.remove_subscriptions(name, stale))
+
+        async with trio.open_nursery() as nursery:
+            for key in batch:
+                nursery.start_soon(prune, key)
+        count = sum(removed)
+        if count:
+            log.info(f"removed {count} stale subscriptions")
+        return count
+
+    async def collect(self) -> None:
+        """Run single collection pass."""
+        await self.expire_topics()
+        await self.prune_subscriptions()
+
+    async def run(self) -> None:
+        """Background task that periodically collects idle topics."""
+        while True:
+            await trio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception:
+                log.exception("topic collection failed")
+
+
+collector = TopicCollector()
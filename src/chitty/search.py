@@ -0,0 +1,193 @@
+"""Full-text message search index.
+
+Chat messages are stored in local SQLite database with FTS5 full-text
+index over message text. Database is written by background indexer
+(:mod:`chitty.indexer`) and read by web service search endpoint, it is
+opened in WAL mode so readers are not blocked by indexer transactions.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Mapping, Optional, Union
+
+SEARCH_DB = os.getenv("CHITTY_SEARCH_DB", "search.db")
+
+MAX_LIMIT = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    date REAL NOT NULL,
+    message TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_topic_date ON messages (topic, date);
+CREATE INDEX IF NOT EXISTS messages_sender_date ON messages (sender, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message, content='messages', content_rowid='id'
+);
+"""
+
+
+@dataclass
+class IndexEntry:
+    topic: str
+    sender: str
+    date: float
+    message: str
+    payload: str
+
+
+@dataclass
+class SearchHit:
+    id: int
+    topic: str
+    sender: str
+    date: float
+    message: str
+    payload: str
+
+    def to_map(self) -> Mapping[str, Union[int, float, str, Any]]:
+        return {
+            "id": self.id,
+            "topic": self.topic,
+            "from": self.sender,
+            "date": self.date,
+            "message": json.loads(self.payload),
+        }
+
+
+def make_query(text: str) -> str:
+    """Build FTS5 query from user supplied search text.
+
+    Every word is quoted so FTS5 query syntax can not be injected, and
+    message has to contain all words to match.
+
+    :param text: search text
+    :type text: str
+    :return: FTS5 match expression
+    :rtype: str
+    """
+    words = text.split()
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+class SearchIndex:
+    """SQLite full-text message index.
+
+    Connection is created per thread, so single index object can be shared
+    by web service worker threads.
+
+    :param path: database file path, defaults to :data:`SEARCH_DB`
+    :type path: str, optional
+    """
+
+    def __init__(self, path: str = SEARCH_DB):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+        return conn
+
+    def add(self, entries: Iterable[IndexEntry]) -> int:
+        """Add messages to index in single transaction.
+
+        :param entries: messages to index
+        :type entries: Iterable[IndexEntry]
+        :return: number of indexed messages
+        :rtype: int
+        """
+        count = 0
+        with self.db as db:
+            for entry in entries:
+                cur = db.execute(
+                    "INSERT INTO messages (topic, sender, date, message, payload) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        entry.topic,
+                        entry.sender,
+                        entry.date,
+                        entry.message,
+                        entry.payload,
+                    ),
+                )
+                db.execute(
+                    "INSERT INTO messages_fts (rowid, message) VALUES (?, ?)",
+                    (cur.lastrowid, entry.message),
+                )
+                count += 1
+        return count
+
+    def search(
+        self,
+        text: str,
+        *,
+        topic: Optional[str] = None,
+        sender: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+    ) -> List[SearchHit]:
+        """Find messages that contain all words of search text.
+
+        Results are ordered from the newest, to get older results repeat
+        search with ``until`` set to date of the oldest returned message.
+
+        :param text: search text
+        :type text: str
+        :param topic: limit results to topic, defaults to None
+        :type topic: Optional[str], optional
+        :param sender: limit results to messages from user, defaults to None
+        :type sender: Optional[str], optional
+        :param since: minimum message timestamp, defaults to None
+        :type since: Optional[float], optional
+        :param until: maximum message timestamp (exclusive), defaults to None
+        :type until: Optional[float], optional
+        :param limit: maximum number of results, defaults to 50
+        :type limit: int, optional
+        :return: matching messages
+        :rtype: List[SearchHit]
+        """
+        query = make_query(text)
+        if not query:
+            return []
+        clauses = ["messages_fts MATCH ?"]
+        params: List[Any] = [query]
+        if topic is not None:
+            clauses.append("m.topic = ?")
+            params.append(topic)
+        if sender is not None:
+            clauses.append("m.sender = ?")
+            params.append(sender)
+        if since is not None:
+            clauses.append("m.date >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("m.date < ?")
+            params.append(until)
+        params.append(min(limit, MAX_LIMIT))
+        rows = self.db.execute(
+            "SELECT m.id, m.topic, m.sender, m.date, m.message, m.payload "
+            "FROM messages_fts JOIN messages AS m ON m.id = messages_fts.rowid "
+            f"WHERE {' AND '.join(clauses)} ORDER BY m.date DESC LIMIT ?",
+            params,
+        )
+        return [SearchHit(*row) for row in rows]
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
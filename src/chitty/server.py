@@ -1,18 +1,34 @@
-import json
+import functools
 import logging
 import os
+import ssl
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
 
 import trio
 from trio_websocket import (
     ConnectionClosed,
     WebSocketConnection,
     WebSocketRequest,
+    WebSocketServer,
     serve_websocket,
 )
 
-from . import errors
-from .controller import route_message
+from . import codec, ephemeral, errors, notify, tls, tracing
+from .capture import capture
+from .controller import message_lane, route_message
+from .filters import content_filter
+from .markers import read_markers
+from .message import (
+    MSG_TYPE_ACK,
+    MSG_TYPE_PRESENCE,
+    MSG_TYPE_UNREAD,
+    make_ephemeral_message,
+)
+from .node import advertised_address, node
+from .retention import collector
 from .services.auth import ResultType, check_token
+from .topic import PRESENCE_TOPIC
 from .user import User, registry
 from .utils import error_response
 
@@ -21,6 +37,16 @@ MAX_CLIENTS = int(os.getenv("WS_MAX_CLIENTS", "16"))
 MAX_MESSAGE_SIZE = 2**16  # 64 KB
 MESSAGE_QUEUE_SIZE = 4
 
+MAX_INFLIGHT = int(os.getenv("CHITTY_MAX_INFLIGHT", "8"))
+
+REQUEST_ID_FIELD = "requestId"
+
+OUTBOUND_QUEUE_SIZE = int(os.getenv("CHITTY_OUTBOUND_QUEUE_SIZE", "32"))
+EPHEMERAL_DROP_THRESHOLD = OUTBOUND_QUEUE_SIZE // 2
+
+PRESENCE_ONLINE = "online"
+PRESENCE_OFFLINE = "offline"
+
 log = logging.getLogger(__name__)
 
 STATS = {
@@ -34,76 +60,267 @@ def _post_close_cleanup(client: str) -> None:
     logging.warning(f"client connection for {client} closed")
 
 
-async def ws_message_processor(ws: WebSocketConnection, user: User) -> None:
-    """Task that reads and routes messages from WebSocket connection.
+async def send_response(ws: WebSocketConnection, payload: Any, fmt: str) -> None:
+    """Send response structure to client in its wire format.
 
     :param ws: WebSocket connection object
     :type ws: WebSocketConnection
-    :param client: client ID from request
-    :type client: str
+    :param payload: response structure
+    :type payload: Any
+    :param fmt: connection wire format
+    :type fmt: str
     """
-    while True:
+    await ws.send_message(codec.encode(payload, fmt))
+
+
+class InboundLanes:
+    """Bounded concurrent execution of inbound messages of one connection.
+
+    Messages for different lanes (target topics) are handled concurrently,
+    messages for the same lane are handled in order they were received. At
+    most ``limit`` messages are in flight, :meth:`submit` blocks when the
+    limit is reached, so connection reader stops reading and WebSocket
+    message queue provides backpressure.
+
+    :param nursery: nursery that runs handler tasks
+    :type nursery: trio.Nursery
+    :param limit: maximum number of messages in flight, defaults to
+                  ``MAX_INFLIGHT``
+    :type limit: int, optional
+    """
+
+    def __init__(self, nursery: trio.Nursery, limit: int = MAX_INFLIGHT):
+        self.nursery = nursery
+        self._slots = trio.Semaphore(limit)
+        self._tails: Dict[str, trio.Event] = {}
+
+    async def submit(self, lane: str, fn: Callable[[], Awaitable[None]]) -> None:
+        """Schedule message handling in lane.
+
+        :param lane: lane key
+        :type lane: str
+        :param fn: message handling function
+        :type fn: Callable[[], Awaitable[None]]
+        """
+        await self._slots.acquire()
+        previous = self._tails.get(lane)
+        done = self._tails[lane] = trio.Event()
+        self.nursery.start_soon(self._run, lane, previous, done, fn)
+
+    async def _run(
+        self,
+        lane: str,
+        previous: Optional[trio.Event],
+        done: trio.Event,
+        fn: Callable[[], Awaitable[None]],
+    ) -> None:
         try:
+            if previous is not None:
+                await previous.wait()
+            await fn()
+        finally:
+            done.set()
+            if self._tails.get(lane) is done:
+                del self._tails[lane]
+            self._slots.release()
+
+
+def _with_request_id(payload: Any, request_id: Union[str, int, None]) -> Any:
+    if request_id is None or not isinstance(payload, dict):
+        return payload
+    return {**payload, REQUEST_ID_FIELD: request_id}
+
+
+async def _handle_message(
+    ws: WebSocketConnection,
+    user: User,
+    fmt: str,
+    payload: dict,
+    request_id: Union[str, int, None],
+    trace_id: Optional[str],
+    received: float,
+) -> None:
+    token = tracing.current_trace.set(trace_id)
+    resp = None
+    try:
+        try:
+            resp = await route_message(user, payload)
+            log.debug("message processed")
+            if not resp and request_id is not None:
+                resp = {"type": MSG_TYPE_ACK}
+            if resp:
+                await send_response(ws, _with_request_id(resp, request_id), fmt)
+        except errors.ChatMessageException as e:
+            resp = error_response(errors.E_REASON_TYPE_INVALID, message=str(e))
+            log.exception("message routing error")
+            await send_response(ws, _with_request_id(resp, request_id), fmt)
+    except ConnectionClosed:
+        # reader task sees the same close and ends the connection, raising
+        # here as well would turn it into a MultiError
+        log.debug("connection closed before response was sent")
+    finally:
+        tracing.current_trace.reset(token)
+        if capture.enabled:
+            error = isinstance(resp, dict) and resp.get("status") == "error"
+            capture.result(ws, received, error)
+
+
+async def ws_message_processor(
+    ws: WebSocketConnection, user: User, fmt: str = codec.FORMAT_JSON
+) -> None:
+    """Task that reads and routes messages from WebSocket connection.
+
+    Messages are handled concurrently in per-topic lanes by
+    :class:`InboundLanes`, so messages for the same topic are processed in
+    order. Client may add ``requestId`` (string or integer) to message, it is
+    then added to response, and handlers that do not respond send ``ack``
+    message instead. Inbound messages are recorded when traffic capture is
+    enabled, see :mod:`chitty.capture`.
+
+    :param ws: WebSocket connection object
+    :type ws: WebSocketConnection
+    :param user: connected user object
+    :type user: User
+    :param fmt: connection wire format, defaults to ``json``
+    :type fmt: str, optional
+    """
+    async with trio.open_nursery() as nursery:
+        lanes = InboundLanes(nursery)
+        while True:
             message = await ws.get_message()
+            received = time.monotonic()
             try:
-                payload = json.loads(message)
-            except json.decoder.JSONDecodeError:
+                payload = codec.decode(message)
+                if not isinstance(payload, dict):
+                    raise codec.DecodeError("expected object")
+            except codec.DecodeError:
+                if capture.enabled:
+                    capture.malformed(ws, len(message))
                 payload = error_response(
                     errors.E_REASON_MALFORMED,
                     message="Invalid message, expected: object",
                 )
                 log.exception("malformed message")
-                await ws.send_message(json.dumps(payload))
-            else:
-                try:
-                    resp = await route_message(user, payload)
-                    log.debug("message processed")
-                    if resp:
-                        await ws.send_message(json.dumps(resp))
-                except errors.ChatMessageException as e:
-                    payload = error_response(
-                        errors.E_REASON_TYPE_INVALID, message=str(e)
-                    )
-                    log.exception("message routing error")
-                    await ws.send_message(json.dumps(payload))
-        except ConnectionClosed:
-            _post_close_cleanup(user.name)
-            break
+                await send_response(ws, payload, fmt)
+                continue
+            request_id = payload.pop(REQUEST_ID_FIELD, None)
+            if capture.enabled:
+                capture.message(ws, payload)
+            if request_id is not None and (
+                not isinstance(request_id, (str, int)) or isinstance(request_id, bool)
+            ):
+                payload = error_response(
+                    errors.E_REASON_MALFORMED,
+                    message="Invalid requestId, expected: string or integer",
+                )
+                await send_response(ws, payload, fmt)
+                continue
+            trace_id = tracing.tracer.sample()
+            if trace_id is not None:
+                tracing.tracer.hop(
+                    trace_id, tracing.HOP_RECEIVE, received, user=user.name
+                )
+                tracing.tracer.hop(trace_id, tracing.HOP_DECODE)
+            await lanes.submit(
+                message_lane(payload),
+                functools.partial(
+                    _handle_message,
+                    ws,
+                    user,
+                    fmt,
+                    payload,
+                    request_id,
+                    trace_id,
+                    received,
+                ),
+            )
+
 
+async def _outbound_sender(
+    ws: WebSocketConnection,
+    user: User,
+    fmt: str,
+    receive_channel: trio.MemoryReceiveChannel,
+) -> None:
+    async with receive_channel:
+        async for message in receive_channel:
+            await message.send(ws, fmt)
+            tracing.tracer.hop(
+                tracing.payload_trace(message.payload),
+                tracing.HOP_SEND,
+                user=user.name,
+            )
+            log.debug("message sent")
 
-async def chat_message_processor(ws: WebSocketConnection, user: User) -> None:
+
+async def chat_message_processor(
+    ws: WebSocketConnection, user: User, fmt: str = codec.FORMAT_JSON
+) -> None:
     """Task that collects messages from chat topic and sends them to WebSocket
     client.
 
+    Messages are passed to sender task through bounded outbound queue. When
+    the queue fills above ``EPHEMERAL_DROP_THRESHOLD`` ephemeral messages are
+    dropped, regular messages wait for free space.
+
     :param ws: WebSocket connection object
     :type ws: WebSocketConnection
-    :param client: client ID from request
-    :type client: str
+    :param user: connected user object
+    :type user: User
+    :param fmt: connection wire format, defaults to ``json``
+    :type fmt: str, optional
     """
-    while True:
-        if ws.closed:
-            _post_close_cleanup(user.name)
-            break
-        async for message in user.message_stream():
-            try:
-                await message.send(ws)
-                log.debug("message sent")
-            except ConnectionClosed:
-                _post_close_cleanup(user.name)
-                break
+    send_channel, receive_channel = trio.open_memory_channel(OUTBOUND_QUEUE_SIZE)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(_outbound_sender, ws, user, fmt, receive_channel)
+        async with send_channel:
+            async for message in user.message_stream():
+                if (
+                    message.ephemeral
+                    and send_channel.statistics().current_buffer_used
+                    >= EPHEMERAL_DROP_THRESHOLD
+                ):
+                    log.debug(f"ephemeral message to {user.name} dropped")
+                    continue
+                await send_channel.send(message)
+
+
+async def _run_connection_task(cancel_scope: trio.CancelScope, fn, *args) -> None:
+    try:
+        await fn(*args)
+    except ConnectionClosed:
+        pass
+    finally:
+        cancel_scope.cancel()
+
+
+async def _publish_presence(user: User, status: str) -> None:
+    message = make_ephemeral_message(
+        user.to_map(), PRESENCE_TOPIC, MSG_TYPE_PRESENCE, status=status
+    )
+    await ephemeral.coalescer.submit(user.name, message)
+
+
+async def _send_unread_counts(ws: WebSocketConnection, user: User, fmt: str) -> None:
+    counts = await read_markers.unread_counts(user.name, user.topics)
+    await send_response(ws, {"type": MSG_TYPE_UNREAD, "counts": counts}, fmt)
 
 
 async def server(request: WebSocketRequest) -> None:
     """Connection handler.
 
     This function will be run for any incoming connection. Request is accepted
-    unless number of open connections exceeds ``MAX_CLIENTS``, rejection comes
-    with code 403.
+    unless node is draining or number of open connections exceeds
+    ``MAX_CLIENTS``, rejection comes with code 503.
 
     :param request: websocket request object
     :type request: WebSocketRequest
     """
     client = str(request.remote)
+    if node.draining:
+        await request.reject(503, body="Server draining".encode("utf-8"))
+        log.info(f"node draining, request from {client} rejected")
+        return
     if STATS["num_clients"] >= MAX_CLIENTS:
         await request.reject(503)
         log.warning(
@@ -127,29 +344,105 @@ async def server(request: WebSocketRequest) -> None:
     if user is None:
         await request.reject(400, body="User unknown".encode("utf-8"))
         return
-    ws = await request.accept()
+    subprotocol, fmt = codec.negotiate(request.proposed_subprotocols)
+    ws = await request.accept(subprotocol=subprotocol)
     STATS["num_clients"] += 1
-    log.debug(f"connection from {client} ({user.name}) accepted")
+    node.add(ws)
+    if capture.enabled:
+        capture.opened(ws, user.name, fmt)
+    log.debug(f"connection from {client} ({user.name}) accepted, format: {fmt}")
+    try:
+        await _publish_presence(user, PRESENCE_ONLINE)
+        try:
+            await _send_unread_counts(ws, user, fmt)
+        except ConnectionClosed:
+            return
+        async with trio.open_nursery() as nursery:
+            for fn in (ws_message_processor, chat_message_processor):
+                nursery.start_soon(
+                    _run_connection_task, nursery.cancel_scope, fn, ws, user, fmt
+                )
+    finally:
+        node.remove(ws)
+        if capture.enabled:
+            capture.closed(ws)
+        _post_close_cleanup(user.name)
+        with trio.CancelScope(shield=True):
+            await _publish_presence(user, PRESENCE_OFFLINE)
+
+
+async def serve_tls(*, host: str, port: int, ssl_context: ssl.SSLContext) -> None:
+    """Serve websocket connections over TLS.
+
+    TLS handshakes are completed by :class:`~chitty.tls.HandshakeListener`
+    before connections are handed to websocket server.
+
+    :param host: host name or IP address to bind to
+    :type host: str
+    :param port: TCP port
+    :type port: int
+    :param ssl_context: server SSL context
+    :type ssl_context: ssl.SSLContext
+    """
+    transport_listeners = await trio.open_ssl_over_tcp_listeners(
+        port, ssl_context, host=host, https_compatible=True
+    )
+    listeners = [tls.HandshakeListener(listener) for listener in transport_listeners]
     async with trio.open_nursery() as nursery:
-        nursery.start_soon(ws_message_processor, ws, user)
-        nursery.start_soon(chat_message_processor, ws, user)
+        for listener in listeners:
+            await nursery.start(listener.run)
+        if tls.REPORT_INTERVAL:
+            nursery.start_soon(tls.report, ssl_context)
+        ws_server = WebSocketServer(
+            server,
+            listeners,
+            max_message_size=MAX_MESSAGE_SIZE,
+            message_queue_size=MESSAGE_QUEUE_SIZE,
+        )
+        await ws_server.run()
 
 
-async def main(*, host: str, port: int) -> None:
+async def main(
+    *, host: str, port: int, ssl_context: Optional[ssl.SSLContext] = None
+) -> None:
     """Websocket server entrypoint.
 
+    Server runs until interrupted or until drain started by drain signal
+    finishes, see :mod:`chitty.node`.
+
     :param host: host name or IP address to bind to
     :type host: str
     :param port: TCP port
     :type port: int
+    :param ssl_context: server SSL context, if None then connections are not
+                        encrypted, defaults to None
+    :type ssl_context: Optional[ssl.SSLContext], optional
     """
     logging.basicConfig(level=os.getenv("CHITTY_LOGLEVEL", "INFO"))
-    log.info(f"starting on {host}:{port}")
-    await serve_websocket(
-        server,
-        host=host,
-        port=port,
-        ssl_context=None,
-        max_message_size=MAX_MESSAGE_SIZE,
-        message_queue_size=MESSAGE_QUEUE_SIZE,
-    )
+    scheme = "wss" if ssl_context else "ws"
+    log.info(f"starting on {scheme}://{host}:{port}")
+    try:
+        async with trio.open_nursery() as nursery:
+            await nursery.start(node.run, nursery.cancel_scope)
+            nursery.start_soon(ephemeral.coalescer.run)
+            nursery.start_soon(notify.aggregator.run)
+            nursery.start_soon(content_filter.run)
+            nursery.start_soon(collector.run)
+            nursery.start_soon(read_markers.run)
+            nursery.start_soon(capture.run)
+            nursery.start_soon(
+                node.report, *advertised_address(host, port), MAX_CLIENTS
+            )
+            if ssl_context is None:
+                await serve_websocket(
+                    server,
+                    host=host,
+                    port=port,
+                    ssl_context=None,
+                    max_message_size=MAX_MESSAGE_SIZE,
+                    message_queue_size=MESSAGE_QUEUE_SIZE,
+                )
+            else:
+                await serve_tls(host=host, port=port, ssl_context=ssl_context)
+    finally:
+        tracing.tracer.exporter.flush()
@@ -2,17 +2,38 @@ import hashlib
 import os
 from collections import namedtuple
 from enum import Enum
+from functools import lru_cache
 
-import itsdangerous
-from itsdangerous.exc import BadSignature, SignatureExpired
-from passlib.context import CryptContext
 
-serializer = itsdangerous.URLSafeTimedSerializer(
-    secret_key=os.environ['CHITTY_SECRET_KEY'],
-    salt='auth',
-    signer_kwargs={'digest_method': hashlib.sha512},
-)
-password_context = CryptContext(schemes=['argon2'])
+@lru_cache(maxsize=None)
+def _itsdangerous():
+    import itsdangerous
+
+    return itsdangerous
+
+
+@lru_cache(maxsize=None)
+def get_serializer():
+    """Token serializer, created on first use.
+
+    :rtype: itsdangerous.URLSafeTimedSerializer
+    """
+    return _itsdangerous().URLSafeTimedSerializer(
+        secret_key=os.environ['CHITTY_SECRET_KEY'],
+        salt='auth',
+        signer_kwargs={'digest_method': hashlib.sha512},
+    )
+
+
+@lru_cache(maxsize=None)
+def get_password_context():
+    """Password hashing context, created on first use.
+
+    :rtype: passlib.context.CryptContext
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=['argon2'])
 
 
 class ResultType(Enum):
@@ -32,7 +53,7 @@ def get_token(data: str) -> str:
     :return: token string
     :rtype: str
     """
-    return serializer.dumps(data)
+    return get_serializer().dumps(data)
 
 
 def check_token(token: str) -> TokenCheckResult:
@@ -47,13 +68,14 @@ def check_token(token: str) -> TokenCheckResult:
     :return: deserialisation result
     :rtype: TokenCheckResult
     """
+    itsdangerous = _itsdangerous()
     value = None
     max_age = int(os.getenv('CHITTY_TOKEN_MAX_AGE', str(24*60*60)))
     try:
         rt = ResultType.OK
-        value = serializer.loads(token, max_age=max_age)
-    except SignatureExpired:
+        value = get_serializer().loads(token, max_age=max_age)
+    except itsdangerous.SignatureExpired:
         rt = ResultType.EXPIRED
-    except BadSignature:
+    except itsdangerous.BadSignature:
         rt = ResultType.BADSIG
     return TokenCheckResult(result=rt, value=value)
@@ -1,3 +1,1522 @@
-import redio
+"""Storage layer.
 
-redis = redio.Redis()
+All data access goes through typed operations defined in
+:class:`StorageOperations`. Every operation is a short list of Redis
+commands and a function that turns raw replies into result value, so the
+same operation works with any backend:
+
+* :class:`RedioBackend` - async Redis client used by chat server
+* :class:`RedisBackend` - sync Redis client used by web application
+* :class:`MemoryBackend` - pure Python in-process store for tests and
+  benchmarks
+
+Operations are run by front-ends. :class:`SyncStorage` sends every operation
+as single pipeline. :class:`AsyncStorage` additionally collects operations
+issued by different tasks in the same scheduler tick and sends them to
+backend as one pipeline.
+
+PubSub subscriptions are not part of storage interface, chat server uses
+redio client (:func:`redio_client`) directly for them.
+
+Redio and trio are imported on first use, so web application and command
+line tools that only need sync storage do not pay for loading them.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import functools
+import inspect
+import os
+import time
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from . import keys
+from .topic import DEFAULT_TOPICS
+
+if TYPE_CHECKING:
+    import redio
+    import trio
+
+BACKEND_REDIS = "redis"
+BACKEND_MEMORY = "memory"
+# maximum time of async backend round trip, in seconds
+TIMEOUT = float(os.getenv("CHITTY_STORAGE_TIMEOUT", "10"))
+
+Command = Tuple[Any, ...]
+
+
+class Op(NamedTuple):
+    """Storage operation: commands to run and reply parser.
+
+    Parser receives list of replies, one per command.
+    """
+
+    commands: List[Command]
+    parse: Callable[[List[Any]], Any]
+
+
+def _first(replies: List[Any]) -> Any:
+    return replies[0]
+
+
+def _ignore(replies: List[Any]) -> None:
+    return None
+
+
+def _as_bool(replies: List[Any]) -> bool:
+    return bool(int(replies[0]))
+
+
+def _as_dict(reply: Any) -> Dict[str, str]:
+    if isinstance(reply, Mapping):
+        return dict(reply)
+    return dict(zip(reply[::2], reply[1::2]))
+
+
+def _as_score(reply: Any) -> Optional[float]:
+    if reply is None:
+        return None
+    return float(reply)
+
+
+def _as_scan(reply: Any) -> Tuple[int, List[str]]:
+    cursor, items = reply
+    return int(cursor), list(items)
+
+
+class Script(NamedTuple):
+    """Lua script and its Python equivalent used by :class:`MemoryBackend`.
+
+    Emulation receives backend, keys and arguments.
+    """
+
+    source: str
+    emulate: Callable[[MemoryBackend, Sequence[str], Sequence[Any]], Any]
+
+
+# Message is stored and published with sequence number field spliced in
+# front of serialised JSON object, so payload is not decoded by Redis.
+_PUBLISH_SEQUENCED_LUA = """
+local seq = redis.call('INCR', KEYS[1])
+local data = ARGV[1]
+if data == '{}' then
+    data = '{"seq":' .. seq .. '}'
+else
+    data = '{"seq":' .. seq .. ',' .. string.sub(data, 2)
+end
+redis.call('LPUSH', KEYS[2], data)
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+redis.call('PUBLISH', ARGV[3], data)
+return seq
+"""
+
+_READ_BACKLOG_LUA = """
+local seq = tonumber(redis.call('GET', KEYS[1]) or '0')
+local missing = seq - tonumber(ARGV[1])
+if missing <= 0 then
+    return {seq, {}}
+end
+return {seq, redis.call('LRANGE', KEYS[2], 0, missing - 1)}
+"""
+
+
+def _splice_seq(data: str, seq: int) -> str:
+    if data == "{}":
+        return f'{{"seq":{seq}}}'
+    return f'{{"seq":{seq},{data[1:]}'
+
+
+def _emulate_publish_sequenced(
+    backend: MemoryBackend, script_keys: Sequence[str], args: Sequence[Any]
+) -> int:
+    seq_key, backlog_key = script_keys
+    data, size, channel = args
+    seq = backend._cmd_incr(seq_key)
+    data = _splice_seq(data, seq)
+    backend._cmd_lpush(backlog_key, data)
+    backend._cmd_ltrim(backlog_key, 0, int(size) - 1)
+    backend._cmd_publish(channel, data)
+    return seq
+
+
+def _emulate_read_backlog(
+    backend: MemoryBackend, script_keys: Sequence[str], args: Sequence[Any]
+) -> List[Any]:
+    seq_key, backlog_key = script_keys
+    seq = int(backend._cmd_get(seq_key) or 0)
+    missing = seq - int(args[0])
+    if missing <= 0:
+        return [seq, []]
+    return [seq, backend._cmd_lrange(backlog_key, 0, missing - 1)]
+
+
+# Topic is removed only if it has not become active since it was selected
+# for expiration.
+# Sequence counter of expired topic is kept, so numbering continues if topic
+# is created again, and its value is recorded as read floor: messages up to
+# it are gone with backlog and older read markers must not count them.
+_EXPIRE_TOPIC_LUA = """
+local activity = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if activity and tonumber(activity) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('SREM', KEYS[4], ARGV[1])
+local seq = redis.call('GET', KEYS[5])
+if seq then
+    redis.call('HSET', KEYS[7], ARGV[1], seq)
+end
+redis.call('DEL', KEYS[6])
+return 1
+"""
+
+
+def _emulate_expire_topic(
+    backend: MemoryBackend, script_keys: Sequence[str], args: Sequence[Any]
+) -> int:
+    (
+        activity_key,
+        names_key,
+        subscribers_key,
+        topics_key,
+        seq_key,
+        backlog_key,
+        floors_key,
+    ) = script_keys
+    topic, before = args
+    activity = backend._cmd_zscore(activity_key, topic)
+    if activity is not None and float(activity) > float(before):
+        return 0
+    for key in (activity_key, names_key, subscribers_key):
+        backend._cmd_zrem(key, topic)
+    backend._cmd_srem(topics_key, topic)
+    seq = backend._cmd_get(seq_key)
+    if seq is not None:
+        backend._cmd_hset(floors_key, topic, seq)
+    backend._cmd_del(backlog_key)
+    return 1
+
+
+# Ranking page after (score, member) cursor. Members of equal score are in
+# descending order, the first one below cursor member is found by binary
+# search, so page cost does not depend on number of topics with equal score.
+_RANKING_PAGE_LUA = """
+local start = 0
+if ARGV[2] then
+    start = redis.call('ZCOUNT', KEYS[1], '(' .. ARGV[2], '+inf')
+    local stop = start + redis.call('ZCOUNT', KEYS[1], ARGV[2], ARGV[2])
+    while start < stop do
+        local middle = math.floor((start + stop) / 2)
+        local member = redis.call('ZREVRANGE', KEYS[1], middle, middle)[1]
+        if member < ARGV[3] then
+            stop = middle
+        else
+            start = middle + 1
+        end
+    end
+end
+return redis.call('ZREVRANGE', KEYS[1], start, start + ARGV[1] - 1, 'WITHSCORES')
+"""
+
+
+def _emulate_ranking_page(
+    backend: MemoryBackend, script_keys: Sequence[str], args: Sequence[Any]
+) -> List[str]:
+    limit, *after = args
+    members = list(reversed(backend._sorted(script_keys[0])))
+    if after:
+        score, name = float(after[0]), after[1]
+        members = [
+            (member, value)
+            for member, value in members
+            if value < score or (value == score and member < name)
+        ]
+    return [
+        item
+        for member, value in members[: int(limit)]
+        for item in (member, _format_score(value))
+    ]
+
+
+# Read markers only move forward, so late write from another device does
+# not make already read messages unread again.
+_SET_READ_MARKERS_LUA = """
+for i = 1, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+    if tonumber(ARGV[i + 1]) > current then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 0
+"""
+
+
+def _emulate_set_read_markers(
+    backend: MemoryBackend, script_keys: Sequence[str], args: Sequence[Any]
+) -> int:
+    for i in range(0, len(args), 2):
+        topic, seq = args[i], int(args[i + 1])
+        if seq > int(backend._cmd_hget(script_keys[0], topic) or 0):
+            backend._cmd_hset(script_keys[0], topic, seq)
+    return 0
+
+
+PUBLISH_SEQUENCED = Script(_PUBLISH_SEQUENCED_LUA, _emulate_publish_sequenced)
+READ_BACKLOG = Script(_READ_BACKLOG_LUA, _emulate_read_backlog)
+EXPIRE_TOPIC = Script(_EXPIRE_TOPIC_LUA, _emulate_expire_topic)
+SET_READ_MARKERS = Script(_SET_READ_MARKERS_LUA, _emulate_set_read_markers)
+RANKING_PAGE = Script(_RANKING_PAGE_LUA, _emulate_ranking_page)
+
+SCRIPTS = {
+    script.source: script
+    for script in (
+        PUBLISH_SEQUENCED,
+        READ_BACKLOG,
+        EXPIRE_TOPIC,
+        SET_READ_MARKERS,
+        RANKING_PAGE,
+    )
+}
+
+
+def _eval(script: Script, script_keys: Sequence[str], *args: Any) -> Command:
+    return ("EVAL", script.source, len(script_keys), *script_keys, *args)
+
+
+def _as_backlog(replies: List[Any]) -> Tuple[int, Optional[List[str]]]:
+    seq, items = replies[0]
+    return int(seq), list(reversed(items))
+
+
+class StorageOperations:
+    """Typed storage operations, shared by sync and async front-ends.
+
+    Every method returns result of :meth:`_run`, that is the value itself
+    for :class:`SyncStorage` and awaitable for :class:`AsyncStorage`.
+    """
+
+    def _run(self, op: Op) -> Any:  # pragma: no cover
+        raise NotImplementedError
+
+    # users
+
+    def user_exists(self, name: str):
+        """Check if user account exists.
+
+        :rtype: bool
+        """
+        return self._run(Op([("EXISTS", f"{keys.USERS}:{name}")], _as_bool))
+
+    def users_exist(self, names: Sequence[str]):
+        """Check if user accounts exist.
+
+        :rtype: List[bool]
+        """
+        return self._run(
+            Op(
+                [("EXISTS", f"{keys.USERS}:{name}") for name in names],
+                lambda replies: [bool(int(rv)) for rv in replies],
+            )
+        )
+
+    def get_user(self, name: str):
+        """Read user account data without password.
+
+        :return: user data or None if account does not exist
+        :rtype: Optional[Dict[str, str]]
+        """
+
+        def parse(replies):
+            data = _as_dict(replies[0])
+            if not data:
+                return None
+            data.pop("password", None)
+            return data
+
+        return self._run(Op([("HGETALL", f"{keys.USERS}:{name}")], parse))
+
+    def get_password(self, name: str):
+        """Read user password hash.
+
+        :rtype: Optional[str]
+        """
+        return self._run(Op([("HGET", f"{keys.USERS}:{name}", "password")], _first))
+
+    def add_users(self, users: Iterable[Tuple[str, str, float, Optional[str]]]):
+        """Create user accounts with their default subscriptions.
+
+        Subscriber counts of default topics in topic directory are updated
+        and auth token is stored if provided.
+
+        :param users: tuples of (name, password hash, created timestamp,
+                      auth token)
+        :type users: Iterable[Tuple[str, str, float, Optional[str]]]
+        :rtype: None
+        """
+        commands: List[Command] = []
+        for name, password, created, token in users:
+            commands.append(
+                (
+                    "HSET",
+                    f"{keys.USERS}:{name}",
+                    "name",
+                    name,
+                    "password",
+                    password,
+                    "created",
+                    created,
+                )
+            )
+            commands.append(("SADD", f"{keys.TOPICS}:{name}", name, *DEFAULT_TOPICS))
+            args: List[Any] = []
+            for topic in DEFAULT_TOPICS:
+                args.extend([0, topic])
+            commands.append(("ZADD", keys.DIRECTORY_NAMES, "NX", *args))
+            for topic in DEFAULT_TOPICS:
+                commands.append(("ZINCRBY", keys.DIRECTORY_SUBSCRIBERS, 1, topic))
+            if token is not None:
+                commands.append(
+                    ("HSET", f"{keys.LOGINS}:{name}", "token", token, "date", created)
+                )
+        return self._run(Op(commands, _ignore))
+
+    def add_user(
+        self, name: str, password: str, created: float, token: Optional[str] = None
+    ):
+        """Create user account with default subscriptions.
+
+        :rtype: None
+        """
+        return self.add_users([(name, password, created, token)])
+
+    # logins
+
+    def set_auth_token(self, name: str, token: str, date: Optional[float] = None):
+        """Store user auth token.
+
+        :rtype: None
+        """
+        date = date or time.time()
+        return self._run(
+            Op(
+                [("HSET", f"{keys.LOGINS}:{name}", "token", token, "date", date)],
+                _ignore,
+            )
+        )
+
+    # topics
+
+    def get_user_topics(self, name: str):
+        """Read names of topics user is subscribed to.
+
+        :rtype: Set[str]
+        """
+        return self._run(
+            Op(
+                [("SMEMBERS", f"{keys.TOPICS}:{name}")],
+                lambda replies: set(replies[0]),
+            )
+        )
+
+    def add_subscription(self, name: str, topic: str):
+        """Store topic in user subscriptions.
+
+        :return: True if user was not subscribed to this topic before
+        :rtype: bool
+        """
+        return self._run(Op([("SADD", f"{keys.TOPICS}:{name}", topic)], _as_bool))
+
+    def remove_subscriptions(self, name: str, topics: Iterable[str]):
+        """Remove topics from user subscriptions.
+
+        :return: number of removed subscriptions
+        :rtype: int
+        """
+        topics = list(topics)
+        if not topics:
+            return self._run(Op([], lambda replies: 0))
+        return self._run(
+            Op(
+                [("SREM", f"{keys.TOPICS}:{name}", *topics)],
+                lambda replies: int(replies[0]),
+            )
+        )
+
+    def topic_exists(self, topic: str):
+        """Check if topic is registered.
+
+        :rtype: bool
+        """
+        return self._run(Op([("SISMEMBER", keys.TOPICS, topic)], _as_bool))
+
+    def add_topic(self, topic: str):
+        """Register topic and add it to topic directory.
+
+        :return: True if topic was not registered before
+        :rtype: bool
+        """
+        return self._run(
+            Op(
+                [
+                    ("SADD", keys.TOPICS, topic),
+                    ("ZADD", keys.DIRECTORY_NAMES, "NX", 0, topic),
+                    ("ZADD", keys.DIRECTORY_ACTIVITY, "NX", time.time(), topic),
+                ],
+                _as_bool,
+            )
+        )
+
+    def topics_exist(self, topics: Sequence[str]):
+        """Check if topics are registered.
+
+        :rtype: List[bool]
+        """
+        return self._run(
+            Op(
+                [("SISMEMBER", keys.TOPICS, topic) for topic in topics],
+                lambda replies: [bool(reply) for reply in replies],
+            )
+        )
+
+    def idle_topics(self, before: float, limit: int):
+        """Read names of topics with no activity since specified time.
+
+        :param before: activity time limit
+        :type before: float
+        :param limit: maximum number of topics
+        :type limit: int
+        :return: topic names, the longest idle first
+        :rtype: List[str]
+        """
+        return self._run(
+            Op(
+                [
+                    (
+                        "ZRANGEBYSCORE",
+                        keys.DIRECTORY_ACTIVITY,
+                        "-inf",
+                        before,
+                        "LIMIT",
+                        0,
+                        limit,
+                    )
+                ],
+                lambda replies: list(replies[0]),
+            )
+        )
+
+    def expire_topic(self, topic: str, before: float):
+        """Unregister idle topic and remove its directory entry and backlog.
+
+        Topic is not removed if it has been active since specified time.
+        Sequence number is kept and becomes read floor of topic, read
+        markers below it are ignored in unread counts.
+
+        :param topic: topic name
+        :type topic: str
+        :param before: activity time limit
+        :type before: float
+        :return: True if topic has been removed
+        :rtype: bool
+        """
+        return self._run(
+            Op(
+                [
+                    _eval(
+                        EXPIRE_TOPIC,
+                        (
+                            keys.DIRECTORY_ACTIVITY,
+                            keys.DIRECTORY_NAMES,
+                            keys.DIRECTORY_SUBSCRIBERS,
+                            keys.TOPICS,
+                            f"{keys.TOPIC_SEQ}:{topic}",
+                            f"{keys.TOPIC_BACKLOG}:{topic}",
+                            keys.READ_FLOORS,
+                        ),
+                        topic,
+                        before,
+                    )
+                ],
+                _as_bool,
+            )
+        )
+
+    def count_subscribers(self, topic: str, amount: int = 1):
+        """Change topic subscriber count in topic directory.
+
+        :return: new subscriber count
+        :rtype: int
+        """
+        return self._run(
+            Op(
+                [("ZINCRBY", keys.DIRECTORY_SUBSCRIBERS, amount, topic)],
+                lambda replies: int(float(replies[0])),
+            )
+        )
+
+    def touch_topic(self, topic: str, timestamp: float):
+        """Record last activity time of topic in topic directory.
+
+        :rtype: None
+        """
+        return self._run(
+            Op([("ZADD", keys.DIRECTORY_ACTIVITY, timestamp, topic)], _ignore)
+        )
+
+    def topic_names(self, start: str, end: str, limit: int, offset: int = 0):
+        """Read topic names from directory in lexicographical range.
+
+        Range boundaries use ``ZRANGEBYLEX`` syntax.
+
+        :rtype: List[str]
+        """
+        return self._run(
+            Op(
+                [
+                    (
+                        "ZRANGEBYLEX",
+                        keys.DIRECTORY_NAMES,
+                        start,
+                        end,
+                        "LIMIT",
+                        offset,
+                        limit,
+                    )
+                ],
+                lambda replies: list(replies[0]),
+            )
+        )
+
+    def topic_ranking(
+        self, key: str, limit: int, after: Optional[Tuple[str, str]] = None
+    ):
+        """Read topic names from directory ranking, highest score first.
+
+        Topics of equal score are ordered by name, descending.
+
+        :param key: ranking key, subscribers or activity
+        :type key: str
+        :param limit: maximum number of topics
+        :type limit: int
+        :param after: score and name of the last topic of previous page,
+                      defaults to None
+        :type after: Optional[Tuple[str, str]], optional
+        :return: list of (name, score) tuples, score as returned by storage
+        :rtype: List[Tuple[str, str]]
+        """
+
+        def parse(replies):
+            items = list(replies[0])
+            return list(zip(items[::2], items[1::2]))
+
+        return self._run(
+            Op([_eval(RANKING_PAGE, (key,), limit, *(after or ()))], parse)
+        )
+
+    def topic_stats(self, topics: Sequence[str]):
+        """Read subscriber count and last activity time of topics.
+
+        :return: list of (subscribers, last activity) tuples
+        :rtype: List[Tuple[int, Optional[float]]]
+        """
+        commands: List[Command] = []
+        for topic in topics:
+            commands.append(("ZSCORE", keys.DIRECTORY_SUBSCRIBERS, topic))
+            commands.append(("ZSCORE", keys.DIRECTORY_ACTIVITY, topic))
+
+        def parse(replies):
+            return [
+                (int(_as_score(subscribers) or 0), _as_score(activity))
+                for subscribers, activity in zip(replies[::2], replies[1::2])
+            ]
+
+        return self._run(Op(commands, parse))
+
+    def get_topics(self):
+        """Read names of all registered topics.
+
+        :rtype: Set[str]
+        """
+        return self._run(
+            Op([("SMEMBERS", keys.TOPICS)], lambda replies: set(replies[0]))
+        )
+
+    def set_topic_subscribers(self, counts: Mapping[str, int], reset: bool = False):
+        """Add topics to directory and overwrite their subscriber counts.
+
+        :param counts: subscriber counts by topic name
+        :type counts: Mapping[str, int]
+        :param reset: flag whether existing subscriber counts should be
+                      removed first, defaults to False
+        :type reset: bool, optional
+        :rtype: None
+        """
+        commands: List[Command] = []
+        if reset:
+            commands.append(("DEL", keys.DIRECTORY_SUBSCRIBERS))
+        for topic, count in counts.items():
+            commands.append(("ZADD", keys.DIRECTORY_NAMES, "NX", 0, topic))
+            if count:
+                commands.append(("ZADD", keys.DIRECTORY_SUBSCRIBERS, count, topic))
+        return self._run(Op(commands, _ignore))
+
+    # scanning
+
+    def scan(self, cursor: int, match: str, count: int):
+        """Single ``SCAN`` iteration over key space.
+
+        :return: next cursor (0 when done) and batch of keys
+        :rtype: Tuple[int, List[str]]
+        """
+        return self._run(
+            Op(
+                [("SCAN", cursor, "MATCH", match, "COUNT", count)],
+                lambda replies: _as_scan(replies[0]),
+            )
+        )
+
+    def sscan(self, key: str, cursor: int, count: int):
+        """Single ``SSCAN`` iteration over set members.
+
+        :return: next cursor (0 when done) and batch of members
+        :rtype: Tuple[int, List[str]]
+        """
+        return self._run(
+            Op(
+                [("SSCAN", key, cursor, "COUNT", count)],
+                lambda replies: _as_scan(replies[0]),
+            )
+        )
+
+    # messages
+
+    def publish(self, topic: str, data: Union[str, bytes]):
+        """Publish message to PubSub channel.
+
+        :return: number of receivers
+        :rtype: int
+        """
+        return self._run(
+            Op([("PUBLISH", topic, data)], lambda replies: int(replies[0]))
+        )
+
+    def publish_many(self, messages: Iterable[Tuple[str, Union[str, bytes]]]):
+        """Publish multiple messages in single pipeline.
+
+        :param messages: pairs of topic name and serialised message
+        :type messages: Iterable[Tuple[str, Union[str, bytes]]]
+        :rtype: None
+        """
+        return self._run(
+            Op([("PUBLISH", topic, data) for topic, data in messages], _ignore)
+        )
+
+    def publish_sequenced(self, topic: str, data: str, backlog: int):
+        """Publish message with next topic sequence number.
+
+        Sequence number is assigned, message is added to topic backlog and
+        published in single script call. Serialised payload must be JSON
+        object, ``seq`` field is added to it.
+
+        :param topic: topic name
+        :type topic: str
+        :param data: JSON serialised message
+        :type data: str
+        :param backlog: number of recent messages kept in topic backlog
+        :type backlog: int
+        :return: assigned sequence number
+        :rtype: int
+        """
+        return self._run(
+            Op(
+                [
+                    _eval(
+                        PUBLISH_SEQUENCED,
+                        (f"{keys.TOPIC_SEQ}:{topic}", f"{keys.TOPIC_BACKLOG}:{topic}"),
+                        data,
+                        backlog,
+                        topic,
+                    )
+                ],
+                lambda replies: int(replies[0]),
+            )
+        )
+
+    def publish_sequenced_many(self, messages: Iterable[Tuple[str, str]], backlog: int):
+        """Publish multiple messages with sequence numbers in single pipeline.
+
+        :param messages: pairs of topic name and JSON serialised message
+        :type messages: Iterable[Tuple[str, str]]
+        :param backlog: number of recent messages kept in topic backlog
+        :type backlog: int
+        :return: assigned sequence numbers
+        :rtype: List[int]
+        """
+        commands = [
+            _eval(
+                PUBLISH_SEQUENCED,
+                (f"{keys.TOPIC_SEQ}:{topic}", f"{keys.TOPIC_BACKLOG}:{topic}"),
+                data,
+                backlog,
+                topic,
+            )
+            for topic, data in messages
+        ]
+        return self._run(
+            Op(commands, lambda replies: [int(reply) for reply in replies])
+        )
+
+    def read_backlog(self, topic: str, since: int):
+        """Read topic messages published after specified sequence number.
+
+        Returned messages are oldest first. If backlog does not reach back
+        to requested sequence number, fewer messages are returned than
+        ``seq - since``.
+
+        :param topic: topic name
+        :type topic: str
+        :param since: last sequence number seen by client
+        :type since: int
+        :return: current topic sequence number and serialised messages
+        :rtype: Tuple[int, List[str]]
+        """
+        return self._run(
+            Op(
+                [
+                    _eval(
+                        READ_BACKLOG,
+                        (f"{keys.TOPIC_SEQ}:{topic}", f"{keys.TOPIC_BACKLOG}:{topic}"),
+                        since,
+                    )
+                ],
+                _as_backlog,
+            )
+        )
+
+    def mark_seen(self, key: str, ttl: int):
+        """Set expiring marker key if it does not exist.
+
+        :return: True if marker was set, False if it already existed
+        :rtype: bool
+        """
+        return self._run(
+            Op([("SET", key, 1, "NX", "EX", ttl)], lambda replies: bool(replies[0]))
+        )
+
+    def forget_seen(self, key: str):
+        """Remove marker key.
+
+        :rtype: None
+        """
+        return self._run(Op([("DEL", key)], _ignore))
+
+    # read markers
+
+    def set_read_markers(self, markers: Mapping[str, Mapping[str, int]]):
+        """Advance read markers of many users.
+
+        Marker is changed only if new sequence number is higher.
+
+        :param markers: mapping of user name to mapping of topic to sequence
+                        number of last read message
+        :type markers: Mapping[str, Mapping[str, int]]
+        :rtype: None
+        """
+        commands = []
+        for name, positions in markers.items():
+            args = [item for pair in positions.items() for item in pair]
+            if args:
+                commands.append(
+                    _eval(SET_READ_MARKERS, (f"{keys.READ_MARKERS}:{name}",), *args)
+                )
+        return self._run(Op(commands, _ignore))
+
+    def unread_counts(self, name: str, topics: Sequence[str]):
+        """Count unread messages in topics.
+
+        Unread count is difference between topic sequence number and user
+        read marker, so it needs no bookkeeping in publish path beyond
+        sequence number increment. Marker below read floor of topic that
+        expired and was created again counts from the floor.
+
+        :param name: user name
+        :type name: str
+        :param topics: topic names
+        :type topics: Sequence[str]
+        :return: mapping of topic name to number of unread messages
+        :rtype: Dict[str, int]
+        """
+        topics = list(topics)
+        if not topics:
+            return self._run(Op([], lambda replies: {}))
+        commands: List[Command] = [
+            ("GET", f"{keys.TOPIC_SEQ}:{topic}") for topic in topics
+        ]
+        commands.append(("HMGET", f"{keys.READ_MARKERS}:{name}", *topics))
+        commands.append(("HMGET", keys.READ_FLOORS, *topics))
+
+        def parse(replies):
+            *seqs, markers, floors = replies
+            return {
+                topic: max(0, int(seq or 0) - max(int(marker or 0), int(floor or 0)))
+                for topic, seq, marker, floor in zip(topics, seqs, markers, floors)
+            }
+
+        return self._run(Op(commands, parse))
+
+    # server nodes
+
+    def set_node_state(self, node: str, state: str, ttl: int):
+        """Record server node state in shared state.
+
+        :param node: node ID
+        :type node: str
+        :param state: node state
+        :type state: str
+        :param ttl: time in seconds after which record expires
+        :type ttl: int
+        :rtype: None
+        """
+        key = f"{keys.NODES}:{node}"
+        return self._run(
+            Op(
+                [
+                    ("HSET", key, "state", state, "updated", time.time()),
+                    ("EXPIRE", key, ttl),
+                ],
+                _ignore,
+            )
+        )
+
+    def report_node(
+        self, node: str, report: Mapping[str, Any], ttl: int, stale_before: float
+    ):
+        """Store server node load report.
+
+        Node is added to node index scored by report time, index entries of
+        nodes that did not report since ``stale_before`` are removed.
+
+        :param node: node ID
+        :type node: str
+        :param report: report fields, must include ``updated`` timestamp
+        :type report: Mapping[str, Any]
+        :param ttl: time in seconds after which report expires
+        :type ttl: int
+        :param stale_before: time limit for removing index entries
+        :type stale_before: float
+        :rtype: None
+        """
+        key = f"{keys.NODES}:{node}"
+        fields = [item for pair in report.items() for item in pair]
+        return self._run(
+            Op(
+                [
+                    ("HSET", key, *fields),
+                    ("EXPIRE", key, ttl),
+                    ("ZADD", keys.NODES, report["updated"], node),
+                    ("ZREMRANGEBYSCORE", keys.NODES, "-inf", f"({stale_before}"),
+                ],
+                _ignore,
+            )
+        )
+
+    def remove_node(self, node: str):
+        """Remove server node report and index entry.
+
+        :rtype: None
+        """
+        return self._run(
+            Op(
+                [("DEL", f"{keys.NODES}:{node}"), ("ZREM", keys.NODES, node)],
+                _ignore,
+            )
+        )
+
+    def node_ids(self, since: float):
+        """Read IDs of server nodes that reported since specified time.
+
+        :rtype: List[str]
+        """
+        return self._run(
+            Op(
+                [("ZRANGEBYSCORE", keys.NODES, since, "+inf")],
+                lambda replies: list(replies[0]),
+            )
+        )
+
+    def node_reports(self, nodes: Sequence[str]):
+        """Read load reports of server nodes.
+
+        :return: mapping of node ID to report, expired reports are skipped
+        :rtype: Dict[str, Dict[str, str]]
+        """
+        nodes = list(nodes)
+
+        def parse(replies):
+            return {
+                node: _as_dict(reply) for node, reply in zip(nodes, replies) if reply
+            }
+
+        return self._run(
+            Op([("HGETALL", f"{keys.NODES}:{node}") for node in nodes], parse)
+        )
+
+    def get_node_state(self, node: str):
+        """Read server node state.
+
+        :return: node state or None if node is not known
+        :rtype: Optional[str]
+        """
+        return self._run(
+            Op([("HGET", f"{keys.NODES}:{node}", "state")], lambda replies: replies[0])
+        )
+
+    # content filter
+
+    def get_filter_version(self):
+        """Read content filter term list version.
+
+        :rtype: int
+        """
+        return self._run(
+            Op(
+                [("GET", keys.FILTER_VERSION)],
+                lambda replies: int(replies[0] or 0),
+            )
+        )
+
+    def get_filter_terms(self):
+        """Read content filter banned terms.
+
+        :rtype: Set[str]
+        """
+        return self._run(
+            Op([("SMEMBERS", keys.FILTER_TERMS)], lambda replies: set(replies[0]))
+        )
+
+    def set_filter_terms(self, terms: Iterable[str]):
+        """Replace content filter term list and bump its version.
+
+        :param terms: banned terms
+        :type terms: Iterable[str]
+        :return: new term list version
+        :rtype: int
+        """
+        commands: List[Command] = [("DEL", keys.FILTER_TERMS)]
+        terms = list(terms)
+        if terms:
+            commands.append(("SADD", keys.FILTER_TERMS, *terms))
+        commands.append(("INCR", keys.FILTER_VERSION))
+        return self._run(Op(commands, lambda replies: int(replies[-1])))
+
+
+def _check_errors(replies: List[Any]) -> None:
+    for reply in replies:
+        if isinstance(reply, Exception):
+            raise reply
+
+
+class SyncStorage(StorageOperations):
+    """Blocking storage front-end.
+
+    Every operation is sent to backend as single pipeline.
+
+    :param backend: sync backend
+    :type backend: Union[RedisBackend, MemoryBackend]
+    """
+
+    def __init__(self, backend: Union[RedisBackend, MemoryBackend]):
+        self.backend = backend
+
+    def _run(self, op: Op) -> Any:
+        if not op.commands:
+            return op.parse([])
+        replies = self.backend.execute(op.commands)
+        _check_errors(replies)
+        return op.parse(replies)
+
+    def scan_iter(self, match: str, count: int = 1000) -> Iterator[str]:
+        cursor = None
+        while cursor != 0:
+            cursor, batch = self.scan(cursor or 0, match, count)
+            yield from batch
+
+    def sscan_iter(self, key: str, count: int = 1000) -> Iterator[str]:
+        cursor = None
+        while cursor != 0:
+            cursor, batch = self.sscan(key, cursor or 0, count)
+            yield from batch
+
+
+@dataclass
+class _Pending:
+    op: Op
+    done: trio.Event
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class AsyncStorage(StorageOperations):
+    """Async storage front-end with automatic pipelining.
+
+    Operations issued by tasks in the same scheduler tick are collected and
+    sent to backend as one pipeline. The first task that issues operation
+    yields once to let other tasks add theirs and then executes the batch
+    for all of them. Failed command fails only the operation it belongs to.
+
+    Batch is executed in shielded scope, so tasks that joined it are never
+    left waiting for results. Backend round trip that takes longer than
+    ``timeout`` fails all operations of the batch with
+    :class:`trio.TooSlowError`, so hung backend does not make callers
+    uncancellable.
+
+    :param backend: async or sync backend
+    :type backend: Union[RedioBackend, MemoryBackend]
+    :param timeout: maximum time of backend round trip, in seconds,
+                    defaults to :data:`TIMEOUT`
+    :type timeout: float, optional
+    """
+
+    def __init__(
+        self, backend: Union[RedioBackend, MemoryBackend], timeout: float = TIMEOUT
+    ):
+        self.backend = backend
+        self.timeout = timeout
+        self.batches = 0
+        self.operations = 0
+        self._pending: List[_Pending] = []
+        self._trio: Any = None
+
+    async def _run(self, op: Op) -> Any:
+        trio = self._trio
+        if trio is None:
+            # module level instance is created on import of web app too,
+            # which does not use trio
+            import trio
+
+            self._trio = trio
+        if not op.commands:
+            return op.parse([])
+        pending = _Pending(op, trio.Event())
+        self._pending.append(pending)
+        if len(self._pending) == 1:
+            with trio.CancelScope(shield=True):
+                await trio.sleep(0)
+                batch, self._pending = self._pending, []
+                await self._execute(batch)
+        else:
+            await pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.value
+
+    async def _execute(self, batch: List[_Pending]) -> None:
+        commands = [command for item in batch for command in item.op.commands]
+        self.batches += 1
+        self.operations += len(batch)
+        try:
+            replies = self.backend.execute(commands)
+            if inspect.isawaitable(replies):
+                with self._trio.fail_after(self.timeout):
+                    replies = await replies
+        except Exception as e:
+            for item in batch:
+                item.error = e
+                item.done.set()
+            return
+        start = 0
+        for item in batch:
+            end = start + len(item.op.commands)
+            part = replies[start:end]
+            start = end
+            try:
+                _check_errors(part)
+                item.value = item.op.parse(part)
+            except Exception as e:
+                item.error = e
+            item.done.set()
+
+
+class RedisBackend:
+    """Sync Redis backend.
+
+    :param client: Redis client, should be created with
+                   ``decode_responses=True``
+    :type client: redis.Redis
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def execute(self, commands: List[Command]) -> List[Any]:
+        pipe = self.client.pipeline(transaction=False)
+        for command in commands:
+            pipe.execute_command(*command)
+        return pipe.execute(raise_on_error=False)
+
+
+@functools.lru_cache(maxsize=None)
+def redio_client() -> redio.Redis:
+    """Shared redio connection pool, created on first use.
+
+    :rtype: redio.Redis
+    """
+    import redio
+
+    return redio.Redis()
+
+
+class RedioBackend:
+    """Async Redis backend.
+
+    :param client: redio connection pool, defaults to shared pool from
+                   :func:`redio_client` that is created on first command
+    :type client: Optional[redio.Redis], optional
+    """
+
+    def __init__(self, client: Optional[redio.Redis] = None):
+        self._client = client
+
+    @property
+    def client(self) -> redio.Redis:
+        if self._client is None:
+            self._client = redio_client()
+        return self._client
+
+    async def execute(self, commands: List[Command]) -> List[Any]:
+        db = self.client()
+        for name, *args in commands:
+            db._command(name.encode(), *args)
+        replies = await db.strdecode
+        if len(commands) == 1:
+            replies = [replies]
+        return replies
+
+
+def _format_score(score: float) -> str:
+    return str(int(score)) if score.is_integer() else repr(score)
+
+
+def _index_range(items: List[str], start: int, stop: int) -> List[str]:
+    end = None if stop == -1 else stop + 1
+    return items[start:end]
+
+
+def _score_bounds(low: Any, high: Any) -> Callable[[float], bool]:
+    def bound(value: Any) -> Tuple[float, bool]:
+        value = str(value)
+        if value.startswith("("):
+            return float(value[1:]), True
+        return float(value), False
+
+    low_value, low_open = bound(low)
+    high_value, high_open = bound(high)
+
+    def check(score: float) -> bool:
+        if score < low_value or (low_open and score == low_value):
+            return False
+        return score < high_value or (not high_open and score == high_value)
+
+    return check
+
+
+def _lex_bounds(start: str, end: str) -> Callable[[str], bool]:
+    def check(bound: str, value: str, lower: bool) -> bool:
+        if bound == "-":
+            return True if lower else False
+        if bound == "+":
+            return False if lower else True
+        inclusive, limit = bound[0] == "[", bound[1:]
+        if lower:
+            return value > limit or (inclusive and value == limit)
+        return value < limit or (inclusive and value == limit)
+
+    return lambda value: check(start, value, True) and check(end, value, False)
+
+
+class MemoryBackend:
+    """In-process backend that implements subset of Redis commands used by
+    storage operations.
+
+    Data is kept in Python dicts and sets, keys with expiration set are
+    removed lazily on access. Published messages are passed to callables
+    registered with :meth:`subscribe`.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.expires: Dict[str, float] = {}
+        self.subscribers: Dict[str, List[Callable[[str, Any], None]]] = {}
+
+    def execute(self, commands: List[Command]) -> List[Any]:
+        replies: List[Any] = []
+        for name, *args in commands:
+            handler = getattr(self, f"_cmd_{name.lower()}", None)
+            try:
+                if handler is None:
+                    raise ValueError(f"unsupported command {name}")
+                replies.append(handler(*args))
+            except Exception as e:
+                replies.append(e)
+        return replies
+
+    def subscribe(self, channel: str, callback: Callable[[str, Any], None]) -> None:
+        self.subscribers.setdefault(channel, []).append(callback)
+
+    def _get(self, key: str, factory: Optional[Callable[[], Any]] = None) -> Any:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            del self.expires[key]
+            self.data.pop(key, None)
+        value = self.data.get(key)
+        if value is None and factory is not None:
+            value = self.data[key] = factory()
+        return value
+
+    # keys
+
+    def _cmd_exists(self, *names: str) -> int:
+        return sum(self._get(name) is not None for name in names)
+
+    def _cmd_del(self, *names: str) -> int:
+        removed = 0
+        for name in names:
+            if self._get(name) is not None:
+                del self.data[name]
+                removed += 1
+            self.expires.pop(name, None)
+        return removed
+
+    def _cmd_expire(self, key: str, seconds: int) -> int:
+        if self._get(key) is None:
+            return 0
+        self.expires[key] = time.monotonic() + float(seconds)
+        return 1
+
+    def _cmd_scan(self, cursor: int, *args: Any) -> List[Any]:
+        options = dict(zip(args[::2], args[1::2]))
+        pattern = options.get("MATCH", "*")
+        found = [key for key in list(self.data) if self._get(key) is not None]
+        return ["0", [key for key in found if fnmatch.fnmatchcase(key, pattern)]]
+
+    # strings
+
+    def _cmd_get(self, key: str) -> Optional[str]:
+        return self._get(key)
+
+    def _cmd_set(self, key: str, value: Any, *options: Any) -> Optional[str]:
+        flags = [str(option).upper() for option in options]
+        if "NX" in flags and self._get(key) is not None:
+            return None
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        if "EX" in flags:
+            seconds = options[flags.index("EX") + 1]
+            self.expires[key] = time.monotonic() + float(seconds)
+        return "OK"
+
+    def _cmd_incr(self, key: str) -> int:
+        value = int(self._get(key) or 0) + 1
+        self.data[key] = str(value)
+        return value
+
+    # hashes
+
+    def _cmd_hset(self, key: str, *args: Any) -> int:
+        data = self._get(key, dict)
+        added = 0
+        for field_name, value in zip(args[::2], args[1::2]):
+            added += field_name not in data
+            data[field_name] = str(value)
+        return added
+
+    def _cmd_hget(self, key: str, field_name: str) -> Optional[str]:
+        return (self._get(key) or {}).get(field_name)
+
+    def _cmd_hmget(self, key: str, *fields: str) -> List[Optional[str]]:
+        data = self._get(key) or {}
+        return [data.get(name) for name in fields]
+
+    def _cmd_hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._get(key) or {})
+
+    # sets
+
+    def _cmd_sadd(self, key: str, *members: str) -> int:
+        data = self._get(key, set)
+        before = len(data)
+        data.update(members)
+        return len(data) - before
+
+    def _cmd_srem(self, key: str, *members: str) -> int:
+        data = self._get(key) or set()
+        removed = len(data & set(members))
+        data.difference_update(members)
+        if not data:
+            self._cmd_del(key)
+        return removed
+
+    def _cmd_smembers(self, key: str) -> List[str]:
+        return list(self._get(key) or ())
+
+    def _cmd_sismember(self, key: str, member: str) -> int:
+        return int(member in (self._get(key) or ()))
+
+    def _cmd_scard(self, key: str) -> int:
+        return len(self._get(key) or ())
+
+    def _cmd_sscan(self, key: str, cursor: int, *args: Any) -> List[Any]:
+        return ["0", self._cmd_smembers(key)]
+
+    # lists
+
+    def _cmd_lpush(self, key: str, *values: Any) -> int:
+        data = self._get(key, list)
+        for value in values:
+            data.insert(0, str(value))
+        return len(data)
+
+    def _cmd_ltrim(self, key: str, start: int, stop: int) -> str:
+        data = self._get(key)
+        if data is not None:
+            data[:] = _index_range(data, int(start), int(stop))
+            if not data:
+                self._cmd_del(key)
+        return "OK"
+
+    def _cmd_lrange(self, key: str, start: int, stop: int) -> List[str]:
+        return _index_range(self._get(key) or [], int(start), int(stop))
+
+    def _cmd_llen(self, key: str) -> int:
+        return len(self._get(key) or [])
+
+    # sorted sets
+
+    def _cmd_zadd(self, key: str, *args: Any) -> int:
+        nx = args and args[0] == "NX"
+        if nx:
+            args = args[1:]
+        data = self._get(key, dict)
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            if member in data:
+                if nx:
+                    continue
+            else:
+                added += 1
+            data[member] = float(score)
+        return added
+
+    def _cmd_zincrby(self, key: str, amount: float, member: str) -> str:
+        data = self._get(key, dict)
+        data[member] = data.get(member, 0.0) + float(amount)
+        return _format_score(data[member])
+
+    def _cmd_zscore(self, key: str, member: str) -> Optional[str]:
+        score = (self._get(key) or {}).get(member)
+        return None if score is None else _format_score(score)
+
+    def _cmd_zrem(self, key: str, *members: str) -> int:
+        data = self._get(key) or {}
+        removed = sum(data.pop(member, None) is not None for member in members)
+        if not data:
+            self._cmd_del(key)
+        return removed
+
+    def _cmd_zcard(self, key: str) -> int:
+        return len(self._get(key) or {})
+
+    def _sorted(self, key: str) -> List[Tuple[str, float]]:
+        data = self._get(key) or {}
+        return sorted(data.items(), key=lambda item: (item[1], item[0]))
+
+    def _cmd_zrevrange(self, key: str, start: int, stop: int) -> List[str]:
+        members = [member for member, _ in reversed(self._sorted(key))]
+        return _index_range(members, int(start), int(stop))
+
+    def _cmd_zrange(self, key: str, start: int, stop: int) -> List[str]:
+        members = [member for member, _ in self._sorted(key)]
+        return _index_range(members, int(start), int(stop))
+
+    def _cmd_zrangebyscore(
+        self, key: str, low: Any, high: Any, *args: Any
+    ) -> List[str]:
+        in_range = _score_bounds(low, high)
+        members = [m for m, score in self._sorted(key) if in_range(score)]
+        if args and args[0] == "LIMIT":
+            offset, count = int(args[1]), int(args[2])
+            end = offset + count if count >= 0 else None
+            members = members[offset:end]
+        return members
+
+    def _cmd_zremrangebyscore(self, key: str, low: Any, high: Any) -> int:
+        in_range = _score_bounds(low, high)
+        return self._cmd_zrem(
+            key, *[m for m, score in self._sorted(key) if in_range(score)]
+        )
+
+    def _cmd_zrangebylex(self, key: str, start: str, end: str, *args: Any) -> List[str]:
+        in_range = _lex_bounds(start, end)
+        members = sorted(m for m in (self._get(key) or {}) if in_range(m))
+        if args and args[0] == "LIMIT":
+            offset, count = int(args[1]), int(args[2])
+            end = offset + count if count >= 0 else None
+            members = members[offset:end]
+        return members
+
+    # scripting
+
+    def _cmd_eval(self, source: str, numkeys: int, *args: Any) -> Any:
+        script = SCRIPTS.get(source)
+        if script is None:
+            raise ValueError("unsupported script")
+        numkeys = int(numkeys)
+        return script.emulate(self, args[:numkeys], args[numkeys:])
+
+    # pubsub
+
+    def _cmd_publish(self, channel: str, data: Any) -> int:
+        callbacks = self.subscribers.get(channel, [])
+        for callback in callbacks:
+            callback(channel, data)
+        return len(callbacks)
+
+
+def make_backend(name: Optional[str] = None) -> Union[RedioBackend, MemoryBackend]:
+    """Create async storage backend.
+
+    Backend name defaults to ``CHITTY_STORAGE_BACKEND`` environment variable,
+    ``redis`` or ``memory``.
+
+    :param name: backend name, defaults to None
+    :type name: Optional[str], optional
+    :return: storage backend
+    :rtype: Union[RedioBackend, MemoryBackend]
+    """
+    name = name or os.getenv("CHITTY_STORAGE_BACKEND", BACKEND_REDIS)
+    if name == BACKEND_MEMORY:
+        return MemoryBackend()
+    if name != BACKEND_REDIS:
+        raise ValueError(f"unknown storage backend {name}")
+    return RedioBackend()
+
+
+storage = AsyncStorage(make_backend())
@@ -0,0 +1,291 @@
+"""TLS termination for WebSocket listener.
+
+Server context issues TLS 1.3 session tickets (and keeps OpenSSL internal
+session cache for TLS 1.2 clients), so reconnecting clients can resume
+sessions and skip full handshake. Ticket encryption keys are generated per
+process by OpenSSL unless shared key file is configured, in which case
+sessions can be resumed on any node that uses the same key file, also
+across restarts. Shared keys are installed through CPython internals, so
+they must be enabled explicitly with ``CHITTY_TLS_CTYPES_TICKET_KEYS=1`` and
+only work on CPython versions in :data:`CTYPES_TICKET_KEYS_VERSIONS`.
+
+Handshakes are performed by :class:`HandshakeListener` in separate tasks
+before connection is handed over to WebSocket server, so that slow clients
+do not block accepting new connections. Handshake counts and timing are
+collected in module level :data:`stats` object.
+"""
+
+import ctypes
+import logging
+import os
+import platform
+import ssl
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import trio
+
+log = logging.getLogger(__name__)
+
+TICKET_KEY_SIZE = 80  # 16 bytes key name, 32 bytes HMAC key, 32 bytes AES key
+
+NUM_TICKETS = int(os.getenv("CHITTY_TLS_TICKETS", "2"))
+HANDSHAKE_TIMEOUT = float(os.getenv("CHITTY_TLS_HANDSHAKE_TIMEOUT", "10"))
+REPORT_INTERVAL = float(os.getenv("CHITTY_TLS_REPORT_INTERVAL", "60"))
+CTYPES_TICKET_KEYS = os.getenv("CHITTY_TLS_CTYPES_TICKET_KEYS") == "1"
+
+# CPython versions where SSL context object layout has been verified
+CTYPES_TICKET_KEYS_VERSIONS = ((3, 8), (3, 13))
+
+_SSL_CTRL_GET_TLSEXT_TICKET_KEYS = 58
+_SSL_CTRL_SET_TLSEXT_TICKET_KEYS = 59
+
+
+def _ssl_ctx_ctrl():
+    import _ssl
+
+    lib = ctypes.CDLL(_ssl.__file__)
+    fn = lib.SSL_CTX_ctrl
+    fn.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_long, ctypes.c_void_p]
+    fn.restype = ctypes.c_long
+    return fn
+
+
+def _check_ctypes_ticket_keys(enabled: bool) -> None:
+    if not enabled:
+        raise RuntimeError(
+            "shared session ticket keys use CPython internals,"
+            " set CHITTY_TLS_CTYPES_TICKET_KEYS=1 to enable them"
+        )
+    low, high = CTYPES_TICKET_KEYS_VERSIONS
+    version = sys.version_info[:2]
+    if platform.python_implementation() != "CPython" or not low <= version <= high:
+        raise RuntimeError(
+            "shared session ticket keys are not supported on"
+            f" {platform.python_implementation()} {platform.python_version()}"
+        )
+
+
+def set_ticket_keys(
+    ctx: ssl.SSLContext, key: bytes, *, enabled: bool = CTYPES_TICKET_KEYS
+) -> None:
+    """Install session ticket encryption keys in server context.
+
+    Standard library does not expose this OpenSSL control, so it is called
+    through :mod:`ctypes` on ``SSL_CTX`` pointer that is the first member of
+    CPython SSL context object. This depends on private object layout, so
+    it has to be enabled and runs only on verified CPython versions. Keys
+    are read back to verify they were installed.
+
+    :param ctx: server SSL context
+    :type ctx: ssl.SSLContext
+    :param key: ticket keys, exactly :data:`TICKET_KEY_SIZE` bytes
+    :type key: bytes
+    :param enabled: flag whether use of CPython internals is allowed,
+                    defaults to :data:`CTYPES_TICKET_KEYS`
+    :type enabled: bool, optional
+    :raises ValueError: if key size is invalid
+    :raises RuntimeError: if keys are not enabled, not supported or could
+                          not be installed
+    """
+    if len(key) != TICKET_KEY_SIZE:
+        raise ValueError(f"ticket key must be {TICKET_KEY_SIZE} bytes long")
+    _check_ctypes_ticket_keys(enabled)
+    try:
+        ctrl = _ssl_ctx_ctrl()
+    except (OSError, AttributeError) as e:
+        raise RuntimeError("OpenSSL SSL_CTX_ctrl is not available") from e
+    ctx_ptr = ctypes.c_void_p.from_address(id(ctx) + object.__basicsize__).value
+    if not ctx_ptr:
+        raise RuntimeError("SSL context is not initialised")
+    buf = ctypes.create_string_buffer(key, TICKET_KEY_SIZE)
+    if not ctrl(ctx_ptr, _SSL_CTRL_SET_TLSEXT_TICKET_KEYS, TICKET_KEY_SIZE, buf):
+        raise RuntimeError("failed to set session ticket keys")
+    check = ctypes.create_string_buffer(TICKET_KEY_SIZE)
+    ctrl(ctx_ptr, _SSL_CTRL_GET_TLSEXT_TICKET_KEYS, TICKET_KEY_SIZE, check)
+    if check.raw != key:
+        raise RuntimeError("session ticket keys were not installed")
+
+
+def make_server_context(
+    certfile: str,
+    keyfile: Optional[str] = None,
+    *,
+    num_tickets: int = NUM_TICKETS,
+    ticket_key_file: Optional[str] = None,
+) -> ssl.SSLContext:
+    """Create server SSL context with session resumption enabled.
+
+    Ticket key file should contain :data:`TICKET_KEY_SIZE` random bytes
+    (eg. ``head -c 80 /dev/urandom > ticket.key``) and be distributed to
+    all nodes that should accept each other's session tickets.
+
+    :param certfile: path to PEM certificate chain
+    :type certfile: str
+    :param keyfile: path to PEM private key, if not included in certificate
+                    file, defaults to None
+    :type keyfile: Optional[str], optional
+    :param num_tickets: number of TLS 1.3 session tickets issued after full
+                        handshake, defaults to :data:`NUM_TICKETS`
+    :type num_tickets: int, optional
+    :param ticket_key_file: path to shared session ticket key file, defaults
+                            to None
+    :type ticket_key_file: Optional[str], optional
+    :return: server SSL context
+    :rtype: ssl.SSLContext
+    """
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.load_cert_chain(certfile, keyfile)
+    ctx.num_tickets = num_tickets
+    if ticket_key_file:
+        with open(ticket_key_file, "rb") as fp:
+            set_ticket_keys(ctx, fp.read())
+        log.info(f"using shared session ticket keys from {ticket_key_file}")
+    return ctx
+
+
+@dataclass
+class HandshakeStats:
+    """TLS handshake counters and timing.
+
+    :ivar full: number of completed full handshakes
+    :type full: int
+    :ivar resumed: number of completed abbreviated (resumed) handshakes
+    :type resumed: int
+    :ivar failed: number of failed handshakes
+    :type failed: int
+    :ivar timeouts: number of handshakes that did not complete in time
+    :type timeouts: int
+    """
+
+    full: int = 0
+    resumed: int = 0
+    failed: int = 0
+    timeouts: int = 0
+    full_time: float = 0.0
+    resumed_time: float = 0.0
+    max_time: float = 0.0
+
+    def record(self, duration: float, resumed: bool) -> None:
+        if resumed:
+            self.resumed += 1
+            self.resumed_time += duration
+        else:
+            self.full += 1
+            self.full_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+    def to_map(self) -> Dict[str, Any]:
+        completed = self.full + self.resumed
+        return {
+            "full": self.full,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "resumptionRate": self.resumed / completed if completed else 0.0,
+            "fullMs": self.full_time / self.full * 1000 if self.full else 0.0,
+            "resumedMs": (
+                self.resumed_time / self.resumed * 1000 if self.resumed else 0.0
+            ),
+            "maxMs": self.max_time * 1000,
+        }
+
+    def summary(self) -> str:
+        data = self.to_map()
+        return (
+            f"full={data['full']} resumed={data['resumed']} "
+            f"failed={data['failed']} timeouts={data['timeouts']} "
+            f"resumption={data['resumptionRate']:.1%} "
+            f"full_avg={data['fullMs']:.2f}ms resumed_avg={data['resumedMs']:.2f}ms "
+            f"max={data['maxMs']:.2f}ms"
+        )
+
+
+stats = HandshakeStats()
+
+
+class HandshakeListener(trio.abc.Listener):
+    """Listener that completes TLS handshake before returning stream.
+
+    Connections accepted from wrapped listener are handshaked concurrently
+    in background tasks (:meth:`run` must be running) and only streams with
+    completed handshake are returned from :meth:`accept`.
+
+    :param transport_listener: SSL listener
+    :type transport_listener: trio.SSLListener
+    :param timeout: handshake timeout in seconds, defaults to
+                    :data:`HANDSHAKE_TIMEOUT`
+    :type timeout: float, optional
+    """
+
+    def __init__(
+        self, transport_listener: trio.SSLListener, timeout: float = HANDSHAKE_TIMEOUT
+    ):
+        self.transport_listener = transport_listener
+        self.timeout = timeout
+        self._send_channel, self._receive_channel = trio.open_memory_channel(0)
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED) -> None:
+        """Accept connections and run handshakes until cancelled."""
+        async with trio.open_nursery() as nursery:
+            task_status.started()
+            while True:
+                try:
+                    stream = await self.transport_listener.accept()
+                except OSError as e:
+                    log.error(f"error accepting connection: {e}")
+                    await trio.sleep(0.1)
+                    continue
+                nursery.start_soon(self._handshake, stream)
+
+    async def _handshake(self, stream: trio.SSLStream) -> None:
+        started = time.perf_counter()
+        with trio.move_on_after(self.timeout) as scope:
+            try:
+                await stream.do_handshake()
+            except Exception as e:
+                # one bad connection must not stop the listener
+                if not isinstance(e, trio.BrokenResourceError):
+                    log.exception("unexpected TLS handshake error")
+                stats.failed += 1
+                await trio.aclose_forcefully(stream)
+                return
+        if scope.cancelled_caught:
+            stats.timeouts += 1
+            await trio.aclose_forcefully(stream)
+            return
+        stats.record(time.perf_counter() - started, stream.session_reused)
+        try:
+            await self._send_channel.send(stream)
+        except trio.ClosedResourceError:
+            await trio.aclose_forcefully(stream)
+
+    async def accept(self) -> trio.SSLStream:
+        return await self._receive_channel.receive()
+
+    async def aclose(self) -> None:
+        self._send_channel.close()
+        await self.transport_listener.aclose()
+
+
+async def report(ctx: ssl.SSLContext, interval: float = REPORT_INTERVAL) -> None:
+    """Periodically log handshake and session cache statistics.
+
+    :param ctx: server SSL context
+    :type ctx: ssl.SSLContext
+    :param interval: report interval in seconds, defaults to
+                     :data:`REPORT_INTERVAL`
+    :type interval: float, optional
+    """
+    while True:
+        await trio.sleep(interval)
+        log.info(f"tls handshakes: {stats.summary()}")
+        cache = ctx.session_stats()
+        log.info(
+            f"tls session cache: hits={cache['hits']} misses={cache['misses']} "
+            f"timeouts={cache['timeouts']} cache_full={cache['cache_full']}"
+        )
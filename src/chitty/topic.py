@@ -1,5 +1,8 @@
 DEFAULT_TOPICS = ["general"]
 
 EVENTS_TOPIC = "sys:events"
+PRESENCE_TOPIC = "sys:presence"
 
-SYSTEM_TOPICS = [EVENTS_TOPIC]
+SYSTEM_TOPICS = [EVENTS_TOPIC, PRESENCE_TOPIC]
+
+SYSTEM_TOPIC_PREFIX = "sys:"
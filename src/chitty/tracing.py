@@ -0,0 +1,183 @@
+"""Sampled message delivery tracing.
+
+Sampled inbound messages get trace ID that is carried in payload of every
+message published while handling them. Each hop on the way to recipient
+(receive, route, publish, pubsub delivery and send) is recorded with
+monotonic and wall clock timestamps, so per-hop latency can be reconstructed
+for a single delivery, also across server nodes.
+
+Tracing is configured with environment variables:
+
+* ``CHITTY_TRACE_SAMPLE_RATE`` - fraction of inbound messages to trace,
+  defaults to 0 (disabled)
+* ``CHITTY_TRACE_FILE`` - file where trace records are appended as JSON
+  lines, defaults to ``chitty-traces.jsonl``
+* ``CHITTY_TRACE_COLLECTOR`` - optional ``host:port`` of UDP collector that
+  receives every record as JSON datagram instead of writing to file
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Mapping, Optional, TextIO, Tuple
+
+HOP_RECEIVE = "receive"
+HOP_DECODE = "decode"
+HOP_ROUTE = "route"
+HOP_PUBLISH = "publish"
+HOP_DELIVER = "deliver"
+HOP_SEND = "send"
+
+TRACE_FIELD = "trace"
+
+log = logging.getLogger(__name__)
+
+current_trace: ContextVar[Optional[str]] = ContextVar("current_trace", default=None)
+
+
+class TraceExporter:
+    """Trace record writer.
+
+    Records go to UDP collector if its address is configured, otherwise they
+    are appended to local file. File writes are buffered and flushed at most
+    once per ``flush_interval`` seconds.
+
+    :param path: trace file path
+    :type path: str
+    :param collector: optional collector address, defaults to None
+    :type collector: Optional[Tuple[str, int]], optional
+    :param flush_interval: file flush interval, defaults to 1
+    :type flush_interval: float, optional
+    """
+
+    def __init__(
+        self,
+        path: str,
+        collector: Optional[Tuple[str, int]] = None,
+        flush_interval: float = 1.0,
+    ):
+        self.path = path
+        self.collector = collector
+        self.flush_interval = flush_interval
+        self._next_flush = 0.0
+        self._file: Optional[TextIO] = None
+        self._sock: Optional[socket.socket] = None
+
+    def export(self, record: Mapping) -> None:
+        data = json.dumps(record, separators=(",", ":"))
+        if self.collector is not None:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._sock.setblocking(False)
+            try:
+                self._sock.sendto(data.encode("utf-8"), self.collector)
+            except OSError:
+                log.debug("trace record dropped")
+            return
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            atexit.register(self.flush)
+        self._file.write(data + "\n")
+        now = time.monotonic()
+        if now >= self._next_flush:
+            self._next_flush = now + self.flush_interval
+            self._file.flush()
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+
+class Tracer:
+    """Sampling tracer.
+
+    :param sample_rate: fraction of inbound messages to trace
+    :type sample_rate: float
+    :param exporter: trace record writer
+    :type exporter: TraceExporter
+    """
+
+    def __init__(self, sample_rate: float, exporter: TraceExporter):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+
+    def sample(self) -> Optional[str]:
+        """Make sampling decision for inbound message.
+
+        :return: new trace ID if message is sampled, None otherwise
+        :rtype: Optional[str]
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return uuid.uuid4().hex
+
+    def hop(
+        self,
+        trace_id: Optional[str],
+        hop: str,
+        monotonic: Optional[float] = None,
+        **extra: str,
+    ) -> None:
+        """Record trace hop.
+
+        This is no-op if trace ID is None, so it is safe to call for every
+        message.
+
+        :param trace_id: trace ID
+        :type trace_id: Optional[str]
+        :param hop: hop name
+        :type hop: str
+        :param monotonic: hop monotonic timestamp, defaults to None (now)
+        :type monotonic: Optional[float], optional
+        """
+        if trace_id is None:
+            return
+        now = time.monotonic()
+        if monotonic is None:
+            monotonic = now
+        record = {
+            "trace": trace_id,
+            "hop": hop,
+            "mono": monotonic,
+            "wall": time.time() - (now - monotonic),
+            "node": self.node,
+        }
+        record.update(extra)
+        self.exporter.export(record)
+
+
+def _collector_address() -> Optional[Tuple[str, int]]:
+    address = os.getenv("CHITTY_TRACE_COLLECTOR")
+    if not address:
+        return None
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+tracer = Tracer(
+    sample_rate=float(os.getenv("CHITTY_TRACE_SAMPLE_RATE", "0")),
+    exporter=TraceExporter(
+        os.getenv("CHITTY_TRACE_FILE", "chitty-traces.jsonl"),
+        collector=_collector_address(),
+    ),
+)
+
+
+def payload_trace(payload: Mapping) -> Optional[str]:
+    """Extract trace ID from message payload.
+
+    :param payload: message payload
+    :type payload: Mapping
+    :return: trace ID or None if message is not traced
+    :rtype: Optional[str]
+    """
+    if isinstance(payload, Mapping):
+        return payload.get(TRACE_FIELD)
+    return None
@@ -2,14 +2,15 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import AsyncGenerator, Mapping, MutableMapping, Optional
+from typing import TYPE_CHECKING, AsyncGenerator, Mapping, MutableMapping, Optional
 
-from redio.pubsub import PubSub
+from . import event, tracing
+from .message import MSG_TYPE_MESSAGE, Message, delivered_message, make_message
+from .storage import storage
+from .topic import DEFAULT_TOPICS, SYSTEM_TOPIC_PREFIX
 
-from . import event, keys
-from .message import MSG_TYPE_MESSAGE, Message, make_message
-from .storage import redis
-from .topic import DEFAULT_TOPICS
+if TYPE_CHECKING:
+    from .pubsub import TopicPubSub
 
 
 @dataclass
@@ -31,30 +32,37 @@ class User:
     created: Optional[datetime] = None
 
     _topics: set[str] = field(init=False, repr=False, default_factory=set)
-    _pubsub: Optional[PubSub] = field(init=False, repr=False, default=None)
+    _pubsub: Optional[TopicPubSub] = field(init=False, repr=False, default=None)
 
     def __post_init__(self):
-        self._pubsub = redis.pubsub(self.name, *DEFAULT_TOPICS).autodecode.with_channel
-        self._pubsub.psubscribe("sys:*")
+        from .pubsub import open_pubsub
+
+        self._pubsub = open_pubsub(self.name, *DEFAULT_TOPICS).strdecode.with_channel
+        self._pubsub.psubscribe(f"{SYSTEM_TOPIC_PREFIX}*")
         self._topics = set(DEFAULT_TOPICS)
         self._topics.add(self.name)
 
     @classmethod
     async def find(cls, name: str) -> Optional[User]:
-        key = f"{keys.USERS}:{name}"
-        data = await redis().hgetall(key).autodecode  # type: ignore
+        data = await storage.get_user(name)
         if data:
-            data.pop("password", None)
             data["created"] = datetime.fromtimestamp(
                 float(data["created"]), tz=timezone.utc
             )
             user = cls(**data)
-            key = f"{keys.TOPICS}:{name}"
-            user_topics = await redis().smembers(key).autodecode  # type: ignore
+            user_topics = await storage.get_user_topics(name)
             for topic in user_topics:
                 await user.subscribe(topic)
             return user
 
+    @property
+    def topics(self) -> frozenset[str]:
+        """Names of topics user is subscribed to.
+
+        :rtype: frozenset[str]
+        """
+        return frozenset(self._topics)
+
     @classmethod
     def from_map(cls, data: Mapping[str, str]) -> User:
         """Deserialise user data into User object.
@@ -91,15 +99,33 @@ class User:
         :type topic: str
         """
         self._pubsub.subscribe(topic)  # type: ignore
-        topics = await redis().smembers(keys.TOPICS).autodecode  # type: ignore
-        if topic not in topics:
-            await redis().sadd(keys.TOPICS, topic)  # type: ignore
+        if topic != self.name and not await storage.topic_exists(topic):
             await event.new_topic_created(topic)
         self._topics.add(topic)
-        key = f"{keys.TOPICS}:{self.name}"
-        await redis().sadd(key, topic)  # type: ignore
+        await self._add_membership(topic)
+
+    async def unsubscribe(self, topic: str) -> bool:
+        """Unsubscribe from specified topic.
 
-    async def post_message(self, topic: str, message: str) -> None:
+        Messages from the topic that are already in flight are dropped by
+        :meth:`message_stream`.
+
+        :param topic: topic name
+        :type topic: str
+        :return: True if user was subscribed to the topic
+        :rtype: bool
+        """
+        self._pubsub.unsubscribe(topic)  # type: ignore
+        subscribed = topic in self._topics
+        self._topics.discard(topic)
+        removed = await storage.remove_subscriptions(self.name, [topic])
+        if removed:
+            await storage.count_subscribers(topic, -1)
+        return subscribed or bool(removed)
+
+    async def post_message(
+        self, topic: str, message: str, attachment: Optional[Mapping] = None
+    ) -> Message:
         """Post chat message to a topic.
 
         This also subscribes user to the topic. If topic does not yet exists,
@@ -109,19 +135,40 @@ class User:
         :type topic: str
         :param message: message text
         :type message: str
+        :param attachment: attachment reference, defaults to None
+        :type attachment: Optional[Mapping], optional
+        :return: published message
+        :rtype: Message
         """
-        self._pubsub.subscribe(topic)  # type: ignore
+        if topic not in self._topics:
+            self._pubsub.subscribe(topic)  # type: ignore
         kw = {"type": MSG_TYPE_MESSAGE}
+        if attachment is not None:
+            kw["attachment"] = attachment
         msg_obj = make_message(self.to_map(), topic, message, **kw)
         await msg_obj.publish()
-        if topic not in self._topics and topic != self.name:
+        if topic == self.name:
+            return msg_obj
+        await storage.touch_topic(topic, msg_obj.payload["date"])
+        if topic not in self._topics:
             self._topics.add(topic)
-            key = f"{keys.TOPICS}:{self.name}"
-            await redis().sadd(key, topic)  # type: ignore
-        topics = await redis().smembers(keys.TOPICS).autodecode  # type: ignore
-        if topic != self.name and topic not in topics:
-            await redis().sadd(keys.TOPICS, topic)  # type: ignore
+            await self._add_membership(topic)
+        if not await storage.topic_exists(topic):
             await event.new_topic_created(topic)
+        return msg_obj
+
+    async def _add_membership(self, topic: str) -> None:
+        """Record topic in user subscriptions.
+
+        Topic directory subscriber count is incremented only if user was not
+        already subscribed.
+
+        :param topic: topic name
+        :type topic: str
+        """
+        added = await storage.add_subscription(self.name, topic)
+        if added and topic != self.name:
+            await storage.count_subscribers(topic)
 
     async def message_stream(self) -> AsyncGenerator[Message, None]:
         """Generator that yields Message objects as they come to pubsub
@@ -131,7 +178,15 @@ class User:
         :rtype: AsyncGenerator[Message, None]
         """
         async for topic, message in self._pubsub:  # type: ignore
-            yield Message(topic=topic, payload=message)  # type: ignore
+            if topic not in self._topics and not topic.startswith(SYSTEM_TOPIC_PREFIX):
+                continue
+            msg_obj = delivered_message(topic, message)
+            tracing.tracer.hop(
+                tracing.payload_trace(msg_obj.payload),
+                tracing.HOP_DELIVER,
+                user=self.name,
+            )
+            yield msg_obj
 
 
 class UserRegistry:
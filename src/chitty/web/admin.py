@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import io
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+import falcon
+from falcon import Request, Response
+
+from ..utils import error_response
+from .auth import authenticated_user
+from .bulk import CONTENT_TYPES, read_records
+from .services import UserPoolManager
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# number of password hashing processes shared by import requests
+IMPORT_WORKERS = int(os.getenv("CHITTY_IMPORT_WORKERS", "2"))
+
+
+def _admin_names():
+    return {
+        name.strip()
+        for name in os.getenv("CHITTY_ADMINS", "").split(",")
+        if name.strip()
+    }
+
+
+def authorize_admin(req: Request, resp: Response, resource, params) -> None:
+    """Falcon hook that allows request only with bearer token of one of users
+    listed in ``CHITTY_ADMINS``.
+    """
+    if authenticated_user(req) not in _admin_names():
+        raise falcon.HTTPForbidden(description="Token authentication failure")
+
+
+class UserImportResource:
+    def __init__(self, user_manager: UserPoolManager, workers: int = IMPORT_WORKERS):
+        self.user_mgr = user_manager
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Process pool shared by all import requests, started on first
+        use."""
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    @falcon.before(authorize_admin)
+    def on_post(self, req: Request, resp: Response) -> None:
+        content_type = (req.content_type or "").split(";")[0].strip().lower()
+        fmt = CONTENT_TYPES.get(content_type)
+        if fmt is None:
+            code = falcon.HTTP_415[:3]
+            resp.media = error_response(
+                reason=code, message="expected JSON lines or CSV data"
+            )
+            resp.status = falcon.HTTP_415
+            return
+        stream = io.TextIOWrapper(req.bounded_stream, encoding="utf-8")
+        result = self.user_mgr.import_users(
+            read_records(stream, fmt), workers=self.workers, executor=self.executor
+        )
+        resp.media = result.to_map()
+        resp.status = falcon.HTTP_200
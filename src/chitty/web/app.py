@@ -2,9 +2,15 @@ import os
 
 import falcon
 
+from ..search import SEARCH_DB, SearchIndex
+from .admin import UserImportResource
+from .attachments import ATTACHMENTS_DIR, AttachmentResource, AttachmentUploadResource
 from .auth import UserLoginResource, UserNamesResource, UserRegistrationResource
-from .meta import ServerMetadataResource
+from .blobs import BlobStore
+from .meta import NodeView, ServerMetadataResource
+from .search import MessageSearchResource
 from .services import Storage, UserPoolManager
+from .topics import TopicDirectoryResource
 
 _resources = {}
 
@@ -16,17 +22,39 @@ class App(falcon.App):
             kw.setdefault("cors_enable", True)
         super().__init__(*args, **kw)
         self.user_mgr = UserPoolManager(Storage())
+        self.blob_store = BlobStore(ATTACHMENTS_DIR)
+        self.search_index = SearchIndex(SEARCH_DB)
         self.register_routes()
 
     def register_routes(self):
         reg = _resources.setdefault("register", UserRegistrationResource(self.user_mgr))
         login = _resources.setdefault("login", UserLoginResource(self.user_mgr))
         names = _resources.setdefault("names", UserNamesResource(self.user_mgr))
-        meta = _resources.setdefault("meta", ServerMetadataResource())
+        meta = _resources.setdefault(
+            "meta", ServerMetadataResource(NodeView(self.user_mgr))
+        )
+        user_import = _resources.setdefault(
+            "user_import", UserImportResource(self.user_mgr)
+        )
+        topics = _resources.setdefault("topics", TopicDirectoryResource(self.user_mgr))
+        upload = _resources.setdefault(
+            "upload", AttachmentUploadResource(self.blob_store)
+        )
+        attachment = _resources.setdefault(
+            "attachment", AttachmentResource(self.blob_store)
+        )
+        search = _resources.setdefault(
+            "search", MessageSearchResource(self.search_index)
+        )
         self.add_route("/register", reg)
         self.add_route("/login", login)
         self.add_route("/names/{name}", names)
         self.add_route("/meta", meta)
+        self.add_route("/admin/users/import", user_import)
+        self.add_route("/topics", topics)
+        self.add_route("/attachments", upload)
+        self.add_route("/attachments/{attachment_id}", attachment)
+        self.add_route("/search", search)
 
 
 def make_app() -> App:
@@ -0,0 +1,87 @@
+import os
+
+import falcon
+from falcon import Request, Response
+
+from ..utils import error_response
+from .auth import authorize_user
+from .blobs import BlobStore, BlobTooLarge
+
+ATTACHMENTS_DIR = os.getenv("CHITTY_ATTACHMENTS_DIR", "attachments")
+
+# content addressed files never change
+CACHE_CONTROL = ["public", "max-age=31536000", "immutable"]
+
+# types that can not run scripts are shown inline, everything else (HTML,
+# SVG, ...) is served as download so it can not execute on web origin
+INLINE_CONTENT_TYPES = {
+    "image/png",
+    "image/jpeg",
+    "image/gif",
+    "image/webp",
+    "audio/mpeg",
+    "audio/ogg",
+    "video/mp4",
+    "video/webm",
+    "text/plain",
+}
+
+
+class AttachmentUploadResource:
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    @falcon.before(authorize_user)
+    def on_post(self, req: Request, resp: Response) -> None:
+        if req.content_length is not None and req.content_length > self.store.max_size:
+            raise falcon.HTTPContentTooLarge(
+                description=f"file exceeds {self.store.max_size} bytes"
+            )
+        try:
+            info = self.store.save(req.bounded_stream, req.content_type)
+        except BlobTooLarge as e:
+            raise falcon.HTTPContentTooLarge(description=str(e))
+        resp.media = info.to_map()
+        resp.location = f"/attachments/{info.id}"
+        resp.status = falcon.HTTP_201
+
+
+class AttachmentResource:
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    def on_get(self, req: Request, resp: Response, attachment_id: str) -> None:
+        info = self.store.info(attachment_id)
+        if info is None:
+            code = falcon.HTTP_404[:3]
+            resp.media = error_response(reason=code, message="attachment not found")
+            resp.status = falcon.HTTP_404
+            return
+        resp.etag = info.id
+        resp.cache_control = CACHE_CONTROL
+        resp.set_header("X-Content-Type-Options", "nosniff")
+        media_type = (info.content_type or "").split(";")[0].strip().lower()
+        if media_type not in INLINE_CONTENT_TYPES:
+            resp.downloadable_as = info.id
+        resp.accept_ranges = "bytes"
+        if info.id in (req.if_none_match or []):
+            resp.status = falcon.HTTP_304
+            return
+        start, end = 0, info.size - 1
+        resp.status = falcon.HTTP_200
+        if req.range is not None and req.range_unit == "bytes":
+            first, last = req.range
+            if first < 0:
+                start = max(info.size + first, 0)
+            else:
+                start = first
+                if last >= 0:
+                    end = min(last, end)
+            if start > end:
+                raise falcon.HTTPRangeNotSatisfiable(info.size)
+            resp.content_range = (start, end, info.size)
+            resp.status = falcon.HTTP_206
+        resp.content_type = info.content_type
+        resp.set_stream(
+            self.store.open_range(info.id, start, end - start + 1), end - start + 1
+        )
@@ -1,11 +1,40 @@
 import falcon
 from falcon import Request, Response
 
+from ..services.auth import ResultType, check_token
 from ..utils import error_response
 from .errors import UserExists, UserError
 from .services import UserPoolManager
 
 
+def authenticated_user(req: Request) -> str:
+    """Get name of user authenticated with bearer token.
+
+    :param req: request object
+    :type req: Request
+    :raises falcon.HTTPUnauthorized: if request has no bearer token
+    :raises falcon.HTTPForbidden: if token is invalid or expired
+    :return: user name
+    :rtype: str
+    """
+    auth = req.get_header("Authorization") or ""
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise falcon.HTTPUnauthorized(description="Please authenticate first")
+    rv = check_token(token)
+    if rv.result != ResultType.OK:
+        raise falcon.HTTPForbidden(description="Token authentication failure")
+    return rv.value
+
+
+def authorize_user(req: Request, resp: Response, resource, params) -> None:
+    """Falcon hook that allows request only with valid bearer token.
+
+    Authenticated user name is stored in request context.
+    """
+    req.context.user = authenticated_user(req)
+
+
 class UserNamesResource:
     def __init__(self, user_manager: UserPoolManager):
         self.user_mgr = user_manager
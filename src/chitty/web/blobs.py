@@ -0,0 +1,194 @@
+"""Content addressed file storage for attachments.
+
+Files are stored on local disk under SHA-256 digest of their content, in two
+levels of fan-out directories (``ab/cd/abcd...``). Uploads are streamed in
+chunks to temporary file while digest is computed and then atomically moved
+in place, so identical files are stored once.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Mapping, Optional, Union
+
+from ..attachment import is_valid_id
+from .errors import ChittyError
+
+CHUNK_SIZE = 64 * 1024
+MAX_SIZE = int(os.getenv("CHITTY_ATTACHMENT_MAX_SIZE", str(25 * 1024 * 1024)))
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+class BlobTooLarge(ChittyError):
+    pass
+
+
+@dataclass
+class BlobInfo:
+    id: str
+    size: int
+    content_type: str = DEFAULT_CONTENT_TYPE
+
+    def to_map(self) -> Mapping[str, Union[str, int]]:
+        return {
+            "id": self.id,
+            "size": self.size,
+            "contentType": self.content_type,
+        }
+
+
+class RangeReader:
+    """Read-only file-like object limited to byte range of a file.
+
+    Reads are served from memory mapped file. :meth:`fileno` returns
+    descriptor positioned at range start, so WSGI servers that implement
+    ``wsgi.file_wrapper`` with ``sendfile`` send range directly from page
+    cache, bounded by response content length.
+
+    :param path: file path
+    :type path: str
+    :param start: range start offset
+    :type start: int
+    :param length: range length
+    :type length: int
+    """
+
+    def __init__(self, path: str, start: int, length: int):
+        self._fp = open(path, "rb")
+        self._fp.seek(start)
+        self._map = None
+        if length:
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pos = start
+        self._end = start + length
+
+    def fileno(self) -> int:
+        return self._fp.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._map is None or self._pos >= self._end:
+            return b""
+        end = self._end if size < 0 else min(self._pos + size, self._end)
+        start, self._pos = self._pos, end
+        return self._map[start:end]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._fp.close()
+
+
+class BlobStore:
+    """Content addressed file store.
+
+    :param root: storage directory
+    :type root: str
+    :param max_size: maximum file size in bytes, defaults to ``MAX_SIZE``
+    :type max_size: int, optional
+    :param chunk_size: upload read chunk size, defaults to ``CHUNK_SIZE``
+    :type chunk_size: int, optional
+    """
+
+    def __init__(
+        self, root: str, max_size: int = MAX_SIZE, chunk_size: int = CHUNK_SIZE
+    ):
+        self.root = root
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def path(self, blob_id: str) -> str:
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    def save(self, stream: BinaryIO, content_type: Optional[str] = None) -> BlobInfo:
+        """Store file content read from stream.
+
+        Content type is recorded only when content is stored for the first
+        time.
+
+        :param stream: input stream
+        :type stream: BinaryIO
+        :param content_type: file content type, defaults to None
+        :type content_type: Optional[str], optional
+        :raises BlobTooLarge: if content exceeds maximum size
+        :return: stored file info
+        :rtype: BlobInfo
+        """
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise BlobTooLarge(f"file exceeds {self.max_size} bytes")
+                    digest.update(chunk)
+                    fp.write(chunk)
+            blob_id = digest.hexdigest()
+            path = self.path(blob_id)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return self.info(blob_id)  # type: ignore
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            info = BlobInfo(blob_id, size, content_type or DEFAULT_CONTENT_TYPE)
+            self._write_meta(info)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return info
+
+    def _write_meta(self, info: BlobInfo) -> None:
+        path = f"{self.path(info.id)}.meta"
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "w") as fp:
+            json.dump({"contentType": info.content_type}, fp)
+        os.replace(tmp_path, path)
+
+    def info(self, blob_id: str) -> Optional[BlobInfo]:
+        """Get stored file info.
+
+        :param blob_id: file ID
+        :type blob_id: str
+        :return: file info or None if there is no such file
+        :rtype: Optional[BlobInfo]
+        """
+        if not is_valid_id(blob_id):
+            return None
+        path = self.path(blob_id)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return None
+        content_type = DEFAULT_CONTENT_TYPE
+        try:
+            with open(f"{path}.meta") as fp:
+                content_type = json.load(fp).get("contentType", content_type)
+        except (OSError, ValueError):
+            pass
+        return BlobInfo(blob_id, size, content_type)
+
+    def open_range(self, blob_id: str, start: int, length: int) -> RangeReader:
+        """Open stored file for reading of byte range.
+
+        :param blob_id: file ID
+        :type blob_id: str
+        :param start: range start offset
+        :type start: int
+        :param length: range length
+        :type length: int
+        :return: file-like range reader
+        :rtype: RangeReader
+        """
+        return RangeReader(self.path(blob_id), start, length)
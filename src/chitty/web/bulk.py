@@ -0,0 +1,52 @@
+import csv
+import json
+from typing import Iterator, Mapping, TextIO, Tuple
+
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+
+FORMATS = [FORMAT_JSONL, FORMAT_CSV]
+
+CONTENT_TYPES = {
+    "application/x-ndjson": FORMAT_JSONL,
+    "application/jsonl": FORMAT_JSONL,
+    "application/json-lines": FORMAT_JSONL,
+    "text/csv": FORMAT_CSV,
+}
+
+
+def read_records(
+    stream: TextIO, fmt: str = FORMAT_JSONL
+) -> Iterator[Tuple[int, Mapping[str, str]]]:
+    """Stream user records from JSON lines or CSV text stream.
+
+    Records are yielded along with their row number (1-based, CSV header is
+    not counted) so import errors can be reported back. Rows that can not be
+    parsed are yielded as empty mappings and rejected later by import
+    validation.
+
+    :param stream: text stream
+    :type stream: TextIO
+    :param fmt: data format, defaults to ``jsonl``
+    :type fmt: str, optional
+    :raises ValueError: if data format is not supported
+    :yield: row number and record
+    :rtype: Iterator[Tuple[int, Mapping[str, str]]]
+    """
+    if fmt == FORMAT_JSONL:
+        for row, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = {}
+            if not isinstance(record, dict):
+                record = {}
+            yield row, record
+    elif fmt == FORMAT_CSV:
+        for row, record in enumerate(csv.DictReader(stream), start=1):
+            yield row, record
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
@@ -1,13 +1,17 @@
+import sys
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
 
 from dotenv import find_dotenv, load_dotenv
-from werkzeug import run_simple
+
+from .bulk import FORMAT_JSONL, FORMATS
 
 
 def parse_args() -> Namespace:
     parser_kw = {"formatter_class": ArgumentDefaultsHelpFormatter}
     parser = ArgumentParser(description="Chitty auxiliary web service")
-    subparsers = parser.add_subparsers(help="Available commands")
+    subparsers = parser.add_subparsers(
+        help="Available commands", dest="command", required=True
+    )
     run_parser = subparsers.add_parser("run", help="Launch the server", **parser_kw)
     run_parser.add_argument(
         "-H", "--host", default="127.0.0.1", help="IP address to bind to"
@@ -15,13 +19,94 @@ def parse_args() -> Namespace:
     run_parser.add_argument(
         "-p", "--port", type=int, default=5001, help="port number to bind to"
     )
+    run_parser.set_defaults(func=run_server)
+    import_parser = subparsers.add_parser(
+        "import", help="Create user accounts in bulk from file", **parser_kw
+    )
+    import_parser.add_argument("file", help="user records file, - for stdin")
+    import_parser.add_argument(
+        "-f", "--format", choices=FORMATS, default=FORMAT_JSONL, help="file format"
+    )
+    import_parser.add_argument(
+        "-b", "--batch-size", type=int, default=1000, help="records per batch"
+    )
+    import_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="[optional] number of password hashing processes (default: CPU count)",
+    )
+    import_parser.set_defaults(func=import_users)
+    reindex_parser = subparsers.add_parser(
+        "reindex-topics", help="Rebuild topic directory from stored data", **parser_kw
+    )
+    reindex_parser.set_defaults(func=reindex_topics)
+    filter_parser = subparsers.add_parser(
+        "filter-terms", help="Replace content filter banned terms", **parser_kw
+    )
+    filter_parser.add_argument("file", help="terms file, one per line, - for stdin")
+    filter_parser.set_defaults(func=set_filter_terms)
     return parser.parse_args()
 
 
-def main():
-    load_dotenv(find_dotenv())
+def run_server(opts: Namespace) -> None:
+    from werkzeug import run_simple
+
     from .app import make_app
 
     application = make_app()
-    opts = parse_args()
     run_simple(opts.host, opts.port, application, use_reloader=True)
+
+
+def import_users(opts: Namespace) -> None:
+    from .bulk import read_records
+    from .services import Storage, UserPoolManager
+
+    def report(result):
+        print(
+            f"processed: {result.processed}, created: {result.created}, "
+            f"errors: {len(result.errors)}",
+            file=sys.stderr,
+        )
+
+    user_mgr = UserPoolManager(Storage())
+    if opts.file == "-":
+        stream = sys.stdin
+    else:
+        stream = open(opts.file, newline="", encoding="utf-8")
+    with stream:
+        result = user_mgr.import_users(
+            read_records(stream, opts.format),
+            batch_size=opts.batch_size,
+            workers=opts.workers,
+            progress=report,
+        )
+    for row, error in result.errors:
+        print(f"row {row}: {error}")
+
+
+def reindex_topics(opts: Namespace) -> None:
+    from .services import Storage
+
+    count = Storage().rebuild_topic_directory()
+    print(f"topic directory rebuilt, {count} topics")
+
+
+def set_filter_terms(opts: Namespace) -> None:
+    from .services import Storage
+
+    if opts.file == "-":
+        stream = sys.stdin
+    else:
+        stream = open(opts.file, encoding="utf-8")
+    with stream:
+        terms = {line.strip() for line in stream}
+    terms.discard("")
+    version = Storage().set_filter_terms(terms)
+    print(f"content filter updated, {len(terms)} terms, version {version}")
+
+
+def main():
+    load_dotenv(find_dotenv())
+    opts = parse_args()
+    opts.func(opts)
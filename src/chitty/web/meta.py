@@ -1,14 +1,99 @@
 import os
+import random
+import threading
+import time
+from typing import Callable, List, Optional
 
 from falcon import Request, Response
 
+from .services import NodeInfo, UserPoolManager
+
+NODE_STATE_ACTIVE = "active"
+
+# how long node list read from Redis is reused
+NODE_VIEW_TTL = float(os.getenv("CHITTY_NODE_VIEW_TTL", "2"))
+# nodes that did not report for this long are considered down
+NODE_STALE_AFTER = float(os.getenv("CHITTY_NODE_STALE_AFTER", "15"))
+META_MAX_AGE = int(os.getenv("CHITTY_META_MAX_AGE", "5"))
+
+
+class NodeView:
+    """Locally cached view of chat server nodes.
+
+    :param user_manager: user pool manager
+    :type user_manager: UserPoolManager
+    :param ttl: cache lifetime in seconds, defaults to ``NODE_VIEW_TTL``
+    :type ttl: float, optional
+    :param stale_after: maximum report age in seconds, defaults to
+                        ``NODE_STALE_AFTER``
+    :type stale_after: float, optional
+    :param clock: wall clock function, defaults to :func:`time.time`
+    :type clock: Callable[[], float], optional
+    """
+
+    def __init__(
+        self,
+        user_manager: UserPoolManager,
+        ttl: float = NODE_VIEW_TTL,
+        stale_after: float = NODE_STALE_AFTER,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.user_mgr = user_manager
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.clock = clock
+        self._nodes: List[NodeInfo] = []
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def healthy(self) -> List[NodeInfo]:
+        """Get active nodes with fresh load reports.
+
+        :rtype: List[NodeInfo]
+        """
+        now = self.clock()
+        with self._lock:
+            if now >= self._expires:
+                self._nodes = self.user_mgr.list_nodes(now - self.stale_after)
+                self._expires = now + self.ttl
+            nodes = self._nodes
+        return [
+            node
+            for node in nodes
+            if node.state == NODE_STATE_ACTIVE and now - node.updated < self.stale_after
+        ]
+
+    def choose(self, rand: Optional[random.Random] = None) -> Optional[NodeInfo]:
+        """Pick node for new client.
+
+        Node is chosen at random with weight that falls quickly with load, so
+        least loaded nodes get most clients but clients that read the same
+        view do not all land on one node. Saturated nodes are skipped unless
+        all nodes are saturated.
+
+        :param rand: random generator, defaults to None (shared generator)
+        :type rand: Optional[random.Random], optional
+        :return: chosen node or None if there are no healthy nodes
+        :rtype: Optional[NodeInfo]
+        """
+        nodes = self.healthy()
+        available = [node for node in nodes if node.load < 1] or nodes
+        if not available:
+            return None
+        weights = [(1 - min(node.load, 0.99)) ** 2 for node in available]
+        return (rand or random).choices(available, weights)[0]
+
 
 class ServerMetadataResource:
+    def __init__(self, node_view: NodeView):
+        self.node_view = node_view
+
     def on_get(self, req: Request, resp: Response) -> None:
-        resp.cache_control = ["public", "max-age=604800"]
-        resp.media = {
-            "chat": {
-                "host": os.getenv("CHITTY_CHAT_HOST", "127.0.0.1"),
-                "port": int(os.getenv("CHITTY_CHAT_PORT", "5000")),
-            }
-        }
+        node = self.node_view.choose()
+        if node is None:
+            host = os.getenv("CHITTY_CHAT_HOST", "127.0.0.1")
+            port = int(os.getenv("CHITTY_CHAT_PORT", "5000"))
+        else:
+            host, port = node.host, node.port
+        resp.cache_control = ["private", f"max-age={META_MAX_AGE}"]
+        resp.media = {"chat": {"host": host, "port": port}}
@@ -0,0 +1,33 @@
+import falcon
+from falcon import Request, Response
+
+from ..search import MAX_LIMIT, SearchIndex
+from ..utils import error_response
+from .auth import authorize_user
+
+
+class MessageSearchResource:
+    def __init__(self, index: SearchIndex):
+        self.index = index
+
+    @falcon.before(authorize_user)
+    def on_get(self, req: Request, resp: Response) -> None:
+        text = req.get_param("q", default="").strip()
+        if not text:
+            code = falcon.HTTP_400[:3]
+            resp.media = error_response(reason=code, message="search text is required")
+            resp.status = falcon.HTTP_400
+            return
+        limit = req.get_param_as_int("limit", default=50, min_value=1)
+        hits = self.index.search(
+            text,
+            topic=req.get_param("topic"),
+            sender=req.get_param("from"),
+            since=req.get_param_as_float("since"),
+            until=req.get_param_as_float("until"),
+            limit=min(limit, MAX_LIMIT),
+        )
+        resp.media = {
+            "results": [hit.to_map() for hit in hits],
+            "until": hits[-1].date if hits else None,
+        }
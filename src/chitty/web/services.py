@@ -1,15 +1,41 @@
+from __future__ import annotations
+
+import math
+import os
 import time
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import List, Mapping, Optional, Union
-
-import redis
+from itertools import islice
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from .. import keys
-from ..services.auth import password_context, serializer
+from ..services.auth import get_password_context, get_serializer
+from ..storage import MemoryBackend, RedisBackend, SyncStorage
 from ..topic import DEFAULT_TOPICS
 from . import errors
 
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+ORDER_POPULAR = "popular"
+ORDER_ACTIVE = "active"
+ORDER_NAME = "name"
+
+TOPIC_ORDERS = [ORDER_POPULAR, ORDER_ACTIVE, ORDER_NAME]
+
+# highest code point, sorts after any UTF-8 continuation of prefix
+LEX_MAX = "\U0010ffff"
+
 
 @dataclass
 class UserData:
@@ -27,58 +53,283 @@ class UserData:
         }
 
 
+@dataclass
+class BulkImportResult:
+    processed: int = 0
+    created: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    def to_map(self) -> Mapping[str, Union[int, List[Mapping[str, Union[int, str]]]]]:
+        return {
+            "processed": self.processed,
+            "created": self.created,
+            "errors": [{"row": row, "error": error} for row, error in self.errors],
+        }
+
+
+@dataclass
+class TopicInfo:
+    name: str
+    subscribers: int = 0
+    last_activity: Optional[float] = None
+
+    def to_map(self) -> Mapping[str, Union[str, int, Optional[float]]]:
+        return {
+            "name": self.name,
+            "subscribers": self.subscribers,
+            "lastActivity": self.last_activity,
+        }
+
+
+@dataclass
+class NodeInfo:
+    """Chat server node load report.
+
+    Load is the highest of connection slot usage, CPU usage and scheduler
+    queue length relative to ``QUEUE_LIMIT``, 1.0 means node is saturated.
+    """
+
+    QUEUE_LIMIT = 100
+
+    name: str
+    host: str
+    port: int
+    state: str = ""
+    connections: int = 0
+    capacity: int = 0
+    cpu: float = 0.0
+    queue: int = 0
+    updated: float = 0.0
+
+    @classmethod
+    def from_report(cls, name: str, data: Mapping[str, str]) -> NodeInfo:
+        return cls(
+            name=name,
+            host=data.get("host", ""),
+            port=int(data.get("port") or 0),
+            state=data.get("state", ""),
+            connections=int(data.get("connections") or 0),
+            capacity=int(data.get("capacity") or 0),
+            cpu=float(data.get("cpu") or 0),
+            queue=int(data.get("queue") or 0),
+            updated=float(data.get("updated") or 0),
+        )
+
+    @property
+    def load(self) -> float:
+        slots = self.connections / self.capacity if self.capacity else 0.0
+        return max(slots, self.cpu, self.queue / self.QUEUE_LIMIT)
+
+
+def hash_password(password: str) -> str:
+    """Hash password with default password context.
+
+    This is module level function so it can be sent to worker processes.
+
+    :param password: plain text password
+    :type password: str
+    :return: password hash
+    :rtype: str
+    """
+    return get_password_context().hash(password)
+
+
 class Storage:
+    """Web application storage.
+
+    Thin layer over :class:`~chitty.storage.SyncStorage` that returns data
+    structures used by web resources.
+
+    :param host: Redis host, defaults to None (localhost)
+    :type host: Optional[str], optional
+    :param port: Redis port, defaults to None (6379)
+    :type port: Optional[int], optional
+    :param database: Redis database number, defaults to None (0)
+    :type database: Optional[int], optional
+    :param backend: storage backend, if provided Redis connection parameters
+                    are ignored, defaults to None
+    :type backend: Optional[Union[RedisBackend, MemoryBackend]], optional
+    """
+
     def __init__(
         self,
         host: Optional[str] = None,
         port: Optional[int] = None,
         database: Optional[int] = None,
+        backend: Optional[Union[RedisBackend, MemoryBackend]] = None,
     ):
-        host = host or "127.0.0.1"
-        port = port or 6379
-        if database is None:
-            database = 0
-        self.redis = redis.Redis(
-            host=host, port=port, db=database, decode_responses=True
-        )
+        if backend is None:
+            import redis
+
+            host = host or "127.0.0.1"
+            port = port or 6379
+            if database is None:
+                database = 0
+            backend = RedisBackend(
+                redis.Redis(host=host, port=port, db=database, decode_responses=True)
+            )
+        self.store = SyncStorage(backend)
 
     def user_exists(self, name: str) -> bool:
-        key = f"{keys.USERS}:{name}"
-        return self.redis.exists(key) != 0
+        return self.store.user_exists(name)
 
     def add_user(self, name: str, password: str) -> UserData:
         created = time.time()
-        pipe = self.redis.pipeline()
-        data = {
-            "name": name,
-            "password": password,
-            "created": created,
-        }
-        pipe.hset(f"{keys.USERS}:{name}", mapping=data)  # type: ignore
+        self.store.add_user(name, password, created)
         topics = [name]
         topics.extend(DEFAULT_TOPICS)
-        pipe.sadd(f"{keys.TOPICS}:{name}", *topics)
-        pipe.execute()
         return UserData(name=name, created=created, topics=topics)
 
+    def users_exist(self, names: Sequence[str]) -> List[bool]:
+        return self.store.users_exist(names)
+
+    def add_users(self, users: Iterable[Tuple[str, str, str]]) -> List[UserData]:
+        """Write multiple users along with their topics and auth tokens in
+        single pipelined round trip.
+
+        :param users: tuples of (name, password hash, token)
+        :type users: Iterable[Tuple[str, str, str]]
+        :return: list of created user data
+        :rtype: List[UserData]
+        """
+        created = time.time()
+        users = list(users)
+        self.store.add_users(
+            (name, password, created, token) for name, password, token in users
+        )
+        return [
+            UserData(
+                name=name, created=created, topics=[name, *DEFAULT_TOPICS], token=token
+            )
+            for name, _, token in users
+        ]
+
     def get_user(self, name) -> UserData:
+        data = self.store.get_user(name) or {}
         created = float(
-            self.redis.hget(f"{keys.USERS}:{name}", "created")
-            or datetime.now(tz=timezone.utc).timestamp()
+            data.get("created") or datetime.now(tz=timezone.utc).timestamp()
         )
-        topics = self.redis.smembers(f"{keys.TOPICS}:{name}")
+        topics = self.store.get_user_topics(name)
         return UserData(name=name, created=created, topics=list(topics))
 
     def get_user_topics(self, name) -> List[str]:
-        return list(self.redis.smembers(f"{keys.TOPICS}:{name}"))
+        return list(self.store.get_user_topics(name))
+
+    def list_topics(
+        self,
+        order: str = ORDER_POPULAR,
+        prefix: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[TopicInfo], Optional[str]]:
+        """Read single page from topic directory.
+
+        Topics can be ordered by subscriber count, last activity (both
+        descending) or by name. Prefix search always uses name ordering. Cost
+        of reading a page depends on page size, not on number of topics.
+        Ranking cursor holds score and name of the last topic on page, so
+        pages do not skip or repeat topics when ranking changes in between.
+
+        :param order: page ordering, defaults to ``popular``
+        :type order: str, optional
+        :param prefix: topic name prefix, defaults to None
+        :type prefix: Optional[str], optional
+        :param cursor: cursor returned with previous page, defaults to None
+        :type cursor: Optional[str], optional
+        :param limit: page size, defaults to 50
+        :type limit: int, optional
+        :return: page of topics and cursor for next page (None if this is
+                 the last page)
+        :rtype: Tuple[List[TopicInfo], Optional[str]]
+        :raises ValueError: if cursor is malformed
+        """
+        if prefix or order == ORDER_NAME:
+            if cursor:
+                start = f"({cursor}"
+            elif prefix:
+                start = f"[{prefix}"
+            else:
+                start = "-"
+            end = f"[{prefix}{LEX_MAX}" if prefix else "+"
+            names = self.store.topic_names(start, end, limit + 1)
+            next_cursor = names[limit - 1] if len(names) > limit else None
+        else:
+            key = (
+                keys.DIRECTORY_ACTIVITY
+                if order == ORDER_ACTIVE
+                else keys.DIRECTORY_SUBSCRIBERS
+            )
+            after = None
+            if cursor:
+                score, _, name = cursor.partition(":")
+                if not math.isfinite(float(score)):
+                    raise ValueError(f"invalid cursor score {score}")
+                after = (score, name)
+            ranking = self.store.topic_ranking(key, limit + 1, after)
+            names = [name for name, _ in ranking]
+            next_cursor = None
+            if len(ranking) > limit:
+                name, score = ranking[limit - 1]
+                next_cursor = f"{score}:{name}"
+        names = names[:limit]
+        topics = [
+            TopicInfo(name=name, subscribers=subscribers, last_activity=activity)
+            for name, (subscribers, activity) in zip(
+                names, self.store.topic_stats(names)
+            )
+        ]
+        return topics, next_cursor
+
+    def rebuild_topic_directory(self, batch_size: int = 1000) -> int:
+        """Rebuild topic directory from topic and subscription sets.
+
+        This scans existing data incrementally and is only needed once for
+        data created before topic directory was introduced.
+
+        :param batch_size: scan batch size, defaults to 1000
+        :type batch_size: int, optional
+        :return: number of topics in directory
+        :rtype: int
+        """
+        counts = {}
+        for key in self.store.scan_iter(f"{keys.TOPICS}:*", count=batch_size):
+            name = key.split(":", 1)[1]
+            for topic in self.store.sscan_iter(key, count=batch_size):
+                if topic != name:
+                    counts[topic] = counts.get(topic, 0) + 1
+        topics = set(self.store.sscan_iter(keys.TOPICS, count=batch_size))
+        topics.update(DEFAULT_TOPICS)
+        batch = {}
+        reset = True
+        for topic in topics:
+            batch[topic] = counts.get(topic, 0)
+            if len(batch) == batch_size:
+                self.store.set_topic_subscribers(batch, reset=reset)
+                batch, reset = {}, False
+        self.store.set_topic_subscribers(batch, reset=reset)
+        return len(topics)
 
     def set_auth_token(self, name: str, token: str) -> None:
-        key = f"{keys.LOGINS}:{name}"
-        self.redis.hset(key, mapping={"token": token, "date": time.time()})
+        self.store.set_auth_token(name, token)
 
     def get_password(self, name: str) -> Optional[str]:
-        key = f"{keys.USERS}:{name}"
-        return self.redis.hget(key, "password")
+        return self.store.get_password(name)
+
+    def set_filter_terms(self, terms: Iterable[str]) -> int:
+        return self.store.set_filter_terms(terms)
+
+    def list_nodes(self, since: float) -> List[NodeInfo]:
+        """Read load reports of chat server nodes.
+
+        :param since: skip nodes that did not report since this time
+        :type since: float
+        :rtype: List[NodeInfo]
+        """
+        names = self.store.node_ids(since)
+        if not names:
+            return []
+        reports = self.store.node_reports(names)
+        return [NodeInfo.from_report(name, data) for name, data in reports.items()]
 
 
 class UserPoolManager:
@@ -110,9 +361,9 @@ class UserPoolManager:
         """
         if self.db.user_exists(name):
             raise errors.UserExists("user already exists")
-        secret = password_context.hash(password)
+        secret = get_password_context().hash(password)
         user_data = self.db.add_user(name, secret)
-        token = str(serializer.dumps(name))
+        token = str(get_serializer().dumps(name))
         self.db.set_auth_token(name, token)
         user_data.token = token
         return user_data
@@ -134,10 +385,134 @@ class UserPoolManager:
         secret = self.db.get_password(name)
         if not secret:
             raise errors.UserNotFound("user does not exist")
-        if not password_context.verify(password, secret):
+        if not get_password_context().verify(password, secret):
             raise errors.UserNotFound("invalid password")
         user_data = self.db.get_user(name)
-        token = str(serializer.dumps(name))
+        token = str(get_serializer().dumps(name))
         self.db.set_auth_token(name, token)
         user_data.token = token
         return user_data
+
+    def import_users(
+        self,
+        records: Iterable[Tuple[int, Mapping[str, str]]],
+        batch_size: int = 1000,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[BulkImportResult], None]] = None,
+        executor: Optional[ProcessPoolExecutor] = None,
+    ) -> BulkImportResult:
+        """Create user accounts in bulk.
+
+        Records are processed in batches. For each batch existing names are
+        checked in single pipeline, passwords are hashed in process pool and
+        users, their topics and auth tokens are written in single pipeline.
+        Invalid rows do not stop the import, they are reported in result
+        along with row number.
+
+        :param records: numbered user records with ``name`` and ``password``
+        :type records: Iterable[Tuple[int, Mapping[str, str]]]
+        :param batch_size: number of records per batch, defaults to 1000
+        :type batch_size: int, optional
+        :param workers: number of hashing processes, defaults to None (CPU
+                        count)
+        :type workers: Optional[int], optional
+        :param progress: callable receiving running result after each batch,
+                         defaults to None
+        :type progress: Optional[Callable[[BulkImportResult], None]], optional
+        :param executor: process pool to hash passwords in, it is not shut
+                         down after import, defaults to None (pool of
+                         ``workers`` processes is started for this import)
+        :type executor: Optional[ProcessPoolExecutor], optional
+        :return: import result
+        :rtype: BulkImportResult
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return self.import_users(
+                    records, batch_size, workers, progress, executor
+                )
+        result = BulkImportResult()
+        records = iter(records)
+        chunksize = max(1, batch_size // (workers * 4))
+        for batch in iter(lambda: list(islice(records, batch_size)), []):
+            self._import_batch(batch, executor, chunksize, result)
+            if progress is not None:
+                progress(result)
+        return result
+
+    def _import_batch(
+        self,
+        batch: List[Tuple[int, Mapping[str, str]]],
+        executor: ProcessPoolExecutor,
+        chunksize: int,
+        result: BulkImportResult,
+    ) -> None:
+        result.processed += len(batch)
+        valid = []
+        seen = set()
+        for row, record in batch:
+            name, password = record.get("name"), record.get("password")
+            if not name or not password:
+                result.errors.append((row, "name and password are required"))
+            elif not isinstance(name, str) or not isinstance(password, str):
+                result.errors.append((row, "name and password must be strings"))
+            elif name in seen:
+                result.errors.append((row, "duplicate user name"))
+            else:
+                seen.add(name)
+                valid.append((row, name, password))
+        if not valid:
+            return
+        exist = self.db.users_exist([name for _, name, _ in valid])
+        to_create = []
+        for (row, name, password), exists in zip(valid, exist):
+            if exists:
+                result.errors.append((row, "user already exists"))
+            else:
+                to_create.append((name, password))
+        if not to_create:
+            return
+        secrets = executor.map(
+            hash_password, [password for _, password in to_create], chunksize=chunksize
+        )
+        users = [
+            (name, secret, str(get_serializer().dumps(name)))
+            for (name, _), secret in zip(to_create, secrets)
+        ]
+        result.created += len(self.db.add_users(users))
+
+    def list_topics(
+        self,
+        order: str = ORDER_POPULAR,
+        prefix: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[TopicInfo], Optional[str]]:
+        """Browse topic directory page by page.
+
+        :param order: page ordering, defaults to ``popular``
+        :type order: str, optional
+        :param prefix: topic name prefix, defaults to None
+        :type prefix: Optional[str], optional
+        :param cursor: cursor returned with previous page, defaults to None
+        :type cursor: Optional[str], optional
+        :param limit: page size, defaults to 50
+        :type limit: int, optional
+        :return: page of topics and next page cursor
+        :rtype: Tuple[List[TopicInfo], Optional[str]]
+        """
+        return self.db.list_topics(
+            order=order, prefix=prefix, cursor=cursor, limit=limit
+        )
+
+    def list_nodes(self, since: float) -> List[NodeInfo]:
+        """List chat server nodes that reported load since specified time.
+
+        :param since: report time limit
+        :type since: float
+        :rtype: List[NodeInfo]
+        """
+        return self.db.list_nodes(since)
@@ -0,0 +1,40 @@
+import falcon
+from falcon import Request, Response
+
+from ..utils import error_response
+from .services import ORDER_POPULAR, TOPIC_ORDERS, UserPoolManager
+
+MAX_PAGE_SIZE = 200
+
+
+class TopicDirectoryResource:
+    def __init__(self, user_manager: UserPoolManager):
+        self.user_mgr = user_manager
+
+    def on_get(self, req: Request, resp: Response) -> None:
+        order = req.get_param("order", default=ORDER_POPULAR)
+        limit = req.get_param_as_int("limit", default=50, min_value=1)
+        if order not in TOPIC_ORDERS:
+            code = falcon.HTTP_400[:3]
+            resp.media = error_response(
+                reason=code, message=f"order must be one of {', '.join(TOPIC_ORDERS)}"
+            )
+            resp.status = falcon.HTTP_400
+            return
+        try:
+            topics, cursor = self.user_mgr.list_topics(
+                order=order,
+                prefix=req.get_param("prefix"),
+                cursor=req.get_param("cursor"),
+                limit=min(limit, MAX_PAGE_SIZE),
+            )
+        except ValueError:
+            code = falcon.HTTP_400[:3]
+            resp.media = error_response(reason=code, message="invalid cursor")
+            resp.status = falcon.HTTP_400
+            return
+        resp.cache_control = ["public", "max-age=10"]
+        resp.media = {
+            "topics": [topic.to_map() for topic in topics],
+            "cursor": cursor,
+        }
@@ -0,0 +1,76 @@
+"""Pre-encoded WebSocket frames.
+
+Frames sent by server are never masked, so frame bytes for given message
+are the same for every connection that does not use protocol extensions.
+Such frames can be built once and written directly to each connection
+stream, skipping per-connection framing in wsproto.
+
+This relies on internals of ``trio_websocket.WebSocketConnection`` (its
+stream, stream lock and wsproto connection state). Connections that can not
+take raw frames should be sent messages with regular ``send_message``.
+"""
+
+from typing import Union
+
+import trio
+from trio_websocket import ConnectionClosed, WebSocketConnection
+from wsproto.connection import ConnectionState
+from wsproto.frame_protocol import FrameProtocol
+
+
+def encode_frame(data: Union[str, bytes]) -> bytes:
+    """Build complete unmasked server-to-client data frame.
+
+    Text frame is built for str data, binary frame for bytes.
+
+    :param data: message content
+    :type data: Union[str, bytes]
+    :return: frame bytes
+    :rtype: bytes
+    """
+    return bytes(FrameProtocol(client=False, extensions=[]).send_data(data, fin=True))
+
+
+def accepts_raw_frames(ws: WebSocketConnection) -> bool:
+    """Check if pre-encoded frame can be written to connection.
+
+    This requires connection to be open, to have no protocol extensions
+    negotiated and no fragmented outbound message in progress.
+
+    :param ws: WebSocket connection
+    :type ws: WebSocketConnection
+    :return: True if raw frames can be written
+    :rtype: bool
+    """
+    connection = getattr(ws._wsproto, "connection", None)
+    if connection is None or ws._close_reason is not None:
+        return False
+    proto = connection._proto
+    return (
+        connection.state == ConnectionState.OPEN
+        and not proto.extensions
+        and proto._outbound_opcode is None
+    )
+
+
+async def send_frame(ws: WebSocketConnection, frame: bytes) -> None:
+    """Write pre-encoded frame to connection stream.
+
+    Writes are serialised with connection's own send lock, the same way
+    ``WebSocketConnection`` does it, so frames never interleave with other
+    outgoing data.
+
+    :param ws: WebSocket connection
+    :type ws: WebSocketConnection
+    :param frame: complete frame bytes
+    :type frame: bytes
+    :raises ConnectionClosed: if connection is closed or breaks while sending
+    """
+    if ws._close_reason:
+        raise ConnectionClosed(ws._close_reason)
+    async with ws._stream_lock:
+        try:
+            await ws._stream.send_all(frame)
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            await ws._abort_web_socket()
+            raise ConnectionClosed(ws._close_reason) from None
@@ -0,0 +1,27 @@
+import pytest
+
+from chitty.storage import AsyncStorage, MemoryBackend, SyncStorage
+
+
+@pytest.fixture
+def storage_modules():
+    """Modules whose storage is replaced by ``backend``, override in test
+    module to change."""
+    return ('message', 'handlers', 'user', 'event')
+
+
+@pytest.fixture
+def accounts():
+    """Names of user accounts created in ``backend``."""
+    return ()
+
+
+@pytest.fixture
+def backend(mocker, storage_modules, accounts):
+    backend = MemoryBackend()
+    storage = AsyncStorage(backend)
+    for module in storage_modules:
+        mocker.patch(f'chitty.{module}.storage', storage)
+    if accounts:
+        SyncStorage(backend).add_users((name, 'hash', 0, None) for name in accounts)
+    return backend
@@ -0,0 +1,128 @@
+import json
+import os
+import zlib
+
+import pytest
+
+from chitty import archive
+
+
+def record(i, date=None, **extra):
+    data = {'message': f'message {i}', 'date': float(i if date is None else date)}
+    data.update(extra)
+    return json.dumps(data)
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path)
+
+
+def write_messages(writer, topic, start, stop, now=0.0):
+    writer.write(
+        {topic: [(float(i), record(i)) for i in range(start, stop)]}, now=now
+    )
+
+
+def test_block_roundtrip():
+    records = [(1.0, 'a'), (3.0, 'żółw'), (2.0, '')]
+    block = archive.encode_block(records)
+    header = archive.BLOCK_HEADER.unpack_from(block)
+    assert header[:4] == (archive.BLOCK_MAGIC, 1.0, 3.0, 3)
+    data = zlib.decompress(block[archive.BLOCK_HEADER.size:])
+    assert list(archive.decode_block(data)) == records
+
+
+def test_read_time_range(root):
+    writer = archive.ArchiveWriter(root)
+    for start in range(0, 100, 10):
+        write_messages(writer, 'sys:events', start, start + 10)
+    reader = archive.ArchiveReader(root)
+    assert reader.topics() == ['sys:events']
+    assert os.listdir(root) == ['sys%3Aevents']
+    assert [ts for ts, _ in reader.read('sys:events', since=25, until=42)] == [
+        float(i) for i in range(25, 42)
+    ]
+    assert len(list(reader.read('sys:events'))) == 100
+    assert list(reader.read('missing')) == []
+
+
+def test_rotation_by_size_and_age(root):
+    writer = archive.ArchiveWriter(root, segment_size=1, segment_age=60)
+    write_messages(writer, 'general', 0, 5, now=0.0)
+    write_messages(writer, 'general', 5, 10, now=0.0)
+    reader = archive.ArchiveReader(root)
+    assert len(reader.segments('general')) == 2
+    writer.segment_size = 10**9
+    write_messages(writer, 'general', 10, 15, now=1.0)
+    write_messages(writer, 'general', 15, 20, now=30.0)
+    assert len(reader.segments('general')) == 2
+    write_messages(writer, 'general', 20, 25, now=61.0)
+    assert len(reader.segments('general')) == 3
+    assert [ts for ts, _ in reader.read('general')] == [float(i) for i in range(25)]
+
+
+def test_blocks_past_index_are_scanned(root):
+    writer = archive.ArchiveWriter(root)
+    write_messages(writer, 'general', 0, 10)
+    write_messages(writer, 'general', 10, 20)
+    segment = writer.segments['general']
+    with open(segment.index_path, 'rb+') as fp:
+        fp.truncate(archive.INDEX_ENTRY.size)
+    with open(segment.path, 'ab') as fp:
+        fp.write(archive.encode_block([(20.0, record(20))])[:10])
+    reader = archive.ArchiveReader(root)
+    assert [ts for ts, _ in reader.read('general', since=5)] == [
+        float(i) for i in range(5, 20)
+    ]
+
+
+async def test_archiver_flush_skips_ephemeral(root):
+    archiver = archive.Archiver(archive.ArchiveWriter(root))
+    archiver.feed('general', record(1))
+    archiver.feed('general', record(2, ephemeral=True))
+    archiver.feed('alice', 'not json')
+    archiver.feed('general', json.dumps({'message': 'no date'}))
+    assert await archiver.flush() == 3
+    assert archiver.pending == []
+    reader = archive.ArchiveReader(root)
+    assert [data for _, data in reader.read('alice')] == ['not json']
+    assert [ts for ts, _ in reader.read('general', until=100)] == [1.0]
+    assert len(list(reader.read('general'))) == 2
+
+
+def test_dot_topics_stay_in_root(root):
+    writer = archive.ArchiveWriter(root)
+    for topic in ('.', '..', '.hidden', '%2E'):
+        write_messages(writer, topic, 0, 2)
+    assert sorted(os.listdir(root)) == ['%252E', '%2E', '%2E.', '%2Ehidden']
+    reader = archive.ArchiveReader(root)
+    assert reader.topics() == ['%2E', '.', '..', '.hidden']
+    assert len(list(reader.read('..'))) == 2
+    with pytest.raises(ValueError):
+        archive.topic_dir(root, '')
+    with pytest.raises(ValueError):
+        archive.topic_dir(root, 'x' * 256)
+
+
+async def test_archiver_flush_error_keeps_unwritten_topics(root, mocker):
+    archiver = archive.Archiver(archive.ArchiveWriter(root))
+    write = archiver.writer.write
+
+    def fail_general(batch, now=None):
+        if 'general' in batch:
+            raise OSError('disk full')
+        return write(batch, now)
+
+    mocker.patch.object(archiver.writer, 'write', side_effect=fail_general)
+    archiver.feed('alice', record(1))
+    archiver.feed('general', record(2))
+    archiver.feed('', record(3))
+    with pytest.raises(OSError):
+        await archiver.flush()
+    assert [topic for topic, _, _ in archiver.pending] == ['general']
+    assert archiver.archived == 1
+    archiver.writer.write.side_effect = write
+    assert await archiver.flush() == 1
+    reader = archive.ArchiveReader(root)
+    assert reader.topics() == ['alice', 'general']
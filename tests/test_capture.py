@@ -0,0 +1,212 @@
+import contextlib
+import json
+
+import pytest
+import trio
+
+from chitty import codec, replay
+from chitty.capture import TrafficCapture, read_capture
+
+pytestmark = pytest.mark.usefixtures('backend')
+
+
+@pytest.fixture
+def storage_modules():
+    return ('capture',)
+
+
+@pytest.fixture
+def accounts():
+    return ('alice', 'bob', 'carol')
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setenv('CHITTY_SECRET_KEY', 'secret')
+
+
+class FakeWebSocket:
+    def __init__(self, fail_types=(), delays=()):
+        self.fail_types = fail_types
+        self.delays = list(delays)
+        self.sent = []
+        self._send, self._receive = trio.open_memory_channel(100)
+
+    async def send_message(self, data):
+        self.sent.append((trio.current_time(), data))
+        payload = codec.decode(data)
+        if payload.get('type') in self.fail_types:
+            resp = {'status': 'error', 'error': {'reason': 'x', 'message': ''}}
+        else:
+            resp = {'type': 'ack'}
+        resp['requestId'] = payload['requestId']
+        delay = self.delays.pop(0) if self.delays else 0
+        trio.lowlevel.spawn_system_task(self._respond, delay, resp)
+
+    async def _respond(self, delay, resp):
+        await trio.sleep(delay)
+        await self._send.send(codec.encode(resp, codec.FORMAT_JSON))
+
+    async def get_message(self):
+        return await self._receive.receive()
+
+
+async def write_capture(path):
+    capture = TrafficCapture(str(path))
+    ws1, ws2 = object(), object()
+    capture.opened(ws1, 'alice', 'json')
+    capture.message(ws1, {'type': 'msg', 'to': 'general', 'value': 'hello'})
+    capture.result(ws1, 0, False)
+    capture.opened(ws2, 'bob', 'json')
+    capture.message(ws2, {'type': 'dm', 'to': 'alice', 'value': 'hi'})
+    capture.malformed(ws2, 3)
+    capture.closed(ws2)
+    capture.closed(ws1)
+    await capture.flush()
+    return capture
+
+
+async def test_capture_scrubs_personal_data(tmp_path):
+    path = tmp_path / 'capture.gz'
+    capture = await write_capture(path)
+    header, records = read_capture(str(path))
+    assert header['version'] == 1
+    records = list(records)
+    assert [record[0] for record in records] == ['o', 'm', 'r', 'o', 'm', 'b', 'c', 'c']
+    alice = capture.pseudonym('alice')
+    assert records[0][3] == alice
+    assert records[1][3] == {'type': 'msg', 'to': 'general', 'value': 'xxxxx'}
+    assert records[4][3] == {'type': 'dm', 'to': alice, 'value': 'xx'}
+    assert 'alice' not in json.dumps(records) and 'bob' not in json.dumps(records)
+
+
+async def test_capture_scrubs_private_topics(tmp_path):
+    capture = TrafficCapture(str(tmp_path / 'capture.gz'))
+    ws = object()
+    capture.opened(ws, 'dave', 'json')
+    for msg in [
+        {'type': 'sub', 'value': 'dave'},
+        {'type': 'read', 'to': 'carol', 'value': 3},
+        {'type': 'typing', 'to': 'general'},
+        {'type': 'unsub', 'value': 'sys:x'},
+    ]:
+        capture.message(ws, msg)
+    await capture.flush()
+    _, records = read_capture(capture.path)
+    payloads = [record[3] for record in records if record[0] == 'm']
+    assert payloads[0]['value'] == capture.pseudonym('dave')
+    assert payloads[1]['to'] == capture.pseudonym('carol')
+    assert payloads[2]['to'] == 'general'
+    assert payloads[3]['value'] == 'sys:x'
+
+
+async def test_capture_hides_topics_when_lookup_fails(tmp_path, mocker):
+    mocker.patch(
+        'chitty.capture.storage.users_exist', side_effect=ConnectionError
+    )
+    capture = TrafficCapture(str(tmp_path / 'capture.gz'))
+    ws = object()
+    capture.opened(ws, 'dave', 'json')
+    capture.message(ws, {'type': 'typing', 'to': 'general'})
+    await capture.flush()
+    _, records = read_capture(capture.path)
+    assert list(records)[1][3]['to'] == capture.pseudonym('general')
+
+
+async def test_capture_disabled_records_nothing():
+    capture = TrafficCapture(None)
+    ws = object()
+    capture.opened(ws, 'alice', 'json')
+    capture.message(ws, {'type': 'msg'})
+    capture.closed(ws)
+    assert not capture.enabled
+    assert await capture.flush() == 0
+
+
+async def test_load_capture(tmp_path):
+    path = tmp_path / 'capture.gz'
+    capture = await write_capture(path)
+    loaded = replay.load_capture(str(path))
+    assert len(loaded.records) == 7
+    assert len(loaded.latencies) == 1 and loaded.errors == 0
+    assert loaded.users == {capture.pseudonym('alice'), capture.pseudonym('bob')}
+
+
+def test_percentile_and_report():
+    assert replay.percentile([], 50) is None
+    values = list(range(1, 101))
+    assert replay.percentile(values, 50) == 50
+    assert replay.percentile(values, 99) == 99
+    capture = replay.Capture(latencies=[1.0, 2.0], errors=1)
+    stats = replay.ReplayStats(latencies=[3.0], errors=1, timeouts=1)
+    report = replay.format_report(capture, stats, '10')
+    assert 'replay speed 10' in report
+    assert '50.00%' in report and '100.00%' in report
+
+
+def make_capture():
+    return replay.Capture(
+        records=[
+            ['o', 0.0, 0, 'u1', 'json'],
+            ['m', 10.0, 0, {'type': 'msg', 'to': 'general', 'value': 'x'}],
+            ['o', 15.0, 1, 'u2', 'json'],
+            ['m', 20.0, 1, {'type': 'sub', 'value': 'sys:x'}],
+            ['c', 30.0, 1],
+            ['c', 40.0, 0],
+        ],
+        latencies=[1.0, 2.0],
+        errors=0,
+    )
+
+
+@pytest.mark.parametrize('speed, last_send', [('1', 20.0), ('10', 2.0), ('max', 0.0)])
+async def test_replay_speed(mocker, secret, autojump_clock, speed, last_send):
+    sockets = []
+
+    @contextlib.asynccontextmanager
+    async def fake_open(url, subprotocols):
+        assert subprotocols == ['chitty.json']
+        ws = FakeWebSocket(fail_types=('sub',))
+        sockets.append(ws)
+        yield ws
+
+    mocker.patch('chitty.replay.open_websocket_url', fake_open)
+    started = trio.current_time()
+    stats = await replay.main(make_capture(), 'ws://test', speed)
+    assert len(sockets) == 2
+    sent = [t - started for ws in sockets for t, _ in ws.sent]
+    assert max(sent) == pytest.approx(last_send)
+    assert len(stats.latencies) == 2
+    assert stats.errors == 1
+    assert stats.timeouts == 0 and stats.connect_errors == 0
+
+
+async def test_replay_counts_connect_errors(mocker, secret, autojump_clock):
+    @contextlib.asynccontextmanager
+    async def fake_open(url, subprotocols):
+        raise OSError('refused')
+        yield
+
+    mocker.patch('chitty.replay.open_websocket_url', fake_open)
+    stats = await replay.main(make_capture(), 'ws://test', 'max')
+    assert stats.connect_errors == 2
+    assert stats.latencies == []
+
+
+async def test_replay_waits_for_late_responses(mocker, secret, autojump_clock):
+    @contextlib.asynccontextmanager
+    async def fake_open(url, subprotocols):
+        yield FakeWebSocket(delays=[0, 5])
+
+    mocker.patch('chitty.replay.open_websocket_url', fake_open)
+    capture = replay.Capture(
+        records=[
+            ['o', 0.0, 0, 'u1', 'json'],
+            ['m', 1.0, 0, {'type': 'msg', 'to': 'general', 'value': 'x'}],
+            ['m', 2.0, 0, {'type': 'msg', 'to': 'general', 'value': 'y'}],
+            ['c', 3.0, 0],
+        ]
+    )
+    stats = await replay.main(capture, 'ws://test', '1')
+    assert stats.timeouts == 0
+    assert sorted(stats.latencies) == [0, 5000]
@@ -3,10 +3,36 @@ from chitty.cli import run
 
 def test_default_runs_without_instrument(mocker):
     fake_run = mocker.Mock()
-    mocker.patch('chitty.cli.trio.run', fake_run)
+    mocker.patch('trio.run', fake_run)
     mocker.patch(
-        'chitty.cli.parse_args', mocker.Mock(return_value=mocker.Mock(instrument=False))
+        'chitty.cli.parse_args',
+        mocker.Mock(
+            return_value=mocker.Mock(instrument=False, certfile=None, capture=None)
+        ),
     )
     run()
     fake_run.assert_called_once()
     assert 'instruments' not in fake_run.call_args.kwargs
+
+
+def test_certfile_enables_tls(mocker):
+    fake_run = mocker.Mock()
+    mocker.patch('trio.run', fake_run)
+    make_context = mocker.patch('chitty.tls.make_server_context')
+    mocker.patch(
+        'chitty.cli.parse_args',
+        mocker.Mock(
+            return_value=mocker.Mock(
+                instrument=False,
+                certfile='cert.pem',
+                capture=None,
+                keyfile='key.pem',
+                tls_tickets=None,
+                ticket_key_file=None,
+            )
+        ),
+    )
+    run()
+    make_context.assert_called_once_with('cert.pem', 'key.pem', ticket_key_file=None)
+    entrypoint = fake_run.call_args.args[0]
+    assert entrypoint.keywords['ssl_context'] is make_context.return_value
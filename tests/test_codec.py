@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import msgpack
+import pytest
+
+from chitty import codec
+from chitty.message import Message
+
+
+def test_negotiate_picks_first_supported():
+    assert codec.negotiate(['foo', 'chitty.msgpack', 'chitty.json']) == (
+        'chitty.msgpack', codec.FORMAT_MSGPACK
+    )
+    assert codec.negotiate([]) == (None, codec.FORMAT_JSON)
+
+
+def test_decode_by_frame_type():
+    assert codec.decode('{"a": 1}') == {'a': 1}
+    assert codec.decode(msgpack.packb({'a': 1})) == {'a': 1}
+    with pytest.raises(codec.DecodeError):
+        codec.decode('{')
+    with pytest.raises(codec.DecodeError):
+        codec.decode(b'\xc1')
+
+
+def test_encode_datetime():
+    created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    assert codec.encode({'created': created}) == f'{{"created": {created.timestamp()}}}'
+
+
+def test_message_encodes_once_per_format(mocker):
+    spy = mocker.spy(codec, 'encode')
+    message = Message.from_serialised('general', '{"message": "hi"}')
+    for _ in range(3):
+        assert message.encoded() == '{"message": "hi"}'
+        assert msgpack.unpackb(message.encoded(codec.FORMAT_MSGPACK)) == {
+            'message': 'hi'
+        }
+    assert spy.call_count == 1
@@ -0,0 +1,43 @@
+import signal
+
+import trio
+
+from chitty.debug import TaskProfiler
+
+
+def test_profiler_aggregates_by_task_name():
+    profiler = TaskProfiler(slow_step=10, report_interval=0)
+
+    async def worker():
+        for _ in range(3):
+            await trio.sleep(0)
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(worker, name='worker')
+            nursery.start_soon(worker, name='worker')
+
+    trio.run(main, instruments=[profiler])
+    stats = profiler.stats['worker']
+    assert stats.steps >= 8
+    assert stats.delays > 0
+    assert sum(stats.step_histogram) == stats.steps
+    assert 'worker' in profiler.report()
+
+
+def test_profiler_flags_slow_steps():
+    profiler = TaskProfiler(slow_step=0, report_interval=0)
+
+    async def main():
+        await trio.sleep(0)
+
+    trio.run(main, instruments=[profiler])
+    assert sum(s.slow_steps for s in profiler.stats.values()) > 0
+
+
+def test_profiler_signal_handler_is_opt_in(mocker):
+    install = mocker.patch('signal.signal')
+    profiler = TaskProfiler(report_interval=0)
+    assert install.call_count == 0
+    assert profiler.install_signal_handler() is True
+    install.assert_called_once_with(signal.SIGUSR1, profiler._on_signal)
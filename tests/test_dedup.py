@@ -0,0 +1,54 @@
+import pytest
+
+from chitty import dedup, handlers
+
+
+@pytest.fixture
+def storage_modules():
+    return ('dedup',)
+
+
+async def test_duplicate_caught_locally(backend, mocker):
+    execute = mocker.spy(backend, 'execute')
+    cache = dedup.DedupCache(ttl=60, maxsize=10)
+    assert await cache.is_duplicate('alice', 'm1') is False
+    assert await cache.is_duplicate('alice', 'm1') is True
+    assert await cache.is_duplicate('bob', 'm1') is False
+    assert execute.call_count == 2
+
+
+async def test_duplicate_caught_in_redis(backend):
+    cache = dedup.DedupCache(ttl=60, maxsize=1)
+    other_node = dedup.DedupCache(ttl=60, maxsize=1)
+    assert await cache.is_duplicate('alice', 'm1') is False
+    assert await other_node.is_duplicate('alice', 'm1') is True
+
+
+async def test_idempotent_handler_runs_once(backend, mocker):
+    mocker.patch('chitty.dedup.cache', dedup.DedupCache())
+    inner = mocker.AsyncMock(return_value=None)
+    handler = handlers.idempotent(inner)
+    user = mocker.Mock()
+    user.name = 'alice'
+    for _ in range(3):
+        assert await handler(user, to='general', value='hi', message_id='m1') is None
+    await handler(user, to='general', value='hi')
+    assert inner.await_count == 2
+    rv = await handler(user, to='general', value='hi', message_id='')
+    assert rv['status'] == 'error'
+
+
+async def test_failed_message_can_be_retried(backend, mocker):
+    mocker.patch('chitty.dedup.cache', dedup.DedupCache())
+    error = {'status': 'error', 'error': {'reason': 'x', 'message': ''}}
+    inner = mocker.AsyncMock(side_effect=[error, ConnectionError, None, None])
+    handler = handlers.idempotent(inner)
+    user = mocker.Mock()
+    user.name = 'alice'
+    assert await handler(user, to='bob', value='hi', message_id='m1') == error
+    with pytest.raises(ConnectionError):
+        await handler(user, to='bob', value='hi', message_id='m1')
+    assert 'dedup:alice:m1' not in backend.data
+    assert await handler(user, to='bob', value='hi', message_id='m1') is None
+    assert await handler(user, to='bob', value='hi', message_id='m1') is None
+    assert inner.await_count == 3
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from chitty import controller, dedup, handlers, message
+
+
+@pytest.fixture
+def storage_modules():
+    return ('message', 'handlers', 'dedup')
+
+
+@pytest.fixture
+def accounts():
+    return ('alice', 'bob', 'carol')
+
+
+@pytest.fixture
+def user(mocker):
+    user = mocker.Mock()
+    user.name = 'alice'
+    user.to_map.return_value = {'name': 'alice'}
+    return user
+
+
+def backlog(backend, topic):
+    return [json.loads(item) for item in backend.data.get(f'backlog:{topic}', [])]
+
+
+async def test_single_recipient(backend, user):
+    msg = {'type': 'dm', 'to': 'bob', 'value': 'hi'}
+    assert await controller.route_message(user, msg) is None
+    [payload] = backlog(backend, 'bob')
+    assert payload['topic'] == 'bob'
+    assert payload['message'] == 'hi'
+
+
+async def test_multiple_recipients(backend, user, mocker):
+    encode = mocker.spy(message.codec, 'encode')
+    execute = mocker.spy(backend, 'execute')
+    to = ['bob', 'zed', 'carol', 'bob', 'yan']
+    rv = await controller.route_message(user, {'type': 'dm', 'to': to, 'value': 'hi'})
+    assert rv['status'] == 'error'
+    assert rv['error']['reason'] == 'E_REASON_NOTREG'
+    assert rv['recipients'] == ['zed', 'yan']
+    assert rv['delivered'] == ['bob', 'carol']
+    assert encode.call_count == 1
+    assert execute.call_count == 2
+    [to_bob] = backlog(backend, 'bob')
+    [to_carol] = backlog(backend, 'carol')
+    assert to_bob == to_carol
+    assert to_bob['to'] == ['bob', 'carol']
+    assert 'topic' not in to_bob
+
+
+async def test_all_recipients_found(backend, user):
+    rv = await controller.route_message(
+        user, {'type': 'dm', 'to': ['bob', 'carol'], 'value': 'hi'}
+    )
+    assert rv is None
+    assert len(backlog(backend, 'carol')) == 1
+
+
+@pytest.mark.parametrize('to', [[], [1], [''], '', ['bob', None]])
+async def test_invalid_recipients(backend, user, to):
+    rv = await controller.route_message(user, {'type': 'dm', 'to': to, 'value': 'hi'})
+    assert rv['error']['reason'] == 'E_REASON_MALFORMED'
+
+
+async def test_too_many_recipients(backend, user, mocker):
+    mocker.patch('chitty.handlers.MAX_RECIPIENTS', 2)
+    rv = await handlers.direct_message(user, to=['bob', 'carol', 'alice'], value='hi')
+    assert rv['error']['reason'] == 'E_REASON_MALFORMED'
+    assert 'backlog:bob' not in backend.data
+
+
+async def test_partial_delivery_is_not_retried(backend, user, mocker):
+    mocker.patch('chitty.dedup.cache', dedup.DedupCache())
+    msg = {'type': 'dm', 'to': ['bob', 'zed'], 'value': 'hi', 'messageId': 'm1'}
+    for _ in range(2):
+        await controller.route_message(user, dict(msg))
+    assert len(backlog(backend, 'bob')) == 1
+    msg = {'type': 'dm', 'to': ['zed'], 'value': 'hi', 'messageId': 'm2'}
+    for _ in range(2):
+        rv = await controller.route_message(user, dict(msg))
+        assert rv['recipients'] == ['zed']
+        assert rv['delivered'] == []
@@ -0,0 +1,26 @@
+from chitty import ephemeral
+from chitty.message import make_ephemeral_message
+from chitty.storage import AsyncStorage, MemoryBackend
+
+
+async def test_events_coalesced_per_window(mocker):
+    published = []
+    backend = MemoryBackend()
+    backend.subscribe('room', lambda topic, data: published.append((topic, data)))
+    storage = AsyncStorage(backend)
+    mocker.patch('chitty.ephemeral.storage', storage)
+    mocker.patch('chitty.message.storage', storage)
+    clock = mocker.patch('chitty.ephemeral.time.monotonic', return_value=100.0)
+    coalescer = ephemeral.EventCoalescer(window=1)
+    for state in (True, True, False):
+        message = make_ephemeral_message({}, 'room', 'typing', active=state)
+        await coalescer.submit('alice', message)
+    await coalescer.submit('bob', make_ephemeral_message({}, 'room', 'typing'))
+    assert len(published) == 2
+    assert await coalescer.flush() == 0
+    clock.return_value = 101.0
+    assert await coalescer.flush() == 1
+    assert '"active": false' in published[-1][1]
+    clock.return_value = 103.0
+    assert await coalescer.flush() == 0
+    assert coalescer._published == {}
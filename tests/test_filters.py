@@ -0,0 +1,93 @@
+import pytest
+
+from chitty import controller, filters
+from chitty.errors import E_REASON_CONTENT_BLOCKED
+from chitty.storage import AsyncStorage, MemoryBackend
+
+MATCHERS = [filters.Matcher]
+if filters.ahocorasick is not None:
+    MATCHERS.append(filters.NativeMatcher)
+
+
+@pytest.fixture
+def storage(mocker):
+    storage = AsyncStorage(MemoryBackend())
+    mocker.patch('chitty.filters.storage', storage)
+    return storage
+
+
+@pytest.mark.parametrize('matcher_cls', MATCHERS)
+def test_matcher_whole_words(matcher_cls):
+    matcher = matcher_cls(['he', 'she', 'hers', 'bad word'])
+    assert matcher.find('ushers') is None
+    assert matcher.find('she said') == 'she'
+    assert matcher.find('it is hers.') == 'hers'
+    assert matcher.find('a bad word here') == 'bad word'
+    assert matcher.find('a bad wording') is None
+    assert matcher.find('') is None
+
+
+@pytest.mark.parametrize('matcher_cls', MATCHERS)
+def test_matcher_overlapping_terms(matcher_cls):
+    matcher = matcher_cls(['abcd', 'bc', 'c'])
+    assert matcher.find('abcx') is None
+    assert matcher.find('ab c') == 'c'
+    assert matcher.find('a bc') == 'bc'
+    assert matcher_cls([]).find('anything') is None
+
+
+def test_check_case_insensitive_and_counted():
+    content_filter = filters.ContentFilter()
+    assert content_filter.check('anything') is None
+    content_filter.matcher = filters.build_matcher([' Spam ', 'EGGS'])
+    assert content_filter.check('Buy SPAM now') == 'spam'
+    assert content_filter.check('eggs!') == 'eggs'
+    assert content_filter.check('spammer') is None
+    assert content_filter.stats.messages == 3
+    assert content_filter.stats.blocked == 2
+    assert content_filter.stats.chars == 24
+
+
+def test_stage_filters_only_posting_types(mocker):
+    content_filter = filters.ContentFilter()
+    content_filter.matcher = filters.build_matcher(['spam'])
+    user = mocker.Mock()
+    user.name = 'alice'
+    rv = content_filter.stage(user, 'msg', {'to': 'general', 'value': 'spam'})
+    assert rv['status'] == 'error'
+    assert rv['error']['reason'] == E_REASON_CONTENT_BLOCKED
+    assert content_filter.stage(user, 'dm', {'to': 'bob', 'value': 'ok'}) is None
+    assert content_filter.stage(user, 'sub', {'topic': 'spam'}) is None
+
+
+async def test_reload_on_version_change(storage):
+    content_filter = filters.ContentFilter()
+    assert await content_filter.reload() is True
+    assert content_filter.matcher is None
+    await storage.set_filter_terms(['spam', 'eggs'])
+    assert await content_filter.reload() is True
+    assert content_filter.version == 1
+    assert content_filter.check('no eggs') == 'eggs'
+    assert await content_filter.reload() is False
+    await storage.set_filter_terms([])
+    assert await content_filter.reload() is True
+    assert content_filter.check('no eggs') is None
+
+
+async def test_route_message_rejected_before_handler(mocker):
+    content_filter = filters.ContentFilter()
+    content_filter.matcher = filters.build_matcher(['spam'])
+    mocker.patch.object(controller, 'MESSAGE_FILTERS', [content_filter.stage])
+    handler = mocker.AsyncMock(return_value=None)
+    mocker.patch.dict(controller.MSG_HANDLERS, {'msg': handler})
+    user = mocker.Mock()
+    user.name = 'alice'
+    rv = await controller.route_message(
+        user, {'type': 'msg', 'to': 'general', 'value': 'SPAM!'}
+    )
+    assert rv['error']['reason'] == E_REASON_CONTENT_BLOCKED
+    handler.assert_not_awaited()
+    await controller.route_message(
+        user, {'type': 'msg', 'to': 'general', 'value': 'hello'}
+    )
+    handler.assert_awaited_once()
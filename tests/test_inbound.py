@@ -0,0 +1,127 @@
+import json
+
+import pytest
+import trio
+from trio_websocket import ConnectionClosed
+
+from chitty import server
+from chitty.controller import message_lane
+
+
+class FakeConnection:
+    def __init__(self, messages):
+        self.inbound = list(messages)
+        self.sent = []
+
+    async def get_message(self):
+        if not self.inbound:
+            await trio.sleep_forever()
+        return self.inbound.pop(0)
+
+    async def send_message(self, data):
+        self.sent.append(json.loads(data))
+
+
+def test_message_lane():
+    assert message_lane({'type': 'msg', 'to': 'room', 'value': 'hi'}) == 'room'
+    assert message_lane({'type': 'sub', 'value': 'room'}) == 'room'
+    assert message_lane({'type': 'sub', 'value': {'x': 1}}) == ''
+    assert message_lane({'type': 'typing'}) == ''
+
+
+async def test_lanes_ordered_per_key_and_concurrent_across_keys():
+    log = []
+
+    async def job(name, delay):
+        log.append(f'start {name}')
+        await trio.sleep(delay)
+        log.append(f'end {name}')
+
+    async with trio.open_nursery() as nursery:
+        lanes = server.InboundLanes(nursery, limit=4)
+        await lanes.submit('a', lambda: job('a1', 0.02))
+        await lanes.submit('a', lambda: job('a2', 0))
+        await lanes.submit('b', lambda: job('b1', 0.01))
+    assert log.index('end a1') < log.index('start a2')
+    assert log.index('start b1') < log.index('end a1')
+    assert lanes._tails == {}
+
+
+async def test_lanes_limit_blocks_submit(autojump_clock):
+    running = []
+    release = trio.Event()
+
+    async def job():
+        running.append(1)
+        await release.wait()
+
+    async with trio.open_nursery() as nursery:
+        lanes = server.InboundLanes(nursery, limit=2)
+        await lanes.submit('a', job)
+        await lanes.submit('b', job)
+        with trio.move_on_after(1) as scope:
+            await lanes.submit('c', job)
+        assert scope.cancelled_caught
+        assert len(running) == 2
+        release.set()
+
+
+@pytest.fixture
+def route(mocker):
+    async def fake_route(user, payload):
+        if payload['type'] == 'bad':
+            raise server.errors.MessageRoutingError('Unknown message type')
+        if payload['type'] == 'sub':
+            return {'type': 'sub', 'topics': [payload['value']]}
+        return None
+
+    return mocker.patch('chitty.server.route_message', side_effect=fake_route)
+
+
+async def test_request_id_echoed(route, mocker, autojump_clock):
+    ws = FakeConnection(
+        [
+            json.dumps({'type': 'sub', 'value': 'room', 'requestId': 1}),
+            json.dumps({'type': 'msg', 'to': 'room', 'value': 'hi', 'requestId': 'm'}),
+            json.dumps({'type': 'msg', 'to': 'room', 'value': 'no id'}),
+            json.dumps({'type': 'bad', 'requestId': 2}),
+            json.dumps({'type': 'msg', 'requestId': [1]}),
+        ]
+    )
+    with trio.move_on_after(0.1):
+        await server.ws_message_processor(ws, mocker.Mock())
+    by_id = {msg.get('requestId'): msg for msg in ws.sent}
+    assert by_id[1]['type'] == 'sub'
+    assert by_id['m'] == {'type': 'ack', 'requestId': 'm'}
+    assert by_id[2]['error']['reason'] == 'E_REASON_TYPE_INVALID'
+    assert by_id[None]['error']['reason'] == 'E_REASON_MALFORMED'
+    assert len(ws.sent) == 4
+    assert all('requestId' not in call.args[1] for call in route.call_args_list)
+
+
+async def test_processor_stops_on_connection_closed(route, mocker):
+    ws = FakeConnection([])
+    ws.get_message = mocker.AsyncMock(side_effect=ConnectionClosed(None))
+    with pytest.raises(ConnectionClosed):
+        await server.ws_message_processor(ws, mocker.Mock())
+
+
+async def test_handlers_on_closed_connection(route, mocker):
+    ws = FakeConnection(
+        [
+            json.dumps({'type': 'msg', 'to': 'a', 'value': 'x', 'requestId': 1}),
+            json.dumps({'type': 'msg', 'to': 'b', 'value': 'y', 'requestId': 2}),
+        ]
+    )
+    ws.send_message = mocker.AsyncMock(side_effect=ConnectionClosed(None))
+    get_message = ws.get_message
+
+    async def closed_after_inbound():
+        if not ws.inbound:
+            raise ConnectionClosed(None)
+        return await get_message()
+
+    ws.get_message = closed_after_inbound
+    with pytest.raises(ConnectionClosed):
+        await server.ws_message_processor(ws, mocker.Mock())
+    assert ws.send_message.await_count == 2
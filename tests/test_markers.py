@@ -0,0 +1,103 @@
+import pytest
+
+from chitty import controller, markers, message
+from chitty.storage import MemoryBackend, SyncStorage
+
+
+@pytest.fixture
+def storage_modules():
+    return ('message', 'markers')
+
+
+@pytest.fixture
+def buffer(mocker):
+    buffer = markers.ReadMarkerBuffer()
+    mocker.patch('chitty.handlers.read_markers', buffer)
+    return buffer
+
+
+async def publish(count, topic):
+    for i in range(count):
+        await message.make_message({'name': 'bob'}, topic, f'message {i}').publish()
+
+
+def test_read_markers_only_advance():
+    storage = SyncStorage(MemoryBackend())
+    storage.set_read_markers({'alice': {'room': 5, 'other': 2}})
+    storage.set_read_markers({'alice': {'room': 3}, 'bob': {}})
+    storage.set_read_markers({'alice': {'other': 4}})
+    assert storage.backend.data['read:alice'] == {'room': '5', 'other': '4'}
+    assert storage.unread_counts('alice', []) == {}
+
+
+async def test_unread_counts(backend, buffer, mocker):
+    await publish(5, 'room')
+    await publish(2, 'alice')
+    user = mocker.Mock()
+    user.name = 'alice'
+    user.topics = frozenset({'alice', 'general', 'room'})
+    for value in (3, 1):
+        rv = await controller.route_message(
+            user, {'type': 'read', 'to': 'room', 'value': value}
+        )
+        assert rv is None
+    assert await buffer.unread_counts('alice', {'room', 'alice', 'empty'}) == {
+        'alice': 2,
+        'empty': 0,
+        'room': 2,
+    }
+    await publish(1, 'room')
+    buffer.mark('alice', 'room', 9)
+    assert await buffer.flush() == 1
+    assert await buffer.flush() == 0
+    assert await markers.storage.unread_counts('alice', ['room']) == {'room': 0}
+
+
+async def test_unread_counts_single_round_trip(backend, buffer, mocker):
+    execute = mocker.spy(backend, 'execute')
+    await buffer.unread_counts('alice', ['a', 'b', 'c'])
+    assert execute.call_count == 1
+
+
+async def test_failed_flush_keeps_markers(backend, buffer, mocker):
+    buffer.mark('alice', 'room', 3)
+    mocker.patch.object(
+        markers.storage, 'set_read_markers', side_effect=ConnectionError
+    )
+    with pytest.raises(ConnectionError):
+        await buffer.flush()
+    buffer.mark('alice', 'room', 2)
+    assert buffer._pending == {'alice': {'room': 3}}
+
+
+async def test_failed_unread_counts_keeps_markers(backend, buffer, mocker):
+    buffer.mark('alice', 'room', 3)
+    mocker.patch.object(
+        markers.storage, 'set_read_markers', side_effect=ConnectionError
+    )
+    with pytest.raises(ConnectionError):
+        await buffer.unread_counts('alice', ['room'])
+    assert buffer._pending == {'alice': {'room': 3}}
+
+
+async def test_read_unsubscribed_topic(buffer, mocker):
+    user = mocker.Mock()
+    user.name = 'alice'
+    user.topics = frozenset({'alice', 'general'})
+    rv = await controller.route_message(
+        user, {'type': 'read', 'to': 'room', 'value': 1}
+    )
+    assert rv['error']['reason'] == 'E_REASON_NOTREG'
+    assert buffer._pending == {}
+
+
+async def test_read_validation(buffer, mocker):
+    user = mocker.Mock()
+    user.name = 'alice'
+    user.topics = frozenset({'alice', 'general', 'room'})
+    for value in (-1, True, '3'):
+        rv = await controller.route_message(
+            user, {'type': 'read', 'to': 'room', 'value': value}
+        )
+        assert rv['error']['reason'] == 'E_REASON_MALFORMED'
+    assert buffer._pending == {}
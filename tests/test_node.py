@@ -0,0 +1,111 @@
+import os
+import signal
+
+import pytest
+import trio
+
+from chitty import node as node_mod
+
+
+class FakeConnection:
+    def __init__(self, node):
+        self.node = node
+        self.closed = None
+
+    async def aclose(self, code=1000, reason=None):
+        self.closed = (trio.current_time(), code)
+        self.node.remove(self)
+
+
+@pytest.fixture
+def storage_modules():
+    return ('node',)
+
+
+def test_drain_schedule():
+    schedule = node_mod.drain_schedule(100, 30, 10, rand=lambda: 0.5)
+    assert schedule == [1.5 + 3 * i for i in range(10)]
+    assert len(node_mod.drain_schedule(3, 30, 10)) == 3
+    assert len(node_mod.drain_schedule(0, 30, 10)) == 1
+    offsets = node_mod.drain_schedule(10, 10, 10)
+    assert all(i <= offset < i + 1 for i, offset in enumerate(offsets))
+
+
+async def test_drain_closes_in_waves(backend, autojump_clock):
+    node = node_mod.Node(node_id='n1', period=10, waves=5)
+    connections = [FakeConnection(node) for _ in range(20)]
+    for ws in connections:
+        node.add(ws)
+    started = trio.current_time()
+    await node.drain()
+    assert node.draining
+    assert node.connections == set()
+    assert backend.data['nodes:n1']['state'] == 'draining'
+    assert all(ws.closed[1] == 1012 for ws in connections)
+    times = sorted(ws.closed[0] - started for ws in connections)
+    assert len(set(times)) == 5
+    assert times[-1] < 10
+
+
+async def test_drain_without_connections(backend, autojump_clock):
+    node = node_mod.Node(node_id='n1', period=10, waves=5)
+    started = trio.current_time()
+    await node.drain()
+    assert trio.current_time() == started
+    assert backend.data['nodes:n1']['state'] == 'draining'
+
+
+async def test_drain_ends_when_clients_leave(backend, autojump_clock, mocker):
+    mocker.patch(
+        'chitty.node.drain_schedule', return_value=[1.0, 3.0, 5.0, 7.0, 9.0]
+    )
+    node = node_mod.Node(node_id='n1', period=10, waves=5)
+    connections = [FakeConnection(node) for _ in range(10)]
+    for ws in connections:
+        node.add(ws)
+
+    async def leave():
+        await trio.sleep(2)
+        for ws in connections:
+            node.remove(ws)
+
+    started = trio.current_time()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(leave)
+        await node.drain()
+    assert trio.current_time() - started == pytest.approx(2)
+    assert sum(ws.closed is not None for ws in connections) == 2
+
+
+async def test_drain_signal_cancels_server(backend, autojump_clock):
+    node = node_mod.Node(node_id='n1', period=1, waves=1)
+    node.add(FakeConnection(node))
+    async with trio.open_nursery() as nursery:
+        await nursery.start(node.run, nursery.cancel_scope, signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        await trio.sleep_forever()
+    assert node.draining
+    assert node.connections == set()
+
+
+async def test_load_report_stored_and_removed(backend, autojump_clock):
+    node = node_mod.Node(node_id='n1')
+    node.add(FakeConnection(node))
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(node.report, 'chat1', 5000, 16, 5)
+        await trio.sleep(1)
+        data = backend.data['nodes:n1']
+        assert data['host'] == 'chat1'
+        assert data['connections'] == '1'
+        assert data['state'] == 'active'
+        assert 'n1' in backend.data['nodes']
+        nursery.cancel_scope.cancel()
+    assert 'nodes:n1' not in backend.data
+    assert 'nodes' not in backend.data
+
+
+def test_advertised_address(mocker):
+    assert node_mod.advertised_address('10.0.0.1', 5000) == ('10.0.0.1', 5000)
+    mocker.patch('chitty.node.NODE_PORT', '443')
+    mocker.patch('chitty.node.socket.getfqdn', return_value='chat.local')
+    assert node_mod.advertised_address('0.0.0.0', 5000) == ('chat.local', 443)
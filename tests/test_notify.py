@@ -0,0 +1,53 @@
+import json
+
+from chitty import handlers, message, notify
+from chitty.storage import AsyncStorage, MemoryBackend, SyncStorage
+
+
+async def test_first_notification_immediate_then_batched(mocker):
+    published = []
+    backend = MemoryBackend()
+
+    def receive(topic, data):
+        published.append((topic, json.loads(data)))
+
+    backend.subscribe('alice', receive)
+    storage = AsyncStorage(backend)
+    mocker.patch('chitty.notify.storage', storage)
+    mocker.patch('chitty.message.storage', storage)
+    clock = mocker.patch('chitty.notify.time.monotonic', return_value=100.0)
+    aggregator = notify.NotificationAggregator(window=2, quiet=10)
+    ref = {'topic': 'general', 'from': 'bob', 'date': 1.0}
+    await aggregator.notify('alice', notify.KIND_REPLY, ref)
+    assert len(published) == 1
+    for _ in range(3):
+        await aggregator.notify('alice', notify.KIND_REPLY, ref)
+    await aggregator.notify('alice', notify.KIND_MENTION, ref)
+    assert len(published) == 1
+    clock.return_value = 102.0
+    assert await aggregator.flush() == 1
+    topic, payload = published[-1]
+    assert topic == 'alice'
+    assert payload['counts'] == {'reply': 3, 'mention': 1}
+    assert payload['message'] == "You've got 3 replies and 1 mention"
+    assert len(payload['refs']) == 4
+    clock.return_value = 120.0
+    await aggregator.notify('alice', notify.KIND_MENTION, ref)
+    assert len(published) == 3
+
+
+async def test_only_existing_users_are_mentioned(mocker):
+    backend = MemoryBackend()
+    SyncStorage(backend).add_users([('bob', 'hash', 0, None)])
+    mocker.patch('chitty.handlers.storage', AsyncStorage(backend))
+    aggregator = mocker.patch('chitty.notify.aggregator')
+    aggregator.notify = mocker.AsyncMock()
+    user = mocker.Mock()
+    user.name = 'alice'
+    user.post_message = mocker.AsyncMock(
+        return_value=message.make_message({'name': 'alice'}, 'general', 'hi')
+    )
+    rv = await handlers.post_message(user, to='general', value='hi @bob @general')
+    assert rv is None
+    aggregator.notify.assert_awaited_once()
+    assert aggregator.notify.await_args.args[:2] == ('bob', notify.KIND_MENTION)
@@ -0,0 +1,84 @@
+import json
+
+from chitty import handlers, message
+from chitty.storage import MemoryBackend, SyncStorage
+
+
+def user(mocker, name='alice'):
+    obj = mocker.Mock()
+    obj.name = name
+    obj.subscribe = mocker.AsyncMock()
+    obj.to_map.return_value = {'name': name}
+    return obj
+
+
+async def publish(count, topic='room'):
+    for i in range(count):
+        msg = message.make_message({'name': 'bob'}, topic, f'message {i}')
+        await msg.publish()
+    return msg
+
+
+async def test_publish_assigns_topic_sequence(backend):
+    delivered = []
+    backend.subscribe('room', lambda topic, data: delivered.append(json.loads(data)))
+    last = await publish(3)
+    assert last.seq == 3
+    assert [payload['seq'] for payload in delivered] == [1, 2, 3]
+    assert delivered[0]['message'] == 'message 0'
+    other = await publish(1, topic='other')
+    assert other.seq == 1
+    received = message.Message.from_serialised('room', backend.data['backlog:room'][0])
+    assert received.seq == 3
+
+
+async def test_ephemeral_message_not_sequenced(backend):
+    msg = message.make_ephemeral_message({'name': 'bob'}, 'room', 'typing')
+    await msg.publish()
+    assert msg.seq is None
+    assert 'seq:room' not in backend.data
+
+
+def test_backlog_trimmed():
+    storage = SyncStorage(MemoryBackend())
+    for i in range(5):
+        storage.publish_sequenced('room', json.dumps({'i': i}), 3)
+    storage.publish_sequenced('room', '{}', 3)
+    seq, messages = storage.read_backlog('room', 2)
+    assert seq == 6
+    assert [json.loads(data) for data in messages] == [
+        {'seq': 4, 'i': 3},
+        {'seq': 5, 'i': 4},
+        {'seq': 6},
+    ]
+    assert storage.read_backlog('room', 6) == (6, [])
+
+
+async def test_subscribe_resync(backend, mocker):
+    await publish(5)
+    rv = await handlers.subscribe(user(mocker), value='room', since=3)
+    resync = rv['resync']
+    assert resync['seq'] == 5
+    assert [payload['seq'] for payload in resync['messages']] == [4, 5]
+    rv = await handlers.subscribe(user(mocker), value='room')
+    assert 'resync' not in rv
+
+
+async def test_subscribe_resync_gap(backend, mocker):
+    mocker.patch('chitty.message.BACKLOG_SIZE', 2)
+    await publish(5)
+    rv = await handlers.subscribe(user(mocker), value='room', since=1)
+    assert rv['resync'] == {'topic': 'room', 'seq': 5, 'gap': True}
+    rv = await handlers.subscribe(user(mocker), value='room', since=9)
+    assert rv['resync']['gap'] is True
+    rv = await handlers.subscribe(user(mocker), value='room', since=-1)
+    assert rv['status'] == 'error'
+
+
+async def test_resync_private_topic_only_for_owner(backend, mocker):
+    backend.execute([('HSET', 'users:bob', 'name', 'bob')])
+    await publish(2, topic='bob')
+    rv = await handlers.subscribe(user(mocker), value='bob', since=0)
+    assert rv['resync']['gap'] is True
+    rv = await handlers.subscribe(user(mocker, 'bob'), value='bob', since=0)
+    assert len(rv['resync']['messages']) == 2
@@ -0,0 +1,132 @@
+import json
+
+import pytest
+
+from chitty import handlers, message, retention
+from chitty.pubsub import TopicPubSub
+from chitty.user import User
+
+
+@pytest.fixture
+def storage_modules():
+    return ('message', 'handlers', 'user', 'event', 'retention')
+
+
+def add_topic(backend, topic, activity, members=()):
+    backend.execute(
+        [
+            ('SADD', 'topics', topic),
+            ('ZADD', 'directory:names', 0, topic),
+            ('ZADD', 'directory:activity', activity, topic),
+            ('ZADD', 'directory:subscribers', len(members), topic),
+            ('SET', f'seq:{topic}', 3),
+            ('LPUSH', f'backlog:{topic}', '{}'),
+        ]
+        + [('SADD', f'topics:{name}', topic) for name in members]
+    )
+
+
+class FakeProtocol:
+    closed = False
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.commands = []
+
+    def _command(self, command):
+        self.commands.append(command)
+
+    async def send_all(self):
+        pass
+
+    async def receive(self):
+        return self.replies.pop(0)
+
+
+async def test_pubsub_unsubscribe():
+    protocol = FakeProtocol(
+        [
+            [b'subscribe', b'a', 1],
+            [b'subscribe', b'b', 2],
+            [b'message', b'a', b'queued'],
+            [b'unsubscribe', b'a', 1],
+            [b'message', b'b', b'live'],
+        ]
+    )
+    pubsub = TopicPubSub(protocol, 'a', 'b').with_channel
+    await pubsub.connect()
+    pubsub.unsubscribe('a', 'never')
+    assert await pubsub == ('a', b'queued')
+    assert protocol.commands[-1] == [b'UNSUBSCRIBE', b'a']
+    assert pubsub.subscribed == {'b'}
+    assert await pubsub == ('b', b'live')
+
+
+async def test_unsubscribe_handler(backend, mocker):
+    user = User('alice')
+    await user.subscribe('room')
+    assert backend.data['directory:subscribers']['room'] == 1
+    rv = await handlers.unsubscribe(user, value='room')
+    assert rv['type'] == 'unsub'
+    assert 'room' not in rv['topics']
+    assert 'topics:alice' not in backend.data
+    assert backend.data['directory:subscribers']['room'] == 0
+    rv = await handlers.unsubscribe(user, value='alice')
+    assert rv['error']['reason'] == 'E_REASON_TOPIC_SYSTEM'
+    rv = await handlers.unsubscribe(user, value='sys:events')
+    assert rv['error']['reason'] == 'E_REASON_TOPIC_SYSTEM'
+    rv = await handlers.unsubscribe(user, value='general')
+    assert rv['error']['reason'] == 'E_REASON_TOPIC_SYSTEM'
+
+
+async def test_expire_idle_topics(backend):
+    add_topic(backend, 'old', 100.0, members=['alice'])
+    add_topic(backend, 'recent', 950.0)
+    add_topic(backend, 'general', 100.0)
+    collector = retention.TopicCollector(ttl=500, batch_size=10)
+    assert await collector.expire_topics(now=1000.0) == 1
+    assert backend.data['topics'] == {'recent', 'general'}
+    assert 'old' not in backend.data['directory:names']
+    assert backend.data['seq:old'] == '3'
+    assert backend.data['floors'] == {'old': '3'}
+    assert 'backlog:old' not in backend.data
+    assert backend.data['directory:activity']['general'] == 1000.0
+    assert await collector.expire_topics(now=1000.0) == 0
+
+
+async def test_recreated_topic_continues_sequence(backend):
+    add_topic(backend, 'old', 100.0)
+    storage = retention.storage
+    await storage.set_read_markers({'alice': {'old': 1}})
+    assert await storage.unread_counts('alice', ['old']) == {'old': 2}
+    assert await storage.expire_topic('old', 500.0)
+    assert await storage.unread_counts('alice', ['old']) == {'old': 0}
+    await storage.add_topic('old')
+    await message.make_message({'name': 'bob'}, 'old', 'hi').publish()
+    assert json.loads(backend.data['backlog:old'][0])['seq'] == 4
+    assert await storage.unread_counts('alice', ['old']) == {'old': 1}
+
+
+async def test_expire_skips_topic_active_again(backend):
+    add_topic(backend, 'old', 100.0)
+    collector = retention.TopicCollector(ttl=500)
+    storage = retention.storage
+    assert await storage.idle_topics(500.0, 10) == ['old']
+    await storage.touch_topic('old', 800.0)
+    assert not await storage.expire_topic('old', 500.0)
+    assert await collector.expire_topics(now=1000.0) == 0
+
+
+async def test_prune_subscriptions(backend):
+    add_topic(backend, 'room', 100.0, members=['alice', 'bob'])
+    backend.execute(
+        [
+            ('SADD', 'topics:alice', 'alice', 'general', 'gone'),
+            ('SADD', 'topics:bob', 'gone', 'lost'),
+        ]
+    )
+    collector = retention.TopicCollector(batch_size=10)
+    assert await collector.prune_subscriptions() == 3
+    assert backend.data['topics:alice'] == {'alice', 'general', 'room'}
+    assert backend.data['topics:bob'] == {'room'}
+    assert collector._cursor == 0
@@ -0,0 +1,110 @@
+import json
+
+import falcon
+import pytest
+from falcon import testing
+
+from chitty import indexer
+from chitty.search import IndexEntry, SearchIndex, make_query
+from chitty.services.auth import get_token
+from chitty.storage import AsyncStorage, MemoryBackend
+from chitty.web.search import MessageSearchResource
+
+
+def payload(text, sender='alice', date=1000.0, topic='general', **extra):
+    data = {
+        'from': {'name': sender, 'created': 1.0},
+        'message': text,
+        'date': date,
+        'topic': topic,
+        'type': 'msg',
+    }
+    data.update(extra)
+    return json.dumps(data)
+
+
+def entry(text, sender='alice', date=1000.0, topic='general'):
+    return IndexEntry(topic, sender, date, text, payload(text, sender, date, topic))
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def storage(mocker):
+    storage = AsyncStorage(MemoryBackend())
+    mocker.patch('chitty.indexer.storage', storage)
+    return storage
+
+
+def test_make_query_quotes_words():
+    assert make_query('hello "world" OR x*') == '"hello" """world""" "OR" "x*"'
+    assert make_query('   ') == ''
+
+
+def test_search_filters(index):
+    index.add(
+        [
+            entry('release is out', date=1.0),
+            entry('new release notes', sender='bob', date=2.0),
+            entry('release party', topic='random', date=3.0),
+            entry('unrelated', date=4.0),
+        ]
+    )
+    assert [hit.date for hit in index.search('release')] == [3.0, 2.0, 1.0]
+    assert [hit.date for hit in index.search('RELEASE', topic='general')] == [2.0, 1.0]
+    assert [hit.sender for hit in index.search('release', sender='bob')] == ['bob']
+    assert [hit.date for hit in index.search('release', since=2.0)] == [3.0, 2.0]
+    assert [hit.date for hit in index.search('release', until=2.0)] == [1.0]
+    assert [hit.date for hit in index.search('release', limit=1)] == [3.0]
+    assert index.search('release notes')[0].message == 'new release notes'
+    assert index.search('"OR') == []
+
+
+def test_parse_entry_skips_non_chat_messages():
+    assert indexer.parse_entry('general', payload('hi')).message == 'hi'
+    assert indexer.parse_entry('sys:events', payload('hi')) is None
+    assert indexer.parse_entry('general', payload('hi', type='typing')) is None
+    assert indexer.parse_entry('general', payload('hi', ephemeral=True)) is None
+    assert indexer.parse_entry('general', 'not json') is None
+
+
+async def test_flush_indexes_public_topics_only(index, storage):
+    await storage.add_topic('general')
+    idx = indexer.Indexer(index, batch_size=10)
+    idx.feed('general', payload('hello world'))
+    idx.feed('bob', payload('private hello', topic='bob'))
+    idx.feed('news', payload('hello news', topic='news'))
+    idx.feed('sys:events', payload('hello event'))
+    await storage.add_topic('news')
+    assert await idx.flush() == 2
+    assert idx.pending == []
+    assert {hit.topic for hit in index.search('hello')} == {'general', 'news'}
+    assert await idx.flush() == 0
+
+
+def test_search_endpoint(index):
+    index.add([entry('hello world', date=1.0), entry('hello there', date=2.0)])
+    app = falcon.App()
+    app.add_route('/search', MessageSearchResource(index))
+    client = testing.TestClient(app)
+    headers = {'Authorization': f'Bearer {get_token("alice")}'}
+    assert client.simulate_get('/search', params={'q': 'hello'}).status_code == 401
+    rv = client.simulate_get('/search', params={'q': ' '}, headers=headers)
+    assert rv.status_code == 400
+    rv = client.simulate_get(
+        '/search', params={'q': 'hello', 'limit': '1'}, headers=headers
+    )
+    assert rv.status_code == 200
+    assert rv.json['until'] == 2.0
+    [hit] = rv.json['results']
+    assert hit['from'] == 'alice'
+    assert hit['message']['message'] == 'hello there'
+    rv = client.simulate_get(
+        '/search', params={'q': 'hello', 'until': '2.0'}, headers=headers
+    )
+    assert [hit['date'] for hit in rv.json['results']] == [1.0]
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# cumulative import time budgets in milliseconds, well above measured times
+# so that only regressions like eagerly loaded heavy dependency fail
+BUDGETS = {
+    'chitty.cli': 100,
+    'chitty.server': 800,
+    'chitty.web.app': 600,
+}
+
+# dependencies that must be loaded on first use, not at import
+LAZY = {
+    'chitty.cli': ['trio', 'dotenv', 'redio', 'passlib', 'itsdangerous'],
+    'chitty.server': ['redio', 'redis', 'passlib', 'itsdangerous', 'falcon'],
+    'chitty.web.app': ['trio', 'redio', 'redis', 'passlib', 'itsdangerous'],
+}
+
+
+def run_python(*args):
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if not name.startswith('CHITTY_')
+    }
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def import_time(module):
+    rv = run_python('-X', 'importtime', '-c', f'import {module}')
+    for line in rv.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if name.strip() == module:
+            return int(cumulative) / 1000
+    raise AssertionError(f'no import time reported for {module}')
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module):
+    elapsed = min(import_time(module) for _ in range(3))
+    assert elapsed < BUDGETS[module], f'{module} imported in {elapsed:.1f}ms'
+
+
+@pytest.mark.parametrize('module', sorted(LAZY))
+def test_heavy_dependencies_not_imported(module):
+    rv = run_python('-c', f'import sys, {module}; print(*sys.modules)')
+    loaded = set(rv.stdout.split())
+    assert [name for name in LAZY[module] if name in loaded] == []
@@ -0,0 +1,114 @@
+import pytest
+import trio
+
+from chitty.storage import AsyncStorage, MemoryBackend, SyncStorage
+from chitty.web.services import ORDER_NAME, ORDER_POPULAR, Storage
+
+
+@pytest.fixture
+def backend():
+    return MemoryBackend()
+
+
+async def test_same_tick_operations_pipelined(backend, mocker):
+    storage = AsyncStorage(backend)
+    execute = mocker.spy(backend, 'execute')
+    results = {}
+
+    async def add(topic):
+        results[topic] = await storage.add_topic(topic)
+
+    async with trio.open_nursery() as nursery:
+        for topic in ('a', 'b', 'a'):
+            nursery.start_soon(add, topic)
+    assert execute.call_count == 1
+    assert len(execute.call_args.args[0]) == 9
+    assert sorted(results) == ['a', 'b']
+    assert await storage.get_topics() == {'a', 'b'}
+    assert execute.call_count == 2
+
+
+async def test_failed_command_fails_own_operation(backend):
+    storage = AsyncStorage(backend)
+    backend.data['topics'] = 42
+    outcome = {}
+
+    async def run(name, fn, *args):
+        try:
+            outcome[name] = await fn(*args)
+        except Exception as e:
+            outcome[name] = e
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(run, 'bad', storage.topic_exists, 'general')
+        nursery.start_soon(run, 'good', storage.add_subscription, 'alice', 'general')
+    assert isinstance(outcome['bad'], Exception)
+    assert outcome['good'] is True
+
+
+def test_sync_user_operations(backend):
+    storage = SyncStorage(backend)
+    storage.add_user('alice', 'secret', 1.0, token='t0k')
+    assert storage.user_exists('alice') is True
+    assert storage.users_exist(['alice', 'bob']) == [True, False]
+    assert storage.get_user('alice') == {'name': 'alice', 'created': '1.0'}
+    assert storage.get_password('alice') == 'secret'
+    assert 'alice' in storage.get_user_topics('alice')
+    assert backend.data['logins:alice']['token'] == 't0k'
+
+
+def test_mark_seen_expires(backend, mocker):
+    storage = SyncStorage(backend)
+    clock = mocker.patch('chitty.storage.time.monotonic', return_value=10.0)
+    assert storage.mark_seen('dedup:x', 5) is True
+    assert storage.mark_seen('dedup:x', 5) is False
+    clock.return_value = 13.0
+    assert storage.mark_seen('dedup:x', 5) is False
+    clock.return_value = 16.0
+    assert storage.mark_seen('dedup:x', 5) is True
+
+
+def test_topic_directory_pages(backend):
+    storage = Storage(backend=backend)
+    store = storage.store
+    for topic, subscribers in (('apples', 3), ('apricots', 1), ('bananas', 2)):
+        store.add_topic(topic)
+        store.count_subscribers(topic, subscribers)
+    store.touch_topic('bananas', 100.0)
+    page, cursor = storage.list_topics(order=ORDER_POPULAR, limit=2)
+    assert [t.name for t in page] == ['apples', 'bananas']
+    assert cursor == '2:bananas'
+    page, cursor = storage.list_topics(order=ORDER_POPULAR, cursor=cursor, limit=2)
+    assert [t.name for t in page] == ['apricots']
+    assert cursor is None
+    page, cursor = storage.list_topics(prefix='ap', limit=1)
+    assert [(t.name, t.subscribers) for t in page] == [('apples', 3)]
+    page, cursor = storage.list_topics(prefix='ap', cursor=cursor, limit=1)
+    assert [t.name for t in page] == ['apricots']
+    page, _ = storage.list_topics(order=ORDER_NAME, limit=5)
+    assert page[-1].last_activity == 100.0
+
+
+def test_rebuild_topic_directory(backend):
+    storage = Storage(backend=backend)
+    storage.store.add_user('alice', 'x', 1.0)
+    storage.store.add_subscription('alice', 'cooking')
+    backend.execute([('SADD', 'topics', 'cooking')])
+    backend.execute([('DEL', 'directory:names', 'directory:subscribers')])
+    assert storage.rebuild_topic_directory(batch_size=1) >= 2
+    page, _ = storage.list_topics(prefix='cooking')
+    assert page[0].subscribers == 1
+
+
+async def test_hung_backend_times_out(backend, mocker, autojump_clock):
+    storage = AsyncStorage(backend, timeout=5)
+
+    async def hang(commands):
+        await trio.sleep_forever()
+
+    mocker.patch.object(backend, 'execute', hang)
+    with trio.move_on_after(1) as scope:
+        with pytest.raises(trio.TooSlowError):
+            await storage.topic_exists('general')
+    assert scope.cancelled_caught is False
+    assert trio.current_time() == 5
@@ -0,0 +1,172 @@
+import socket
+import ssl
+
+import pytest
+import trio
+import trustme
+
+from chitty import tls
+
+
+@pytest.fixture
+def ca():
+    return trustme.CA()
+
+
+@pytest.fixture
+def server_context(ca):
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ca.issue_cert("localhost").configure_cert(ctx)
+    ctx.num_tickets = 2
+    return ctx
+
+
+@pytest.fixture
+def client_context(ca):
+    ctx = ssl.create_default_context()
+    ca.configure_trust(ctx)
+    return ctx
+
+
+@pytest.fixture
+def handshake_stats(mocker):
+    stats = tls.HandshakeStats()
+    mocker.patch.object(tls, "stats", stats)
+    return stats
+
+
+def connect(client_context, port, session=None):
+    with client_context.wrap_socket(
+        socket.create_connection(("127.0.0.1", port)),
+        server_hostname="localhost",
+        session=session,
+    ) as sock:
+        sock.recv(1)
+        return sock.session, sock.session_reused
+
+
+async def open_listener(nursery, server_context):
+    transport, *_ = await trio.open_ssl_over_tcp_listeners(
+        0, server_context, host="127.0.0.1", https_compatible=True
+    )
+    listener = tls.HandshakeListener(transport, timeout=5)
+    await nursery.start(listener.run)
+    port = transport.transport_listener.socket.getsockname()[1]
+    return listener, port
+
+
+async def test_handshake_resumed(
+    nursery, server_context, client_context, handshake_stats
+):
+    listener, port = await open_listener(nursery, server_context)
+
+    async def serve():
+        for _ in range(2):
+            stream = await listener.accept()
+            await stream.send_all(b"x")
+            await stream.aclose()
+
+    nursery.start_soon(serve)
+    session, reused = await trio.to_thread.run_sync(connect, client_context, port)
+    assert reused is False
+    _, reused = await trio.to_thread.run_sync(connect, client_context, port, session)
+    assert reused is True
+    assert handshake_stats.full == 1
+    assert handshake_stats.resumed == 1
+    assert handshake_stats.to_map()["resumptionRate"] == 0.5
+
+
+async def test_handshake_failed_not_accepted(nursery, server_context, handshake_stats):
+    listener, port = await open_listener(nursery, server_context)
+    with trio.socket.socket() as sock:
+        await sock.connect(("127.0.0.1", port))
+        await sock.send(b"GET / HTTP/1.1\r\n\r\n")
+        await sock.recv(1024)
+    with trio.move_on_after(0.5):
+        while not handshake_stats.failed:
+            await trio.sleep(0.01)
+    assert handshake_stats.failed == 1
+    assert handshake_stats.full == 0
+
+
+def test_shared_ticket_keys(ca, client_context):
+    key = bytes(range(tls.TICKET_KEY_SIZE))
+    contexts = []
+    for _ in range(2):
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ca.issue_cert("localhost").configure_cert(ctx)
+        tls.set_ticket_keys(ctx, key, enabled=True)
+        contexts.append(ctx)
+
+    def handshake(server_ctx, session=None):
+        bios = [ssl.MemoryBIO() for _ in range(4)]
+        client = client_context.wrap_bio(
+            bios[0], bios[1], server_hostname="localhost", session=session
+        )
+        server = server_ctx.wrap_bio(bios[2], bios[3], server_side=True)
+        for _ in range(5):
+            for obj in (client, server):
+                try:
+                    obj.do_handshake()
+                except ssl.SSLWantReadError:
+                    pass
+            bios[2].write(bios[1].read())
+            bios[0].write(bios[3].read())
+        server.write(b"x")
+        bios[0].write(bios[3].read())
+        client.read()
+        return client.session, server.session_reused
+
+    session, reused = handshake(contexts[0])
+    assert reused is False
+    _, reused = handshake(contexts[1], session)
+    assert reused is True
+
+
+def test_ticket_key_size():
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    with pytest.raises(ValueError):
+        tls.set_ticket_keys(ctx, b"short")
+
+
+def test_ticket_keys_need_opt_in(mocker):
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    key = bytes(tls.TICKET_KEY_SIZE)
+    with pytest.raises(RuntimeError, match="CHITTY_TLS_CTYPES_TICKET_KEYS"):
+        tls.set_ticket_keys(ctx, key, enabled=False)
+    mocker.patch.object(tls, "CTYPES_TICKET_KEYS_VERSIONS", ((2, 0), (2, 7)))
+    with pytest.raises(RuntimeError, match="not supported"):
+        tls.set_ticket_keys(ctx, key, enabled=True)
+
+
+async def test_handshake_error_does_not_stop_listener(
+    nursery, mocker, handshake_stats
+):
+    bad, good = mocker.Mock(), mocker.Mock(session_reused=False)
+    for stream in (bad, good):
+        stream.aclose = mocker.AsyncMock()
+    bad.do_handshake = mocker.AsyncMock(side_effect=ValueError("boom"))
+    good.do_handshake = mocker.AsyncMock()
+    streams = [bad, good]
+
+    async def accept():
+        if not streams:
+            await trio.sleep_forever()
+        return streams.pop(0)
+
+    transport = mocker.Mock(accept=accept)
+    listener = tls.HandshakeListener(transport, timeout=5)
+    await nursery.start(listener.run)
+    assert await listener.accept() is good
+    assert handshake_stats.failed == 1
+    assert handshake_stats.full == 1
+    bad.aclose.assert_awaited_once()
+
+
+def test_ticket_keys_skip_unsupported_interpreter(mocker):
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    mocker.patch("platform.python_implementation", return_value="PyPy")
+    ctrl = mocker.patch.object(tls, "_ssl_ctx_ctrl")
+    with pytest.raises(RuntimeError, match="not supported on PyPy"):
+        tls.set_ticket_keys(ctx, bytes(tls.TICKET_KEY_SIZE), enabled=True)
+    ctrl.assert_not_called()
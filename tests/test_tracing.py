@@ -0,0 +1,34 @@
+import json
+
+from chitty import tracing
+from chitty.message import make_message
+
+
+def test_make_message_carries_current_trace():
+    token = tracing.current_trace.set('abc')
+    try:
+        message = make_message({'name': 'alice'}, 'general', 'hi')
+    finally:
+        tracing.current_trace.reset(token)
+    assert message.payload[tracing.TRACE_FIELD] == 'abc'
+    assert tracing.TRACE_FIELD not in make_message({}, 'general', 'hi').payload
+
+
+def test_tracer_records_hops(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    exporter = tracing.TraceExporter(str(path), flush_interval=0)
+    tracer = tracing.Tracer(sample_rate=1, exporter=exporter)
+    trace_id = tracer.sample()
+    tracer.hop(trace_id, tracing.HOP_RECEIVE, user='alice')
+    tracer.hop(None, tracing.HOP_ROUTE)
+    tracer.hop(trace_id, tracing.HOP_PUBLISH, topic='general')
+    exporter.flush()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r['hop'] for r in records] == [tracing.HOP_RECEIVE, tracing.HOP_PUBLISH]
+    assert records[0]['mono'] <= records[1]['mono']
+    assert all(r['trace'] == trace_id for r in records)
+
+
+def test_tracer_disabled_does_not_sample():
+    tracer = tracing.Tracer(sample_rate=0, exporter=None)
+    assert tracer.sample() is None
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+
+import falcon
+import pytest
+from falcon import testing
+
+from chitty.attachment import make_reference
+from chitty.services.auth import get_token
+from chitty.web.attachments import AttachmentResource, AttachmentUploadResource
+from chitty.web.blobs import BlobStore, BlobTooLarge
+
+CONTENT = bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path), max_size=len(CONTENT), chunk_size=4096)
+
+
+@pytest.fixture
+def client(store):
+    app = falcon.App()
+    app.add_route('/attachments', AttachmentUploadResource(store))
+    app.add_route('/attachments/{attachment_id}', AttachmentResource(store))
+    return testing.TestClient(app)
+
+
+def upload(client, body, content_type='image/png'):
+    return client.simulate_post(
+        '/attachments',
+        body=body,
+        headers={
+            'Authorization': f'Bearer {get_token("alice")}',
+            'Content-Type': content_type,
+        },
+    )
+
+
+def test_upload_content_addressed(client, store):
+    rv = upload(client, CONTENT)
+    assert rv.status_code == 201
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    assert rv.json == {'id': digest, 'size': len(CONTENT), 'contentType': 'image/png'}
+    rv = upload(client, CONTENT, content_type='text/plain')
+    assert rv.json['contentType'] == 'image/png'
+    with open(store.path(digest), 'rb') as fp:
+        assert fp.read() == CONTENT
+
+
+def test_upload_requires_token(client):
+    rv = client.simulate_post('/attachments', body=b'data')
+    assert rv.status_code == 401
+
+
+def test_upload_too_large(client, store):
+    rv = upload(client, CONTENT + b'x')
+    assert rv.status_code == 413
+    with pytest.raises(BlobTooLarge):
+        store.save(io.BytesIO(CONTENT + b'x'))
+    assert os.listdir(os.path.join(store.root, 'tmp')) == []
+
+
+def test_download_range(client):
+    blob_id = upload(client, CONTENT).json['id']
+    rv = client.simulate_get(f'/attachments/{blob_id}')
+    assert rv.status_code == 200
+    assert rv.content == CONTENT
+    assert rv.headers['content-type'] == 'image/png'
+    rv = client.simulate_get(
+        f'/attachments/{blob_id}', headers={'Range': 'bytes=10-19'}
+    )
+    assert rv.status_code == 206
+    assert rv.content == CONTENT[10:20]
+    assert rv.headers['content-range'] == f'bytes 10-19/{len(CONTENT)}'
+    rv = client.simulate_get(f'/attachments/{blob_id}', headers={'Range': 'bytes=-5'})
+    assert rv.content == CONTENT[-5:]
+    rv = client.simulate_get(
+        f'/attachments/{blob_id}', headers={'Range': f'bytes={len(CONTENT)}-'}
+    )
+    assert rv.status_code == 416
+    rv = client.simulate_get(
+        f'/attachments/{blob_id}', headers={'If-None-Match': f'"{blob_id}"'}
+    )
+    assert rv.status_code == 304
+
+
+@pytest.mark.parametrize(
+    'content_type, inline',
+    [('image/png', True), ('text/html', False), ('image/svg+xml', False)],
+)
+def test_download_active_content_not_inline(client, content_type, inline):
+    rv = upload(client, content_type.encode(), content_type=content_type)
+    blob_id = rv.json['id']
+    rv = client.simulate_get(f'/attachments/{blob_id}')
+    assert rv.headers['X-Content-Type-Options'] == 'nosniff'
+    disposition = rv.headers.get('Content-Disposition')
+    if inline:
+        assert disposition is None
+    else:
+        assert disposition.startswith('attachment')
+
+
+def test_download_unknown(client):
+    assert client.simulate_get('/attachments/nope').status_code == 404
+    assert client.simulate_get(f'/attachments/{"0" * 64}').status_code == 404
+
+
+def test_make_reference():
+    ref = make_reference({'id': 'a' * 64, 'name': 'cat.png', 'size': 10, 'x': 1})
+    assert ref == {'id': 'a' * 64, 'name': 'cat.png', 'size': 10}
+    for data in ({'id': 'nope'}, 'a' * 64, {'id': 'a' * 64, 'size': -1}):
+        with pytest.raises(ValueError):
+            make_reference(data)
@@ -0,0 +1,64 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from chitty.web.bulk import FORMAT_CSV, read_records
+from chitty.web.services import UserData, UserPoolManager
+
+
+def test_read_records_jsonl_reports_bad_rows():
+    stream = io.StringIO('{"name": "a", "password": "x"}\n\nnot json\n[1]\n')
+    records = list(read_records(stream))
+    assert records == [(1, {'name': 'a', 'password': 'x'}), (3, {}), (4, {})]
+
+
+def test_read_records_csv():
+    stream = io.StringIO('name,password\na,x\nb,y\n')
+    records = list(read_records(stream, FORMAT_CSV))
+    assert [row for row, _ in records] == [1, 2]
+    assert records[1][1]['name'] == 'b'
+
+
+def test_import_users_batches(mocker):
+    db = mocker.Mock()
+    db.users_exist.side_effect = lambda names: [name == 'taken' for name in names]
+    db.add_users.side_effect = lambda users: [
+        UserData(name=name, created=0, token=token) for name, _, token in users
+    ]
+    records = [
+        (1, {'name': 'a', 'password': 'x'}),
+        (2, {'name': 'taken', 'password': 'x'}),
+        (3, {'name': 'a', 'password': 'x'}),
+        (4, {'name': 'b'}),
+        (5, {'name': 'c', 'password': 'y'}),
+    ]
+    progress = mocker.Mock()
+    result = UserPoolManager(db).import_users(
+        records, batch_size=3, workers=1, progress=progress
+    )
+    assert result.processed == 5
+    assert result.created == 2
+    assert sorted(row for row, _ in result.errors) == [2, 3, 4]
+    assert progress.call_count == 2
+    assert db.add_users.call_count == 2
+    name, secret, token = db.add_users.call_args_list[0].args[0][0]
+    assert name == 'a'
+    assert secret.startswith('$argon2')
+
+
+def test_import_users_rejects_non_string_fields(mocker):
+    db = mocker.Mock()
+    db.users_exist.side_effect = lambda names: [False for _ in names]
+    db.add_users.side_effect = lambda users: [
+        UserData(name=name, created=0, token=token) for name, _, token in users
+    ]
+    records = [
+        (1, {'name': 'a', 'password': 123}),
+        (2, {'name': ['b'], 'password': 'x'}),
+        (3, {'name': 'c', 'password': None}),
+        (4, {'name': 'd', 'password': 'y'}),
+    ]
+    executor = ThreadPoolExecutor(max_workers=1)
+    result = UserPoolManager(db).import_users(records, workers=1, executor=executor)
+    assert result.created == 1
+    assert [row for row, _ in result.errors] == [1, 2, 3]
+    assert executor.submit(int).result() == 0
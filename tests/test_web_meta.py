@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+
+import falcon
+import pytest
+from falcon import testing
+
+from chitty.storage import MemoryBackend, SyncStorage
+from chitty.web.meta import NodeView, ServerMetadataResource
+from chitty.web.services import NodeInfo, Storage, UserPoolManager
+
+NOW = 1000.0
+
+
+@pytest.fixture
+def store():
+    return Storage(backend=MemoryBackend())
+
+
+@pytest.fixture
+def view(store):
+    return NodeView(UserPoolManager(store), ttl=2, stale_after=15, clock=lambda: NOW)
+
+
+def report(store, name, updated=NOW, **fields):
+    data = {
+        'host': name,
+        'port': 5000,
+        'state': 'active',
+        'connections': 0,
+        'capacity': 100,
+        'cpu': 0.0,
+        'queue': 0,
+        'updated': updated,
+        **fields,
+    }
+    store.store.report_node(name, data, 15, updated - 15)
+
+
+def test_node_load():
+    node = NodeInfo('a', 'a', 5000, connections=50, capacity=100, cpu=0.2, queue=10)
+    assert node.load == 0.5
+    assert NodeInfo('a', 'a', 5000, cpu=0.7, queue=80).load == 0.8
+
+
+def test_healthy_nodes(store, view):
+    report(store, 'a')
+    report(store, 'b', state='draining')
+    report(store, 'c', updated=NOW - 20)
+    assert [node.name for node in view.healthy()] == ['a']
+
+
+def test_view_cached(store, view, mocker):
+    report(store, 'a')
+    list_nodes = mocker.spy(view.user_mgr, 'list_nodes')
+    view.healthy()
+    report(store, 'b')
+    assert len(view.healthy()) == 1
+    assert list_nodes.call_count == 1
+    view.clock = lambda: NOW + 3
+    assert len(view.healthy()) == 2
+
+
+def test_choice_weighted_by_load(store, view):
+    report(store, 'idle', connections=10)
+    report(store, 'busy', connections=70)
+    report(store, 'full', connections=100)
+    rand = random.Random(1)
+    counts = Counter(view.choose(rand).name for _ in range(1000))
+    assert counts['full'] == 0
+    assert counts['idle'] > 5 * counts['busy'] > 0
+
+
+def test_meta_falls_back_to_environment(store, view, monkeypatch):
+    monkeypatch.setenv('CHITTY_CHAT_HOST', 'chat.example.com')
+    app = falcon.App()
+    app.add_route('/meta', ServerMetadataResource(view))
+    client = testing.TestClient(app)
+    rv = client.simulate_get('/meta')
+    assert rv.json == {'chat': {'host': 'chat.example.com', 'port': 5000}}
+    assert rv.headers['Cache-Control'] == 'private, max-age=5'
+    report(store, 'node1', port=5001)
+    view.clock = lambda: NOW + 3
+    rv = client.simulate_get('/meta')
+    assert rv.json == {'chat': {'host': 'node1', 'port': 5001}}
+
+
+def test_stale_index_entries_removed():
+    storage = SyncStorage(MemoryBackend())
+    data = {'updated': 10.0}
+    storage.report_node('old', data, 15, -5)
+    storage.report_node('new', {'updated': 30.0}, 15, 15)
+    assert storage.node_ids(0) == ['new']
+    storage.remove_node('new')
+    assert storage.node_ids(0) == []
@@ -0,0 +1,80 @@
+import falcon
+import pytest
+from falcon import testing
+
+from chitty.storage import MemoryBackend
+from chitty.web.services import Storage, UserPoolManager
+from chitty.web.topics import TopicDirectoryResource
+
+
+@pytest.fixture
+def store():
+    store = Storage(backend=MemoryBackend())
+    counts = {'a': 3, 'b': 1, 'c': 1, 'd': 1, 'e': 0, 'f': 5}
+    store.store.set_topic_subscribers(counts)
+    for i, topic in enumerate(sorted(counts)):
+        store.store.touch_topic(topic, 100.0 + i / 10)
+    return store
+
+
+@pytest.fixture
+def client(store):
+    app = falcon.App()
+    app.add_route('/topics', TopicDirectoryResource(UserPoolManager(store)))
+    return testing.TestClient(app)
+
+
+def pages(client, **params):
+    names, cursor = [], None
+    while True:
+        query = dict(params, cursor=cursor) if cursor else params
+        rv = client.simulate_get('/topics', params=query)
+        assert rv.status_code == 200
+        names.append([topic['name'] for topic in rv.json['topics']])
+        cursor = rv.json['cursor']
+        if cursor is None:
+            return names
+
+
+def test_popular_pages_split_ties(client):
+    assert pages(client, order='popular', limit=2) == [
+        ['f', 'a'],
+        ['d', 'c'],
+        ['b'],
+    ]
+
+
+def test_active_pages(client):
+    assert pages(client, order='active', limit=4) == [
+        ['f', 'e', 'd', 'c'],
+        ['b', 'a'],
+    ]
+
+
+def test_cursor_survives_ranking_change(client, store):
+    rv = client.simulate_get('/topics', params={'order': 'popular', 'limit': 3})
+    assert [topic['name'] for topic in rv.json['topics']] == ['f', 'a', 'd']
+    assert rv.json['topics'][2]['subscribers'] == 1
+    store.store.count_subscribers('f', -5)
+    store.store.count_subscribers('z', 2)
+    rv = client.simulate_get(
+        '/topics', params={'order': 'popular', 'cursor': rv.json['cursor']}
+    )
+    assert [topic['name'] for topic in rv.json['topics']] == ['c', 'b', 'f']
+
+
+def test_name_order_and_prefix(client, store):
+    assert pages(client, order='name', limit=4) == [['a', 'b', 'c', 'd'], ['e', 'f']]
+    store.store.set_topic_subscribers({'ab': 0, 'abc': 0})
+    assert pages(client, prefix='ab', limit=1) == [['ab'], ['abc']]
+
+
+@pytest.mark.parametrize('cursor', ['x:a', 'nan:a', 'inf:a'])
+def test_invalid_cursor(client, cursor):
+    rv = client.simulate_get('/topics', params={'order': 'popular', 'cursor': cursor})
+    assert rv.status_code == 400
+
+
+def test_invalid_order(client):
+    rv = client.simulate_get('/topics', params={'order': 'random'})
+    assert rv.status_code == 400
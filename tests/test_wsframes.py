@@ -0,0 +1,57 @@
+import msgpack
+import pytest
+import trio
+import trio.testing
+from trio_websocket import ConnectionClosed, wrap_client_stream, wrap_server_stream
+
+from chitty import codec, wsframes
+from chitty.message import delivered_message, make_message
+
+
+async def open_pair(nursery):
+    client_stream, server_stream = trio.testing.memory_stream_pair()
+    client_ws = None
+
+    async def connect():
+        nonlocal client_ws
+        client_ws = await wrap_client_stream(nursery, client_stream, "test", "/")
+
+    nursery.start_soon(connect)
+    request = await wrap_server_stream(nursery, server_stream)
+    server_ws = await request.accept()
+    while client_ws is None:
+        await trio.sleep(0)
+    return server_ws, client_ws
+
+
+async def test_send_writes_shared_frame(nursery, mocker):
+    pairs = [await open_pair(nursery) for _ in range(3)]
+    message = make_message({"name": "alice"}, "general", "hi")
+    encode_frame = mocker.spy(wsframes, "encode_frame")
+    formats = [codec.FORMAT_JSON, codec.FORMAT_MSGPACK, codec.FORMAT_JSON]
+    assert all(wsframes.accepts_raw_frames(server) for server, _ in pairs)
+    for (server, _), fmt in zip(pairs, formats):
+        await message.send(server, fmt)
+    assert encode_frame.call_count == 2
+    received = [await client.get_message() for _, client in pairs]
+    assert received[0] == received[2] == message.serialised_payload
+    assert msgpack.unpackb(received[1])["message"] == "hi"
+    await pairs[0][0].send_message("after")
+    assert await pairs[0][1].get_message() == "after"
+
+
+async def test_send_to_closed_connection(nursery):
+    server, _ = await open_pair(nursery)
+    await server.aclose()
+    assert not wsframes.accepts_raw_frames(server)
+    message = make_message({"name": "alice"}, "general", "hi")
+    with pytest.raises(ConnectionClosed):
+        await message.send(server)
+
+
+def test_delivered_message_is_shared():
+    data = make_message({"name": "alice"}, "general", "hi").serialised_payload
+    delivered = delivered_message("general", data)
+    assert delivered_message("general", data) is delivered
+    assert delivered_message("other", data) is not delivered
+    assert delivered.payload["message"] == "hi"